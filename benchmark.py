@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline Benchmark for Intent Detection
+เปรียบเทียบการตั้งค่าต่างๆ ของ IntentDetector กับชุดข้อความตัวอย่าง (ต้องมี OPENAI_API_KEY)
+
+ตัวอย่าง:
+    python benchmark.py intent-output --modes text,function
+    python benchmark.py fallback-mode --modes two_call,single_call
+    python benchmark.py history --budget 300
+    python benchmark.py models --models gpt-3.5-turbo,gpt-4o-mini
+    python benchmark.py normalize            (ไม่เรียก OpenAI)
+    python benchmark.py address              (ไม่เรียก OpenAI)
+    python benchmark.py facts --k 6          (ไม่เรียก OpenAI)
+    python benchmark.py faq                  (ไม่เรียก OpenAI)
+    python benchmark.py examples --k 6       (ไม่เรียก OpenAI)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from typing import Dict, Any, List
+
+from example_bank import ExampleBank
+from fact_index import FactIndex
+from faq import FaqEngine
+from intent_detector import IntentDetector
+from metrics import Metrics
+from model_router import ModelRouter
+from resilience import CircuitBreaker, ResilientCaller
+from text_normalizer import normalize_text
+
+
+# ตัวอย่าง 17 รายการที่เคยใส่ตายตัวใน prompt ของ detect_intent ก่อนมี ExampleBank (ใช้เทียบขนาดใน bench_examples)
+STATIC_FEW_SHOT = """
+ตัวอย่างรูปแบบสำคัญ:
+- "เอาดำ ครีม ฟ้า XL ปลายทางค่ะ" = order_confirm (มีครบ สี+ไซส์+จำนวน)
+- "Lสีโกโก้1ตัวก่อน" = order_confirm (มีครบ ไซส์+สี+จำนวน)
+- "ดำ M 2 ตัว" = order_confirm (มีครบ สี+ไซส์+จำนวน)
+- "ดำ 2 ตัว" = color_with_quantity (สี+จำนวน ไม่มีไซส์)
+- "M" = size_after_color_quantity (ไซส์เดียว หลังแจ้งสี+จำนวนแล้ว)
+- "รับ 2 ตัว 340 ค่าส่ง 30" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
+- "รับ 1 ตัว 180" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
+- "รับ 3 ตัว 490 ส่งฟรี" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
+- "ราคาเท่าไหร่" = price (ถามราคาเฉยๆ ไม่ได้สั่งซื้อ)
+- "มีสีดำไหม" = color_availability (ถามว่ามีสีนั้นไหม)
+- "สีชมพูมีไหมคะ" = color_availability (ถามว่ามีสีนั้นไหม)
+- "ดำ" = color (เลือกสีเดียว ไม่ถาม)
+- "ผ้าบางไหม" = fabric_quality (ถามคุณภาพผ้า)
+- "กี่วันถึง" = shipping (ถามระยะเวลาจัดส่ง)
+- "ขอเปลี่ยนเทาเป็นโกโก้" = order_edit (แก้ไขสีในออเดอร์)
+- "แก้ไขครีมเป็นดำ" = order_edit (แก้ไขออเดอร์ที่สั่งแล้ว)
+- "ปลายทาง" = payment_cod (เลือกเก็บเงินปลายทาง)
+"""
+
+
+def load_samples(file_path: str) -> List[Dict[str, Any]]:
+    """โหลดชุดข้อความตัวอย่าง"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def make_context(sample: Dict[str, Any]) -> Dict[str, Any]:
+    """สร้าง user context จำลองจาก last_intent ของตัวอย่าง"""
+    return {
+        'last_intent': sample.get('last_intent'),
+        'last_message': None,
+        'order_info': {},
+        'manual_mode': False,
+        'conversation_history': []
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """ปิด debug print ของ detector ระหว่างวัดผล"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def print_report(label: str, metrics: Metrics, call_site: str, extra: Dict[str, Any] = None) -> None:
+    """พิมพ์สรุปผลของการตั้งค่าหนึ่งชุด"""
+    snapshot = metrics.snapshot()
+    counters = snapshot['counters']
+    observations = snapshot['observations']
+    latency = observations.get(f"{call_site}.latency_ms", {})
+    completion = observations.get(f"{call_site}.completion_tokens", {})
+    prompt = observations.get(f"{call_site}.prompt_tokens", {})
+
+    print(f"▶ {label}")
+    print(f"   calls={int(counters.get(f'{call_site}.calls', 0))} "
+          f"errors={int(counters.get(f'{call_site}.errors', 0))} "
+          f"parse_failures={int(counters.get(f'{call_site}.parse_failures', 0))}")
+    print(f"   latency avg={latency.get('avg', 0):.0f}ms p95={latency.get('p95') or 0:.0f}ms")
+    print(f"   tokens prompt avg={prompt.get('avg', 0):.0f} completion avg={completion.get('avg', 0):.1f}")
+    for key, value in (extra or {}).items():
+        print(f"   {key}={value}")
+
+
+def bench_intent_output(args, samples: List[Dict[str, Any]]) -> None:
+    """เปรียบเทียบ intent_output_mode (text / json_schema / function)"""
+    for mode in args.modes.split(','):
+        metrics = Metrics()
+        detector = IntentDetector(args.api_key, intent_output_mode=mode,
+                                  include_reason=args.include_reason, metrics=metrics)
+        correct = 0
+        for sample in samples:
+            with quiet():
+                result = detector.detect_intent(sample['text'], make_context(sample))
+            if result.intent == sample.get('expected'):
+                correct += 1
+        print_report(f"mode={mode} reason={args.include_reason}", metrics, "detect_intent",
+                     {'accuracy': f"{correct}/{len(samples)}"})
+
+
+def bench_fallback_mode(args, samples: List[Dict[str, Any]]) -> None:
+    """เปรียบเทียบ latency ของ process_message ระหว่าง two_call และ single_call"""
+    for mode in args.modes.split(','):
+        metrics = Metrics()
+        detector = IntentDetector(args.api_key, intent_output_mode=args.output_mode,
+                                  include_reason=False, metrics=metrics, fallback_mode=mode)
+        for index, sample in enumerate(samples):
+            user_id = f"bench_{index}"
+            detector.user_contexts[user_id] = make_context(sample)
+            started = time.perf_counter()
+            with quiet():
+                result = detector.process_message(sample['text'], user_id=user_id)
+            elapsed = (time.perf_counter() - started) * 1000
+            path = "fallback_path" if result['used_intent'] == 'smart_fallback' else "intent_path"
+            metrics.observe(f"process_message.{path}_ms", elapsed)
+
+        observations = metrics.snapshot()['observations']
+        intent_path = observations.get("process_message.intent_path_ms", {})
+        fallback_path = observations.get("process_message.fallback_path_ms", {})
+        print_report(f"fallback_mode={mode}", metrics, "detect_intent", {
+            'intent_path': f"n={intent_path.get('count', 0)} avg={intent_path.get('avg', 0):.0f}ms p95={intent_path.get('p95') or 0:.0f}ms",
+            'fallback_path': f"n={fallback_path.get('count', 0)} avg={fallback_path.get('avg', 0):.0f}ms p95={fallback_path.get('p95') or 0:.0f}ms",
+            'smart_fallback_calls': int(metrics.counters.get('smart_fallback.calls', 0)),
+        })
+
+
+def bench_history(args, samples: List[Dict[str, Any]]) -> None:
+    """เปรียบเทียบ prompt tokens และ latency ของ detect_intent ระหว่าง history แบบเต็มและแบบ compact"""
+    conversations = load_samples(args.conversations)
+    for compact in (False, True):
+        metrics = Metrics()
+        detector = IntentDetector(args.api_key, intent_output_mode=args.output_mode, include_reason=False,
+                                  metrics=metrics, compact_history=compact, history_token_budget=args.budget)
+        for conversation in conversations:
+            user_id = f"bench_{conversation['name']}"
+            for text in conversation['messages']:
+                with quiet():
+                    detector.process_message(text, user_id=user_id)
+
+        history = metrics.snapshot()['observations'].get("detect_intent.history_tokens_est", {})
+        label = f"compact_history=True budget={args.budget}" if compact else "compact_history=False"
+        print_report(label, metrics, "detect_intent", {
+            'history_tokens_est': f"avg={history.get('avg', 0):.0f} max={history.get('max', 0):.0f}",
+        })
+
+
+def bench_models(args, samples: List[Dict[str, Any]]) -> None:
+    """เปรียบเทียบ model ของ call site หนึ่ง (ใช้ max_tokens/temperature/timeout จาก --routes ถ้ามี)"""
+    for model in args.models.split(','):
+        metrics = Metrics()
+        router = ModelRouter(args.routes, metrics=metrics)
+        router.route(args.call_site).models = [model]  # ไม่ใช้ model สำรอง เพื่อวัดผลของ model นี้อย่างเดียว
+        detector = IntentDetector(args.api_key, intent_output_mode=args.output_mode, include_reason=False,
+                                  metrics=metrics, model_router=router, faq_answers=False)
+        correct = 0
+        for sample in samples:
+            with quiet():
+                if args.call_site == 'detect_intent':
+                    correct += detector.detect_intent(sample['text'], make_context(sample)).intent == sample.get('expected')
+                else:
+                    detector._generate_smart_fallback(sample['text'])
+        extra = {'accuracy': f"{correct}/{len(samples)}"} if args.call_site == 'detect_intent' else {}
+        print_report(f"{args.call_site} model={model}", metrics, args.call_site, extra)
+
+
+def bench_normalize(args, samples: List[Dict[str, Any]]) -> None:
+    """นับข้อความที่ rules ตัดสินได้เองโดยไม่ต้องใช้ GPT เมื่อปิด/เปิด normalize_messages
+
+    เปิด circuit breaker ค้างไว้ detector จึงทำงานแบบ degraded (ใช้ rules อย่างเดียว ไม่เรียก OpenAI)
+    """
+    resolved_by_mode = {}
+    for normalize in (False, True):
+        metrics = Metrics()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=float('inf'), metrics=metrics)
+        breaker.record_failure()
+        detector = IntentDetector("offline", metrics=metrics, normalize_messages=normalize,
+                                  resilience=ResilientCaller(breaker=breaker, metrics=metrics))
+        resolved, correct = set(), 0
+        for index, sample in enumerate(samples):
+            user_id = f"bench_{index}"
+            detector.user_contexts[user_id] = make_context(sample)
+            with quiet():
+                result = detector.process_message(sample['text'], user_id=user_id)
+            if result['used_intent'] != 'smart_fallback':
+                resolved.add(index)
+            if result['used_intent'] == sample.get('expected'):
+                correct += 1
+        resolved_by_mode[normalize] = resolved
+        print(f"▶ normalize_messages={normalize}")
+        print(f"   resolved_without_gpt={len(resolved)}/{len(samples)} accuracy={correct}/{len(samples)}")
+
+    gained = sorted(resolved_by_mode[True] - resolved_by_mode[False])
+    print(f"➕ {len(gained)} extra messages resolved without GPT")
+    for index in gained:
+        print(f"   {samples[index]['text']!r}")
+
+
+def bench_address(args, samples: List[Dict[str, Any]]) -> None:
+    """วัดความแม่นยำ (address_received / address_incomplete) และเวลาต่อข้อความของ _analyze_address"""
+    detector = IntentDetector("offline")
+    messages = [sample['text'] for sample in samples]  # _analyze_address รับข้อความเดิมของลูกค้า
+    correct = 0
+    for sample, message in zip(samples, messages):
+        info = detector._analyze_address(message)
+        complete = info['has_name'] and info['has_address'] and info['has_phone']
+        predicted = "address_received" if complete else "address_incomplete"
+        if predicted == sample['expected']:
+            correct += 1
+        else:
+            print(f"   ✗ expected={sample['expected']} issue={info.get('address_issue') or '-'} {sample['text']!r}")
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for message in messages:
+            detector._analyze_address(message)
+    per_message = (time.perf_counter() - started) / (args.rounds * len(messages)) * 1_000_000
+    print(f"▶ accuracy={correct}/{len(samples)} avg={per_message:.1f}µs/message ({args.rounds} rounds)")
+
+
+def bench_facts(args, samples: List[Dict[str, Any]]) -> None:
+    """วัด recall@k ของการค้นข้อเท็จจริงใน business_context, ขนาด prompt ของ smart fallback (ทั้งหมด vs top-k) และเวลาค้นหา"""
+    index = FactIndex(args.context)
+    hits = 0
+    for sample in samples:
+        facts = index.search(sample['text'], args.k)
+        if any(fact.startswith((sample['expected'] + ':', sample['expected'] + ' >')) for fact in facts):
+            hits += 1
+        else:
+            print(f"   ✗ expected={sample['expected']} {sample['text']!r} -> {[fact.split(':')[0] for fact in facts]}")
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for sample in samples:
+            index.search(sample['text'], args.k)
+    per_query = (time.perf_counter() - started) / (args.rounds * len(samples)) * 1_000_000
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = IntentDetector("offline", context_file=args.context, fallback_top_facts=0)
+        top_k = IntentDetector("offline", context_file=args.context, fallback_top_facts=args.k)
+    full_tokens = sum(full._estimate_tokens(full._build_smart_fallback_prompt(s['text'])) for s in samples) / len(samples)
+    top_k_tokens = sum(top_k._estimate_tokens(top_k._build_smart_fallback_prompt(s['text'])) for s in samples) / len(samples)
+    print(f"▶ {len(index.facts)} facts recall@{args.k}={hits}/{len(samples)} avg={per_query:.1f}µs/query")
+    print(f"▶ smart_fallback prompt ≈{full_tokens:.0f} tokens (all facts) -> ≈{top_k_tokens:.0f} tokens (top {args.k})")
+
+
+def bench_examples(args, samples: List[Dict[str, Any]]) -> None:
+    """วัดว่าตัวอย่าง k รายการที่เลือกมีตัวอย่างของ intent ที่ถูกต้องไหม ขนาดส่วนตัวอย่างใน prompt และเวลาเลือก"""
+    with quiet():
+        detector = IntentDetector("offline", examples_file=args.examples, few_shot_examples=args.k)
+        everything = IntentDetector("offline", examples_file=args.examples, few_shot_examples=len(detector.example_bank.examples))
+    bank: ExampleBank = detector.example_bank
+    intents = [intent for intent in detector.replies if intent != 'fallback']
+    cases = []
+    for sample in samples:
+        stage = detector.order_flow.stage_for(make_context(sample))
+        cases.append((normalize_text(sample['text']), stage, detector.order_flow.candidates(stage, intents)))
+
+    hits = nearest = 0
+    for sample, (message, stage, candidates) in zip(samples, cases):
+        selected = [example['intent'] for example in bank.select(message, stage.name, candidates, args.k)]
+        hits += sample['expected'] in selected
+        nearest += bool(selected) and selected[0] == sample['expected']
+        if sample['expected'] not in selected:
+            print(f"   ✗ expected={sample['expected']} stage={stage.name} {sample['text']!r} -> {selected}")
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for message, stage, candidates in cases:
+            bank.select(message, stage.name, candidates, args.k)
+    per_message = (time.perf_counter() - started) / (args.rounds * len(cases)) * 1_000_000
+
+    all_tokens = sum(detector._estimate_tokens(everything._few_shot_examples(m, st, c)) for m, st, c in cases) / len(cases)
+    top_k_tokens = sum(detector._estimate_tokens(detector._few_shot_examples(m, st, c)) for m, st, c in cases) / len(cases)
+    print(f"▶ {len(bank.examples)} examples expected-in-top{args.k}={hits}/{len(samples)} "
+          f"nearest-correct={nearest}/{len(samples)} avg={per_message:.1f}µs/message")
+    static_tokens = detector._estimate_tokens(STATIC_FEW_SHOT)
+    print(f"▶ examples in prompt ≈{static_tokens} tokens (static 17) -> ≈{all_tokens:.0f} tokens (all matching) "
+          f"-> ≈{top_k_tokens:.0f} tokens (top {args.k})")
+
+
+def bench_faq(args, samples: List[Dict[str, Any]]) -> None:
+    """วัด hit rate / ความแม่นยำของ FAQ (expected=null คือคำถามที่ต้องส่งต่อให้ smart fallback) และเวลาต่อข้อความ"""
+    with open(args.context, 'r', encoding='utf-8') as f:
+        engine = FaqEngine(json.load(f), min_score=args.min_score)
+    hits = wrong = 0
+    for sample in samples:
+        entry = engine.match(sample['text'])
+        answered = entry['id'] if entry else None
+        hits += answered is not None
+        if answered != sample['expected']:
+            wrong += answered is not None
+            print(f"   ✗ expected={sample['expected']} got={answered} {sample['text']!r}")
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for sample in samples:
+            engine.score(sample['text'])
+    per_message = (time.perf_counter() - started) / (args.rounds * len(samples)) * 1_000_000
+    answerable = sum(1 for sample in samples if sample['expected'])
+    print(f"▶ {len(engine.entries)} FAQ hit_rate={hits}/{len(samples)} (answerable {answerable}) "
+          f"wrong_answers={wrong} avg={per_message:.1f}µs/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IntentDetector configurations")
+    parser.add_argument('--samples', help="ไฟล์ข้อความตัวอย่าง (ค่าเริ่มต้นขึ้นกับคำสั่ง)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    intent_output = subparsers.add_parser('intent-output', help="เปรียบเทียบ structured output modes")
+    intent_output.add_argument('--modes', default='text,function', help="คั่นด้วย comma")
+    intent_output.add_argument('--include-reason', action='store_true', help="ให้ GPT ตอบเหตุผลด้วย")
+    intent_output.set_defaults(handler=bench_intent_output)
+
+    fallback_mode = subparsers.add_parser('fallback-mode', help="เปรียบเทียบ two_call กับ single_call")
+    fallback_mode.add_argument('--modes', default='two_call,single_call', help="คั่นด้วย comma")
+    fallback_mode.add_argument('--output-mode', default='function', help="intent_output_mode ที่ใช้")
+    fallback_mode.set_defaults(handler=bench_fallback_mode)
+
+    history = subparsers.add_parser('history', help="เปรียบเทียบ history แบบเต็มกับแบบ compact")
+    history.add_argument('--conversations', default='benchmark_conversations.json', help="ไฟล์บทสนทนาตัวอย่าง")
+    history.add_argument('--budget', type=int, default=300, help="history_token_budget")
+    history.add_argument('--output-mode', default='function', help="intent_output_mode ที่ใช้")
+    history.set_defaults(handler=bench_history)
+
+    models = subparsers.add_parser('models', help="เปรียบเทียบความแม่นยำ/latency/token ของแต่ละ model")
+    models.add_argument('--models', default='gpt-3.5-turbo,gpt-4o-mini', help="คั่นด้วย comma")
+    models.add_argument('--call-site', default='detect_intent', choices=['detect_intent', 'smart_fallback'])
+    models.add_argument('--routes', default='model_routes.json', help="ไฟล์ routes ที่ใช้ค่า max_tokens/temperature/timeout")
+    models.add_argument('--output-mode', default='function', help="intent_output_mode ที่ใช้")
+    models.set_defaults(handler=bench_models)
+
+    normalize = subparsers.add_parser('normalize', help="เปรียบเทียบ rules ก่อน/หลัง normalize ข้อความ (ออฟไลน์)")
+    normalize.set_defaults(handler=bench_normalize, offline=True, default_samples='benchmark_noisy_messages.json')
+
+    address = subparsers.add_parser('address', help="ความแม่นยำและความเร็วของการแยกชื่อ/ที่อยู่/เบอร์โทร (ออฟไลน์)")
+    address.add_argument('--rounds', type=int, default=200, help="จำนวนรอบที่ใช้จับเวลา")
+    address.set_defaults(handler=bench_address, offline=True, default_samples='benchmark_addresses.json')
+
+    facts = subparsers.add_parser('facts', help="ความแม่นยำ/ความเร็วของการค้นข้อมูลร้านสำหรับ smart fallback (ออฟไลน์)")
+    facts.add_argument('--context', default='business_context.json', help="ไฟล์ข้อมูลธุรกิจ")
+    facts.add_argument('--k', type=int, default=6, help="จำนวนข้อเท็จจริงที่ใส่ใน prompt")
+    facts.add_argument('--rounds', type=int, default=200, help="จำนวนรอบที่ใช้จับเวลา")
+    facts.set_defaults(handler=bench_facts, offline=True, default_samples='benchmark_questions.json')
+
+    faq = subparsers.add_parser('faq', help="hit rate และความแม่นยำของการตอบ FAQ โดยไม่เรียก GPT (ออฟไลน์)")
+    faq.add_argument('--context', default='business_context.json', help="ไฟล์ข้อมูลธุรกิจ")
+    faq.add_argument('--min-score', type=float, default=0.6, help="คะแนนขั้นต่ำที่ตอบด้วย FAQ")
+    faq.add_argument('--rounds', type=int, default=200, help="จำนวนรอบที่ใช้จับเวลา")
+    faq.set_defaults(handler=bench_faq, offline=True, default_samples='benchmark_faq.json')
+
+    examples = subparsers.add_parser('examples', help="ความแม่นยำ/ความเร็วของการเลือก few-shot examples (ออฟไลน์)")
+    examples.add_argument('--examples', default='intent_examples.json', help="ไฟล์ตัวอย่าง intent")
+    examples.add_argument('--k', type=int, default=6, help="จำนวนตัวอย่างที่ใส่ใน prompt")
+    examples.add_argument('--rounds', type=int, default=200, help="จำนวนรอบที่ใช้จับเวลา")
+    examples.set_defaults(handler=bench_examples, offline=True, default_samples='benchmark_messages.json')
+
+    args = parser.parse_args()
+    args.api_key = os.getenv('OPENAI_API_KEY')
+    if not args.api_key and not getattr(args, 'offline', False):
+        print("❌ OPENAI_API_KEY is required for benchmarking")
+        sys.exit(1)
+
+    args.samples = args.samples or getattr(args, 'default_samples', 'benchmark_messages.json')
+    samples = load_samples(args.samples)
+    print(f"📊 {len(samples)} samples from {args.samples}")
+    args.handler(args, samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import itertools
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class _OrderedUserSet:
+    """ชุด user_id เรียงตามลำดับที่เข้ามา รองรับ cursor pagination โดยไม่ต้องไล่จากต้น
+
+    เก็บ log แบบ append-only (seq, user_id) คู่กับ dict ของรายการที่ยังอยู่
+    การลบเป็นแบบ lazy และจะ compact log เมื่อมีรายการที่ถูกลบมากเกินไป
+    """
+
+    def __init__(self):
+        self._seqs: List[int] = []
+        self._users: List[str] = []
+        self._live: Dict[str, Tuple[int, float]] = {}  # user_id -> (seq, timestamp)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._live
+
+    def add(self, user_id: str, seq: int, timestamp: float) -> None:
+        self._live[user_id] = (seq, timestamp)
+        self._seqs.append(seq)
+        self._users.append(user_id)
+
+    def discard(self, user_id: str) -> None:
+        if self._live.pop(user_id, None) is not None:
+            self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if len(self._seqs) <= 2 * len(self._live) + 64:
+            return
+        live = [(seq, user_id) for seq, user_id in zip(self._seqs, self._users) if self._live.get(user_id, (None,))[0] == seq]
+        self._seqs = [seq for seq, _ in live]
+        self._users = [user_id for _, user_id in live]
+
+    def page(self, cursor: int, limit: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """คืนรายการถัดจาก cursor ไม่เกิน limit และ cursor ของหน้าถัดไป (None ถ้าหมดแล้ว)"""
+        items = []
+        index = bisect_right(self._seqs, cursor)
+        # ดึงเกินมา 1 รายการเพื่อรู้ว่ายังมีหน้าถัดไปหรือไม่
+        while index < len(self._seqs) and len(items) <= limit:
+            seq, user_id = self._seqs[index], self._users[index]
+            live = self._live.get(user_id)
+            if live and live[0] == seq:
+                items.append({'user_id': user_id, 'since': live[1], 'cursor': seq})
+            index += 1
+        if len(items) > limit:
+            items = items[:limit]
+            return items, items[-1]['cursor'] if items else cursor
+        return items, None
+
+
+class ContextIndex:
+    """Secondary indexes ของ user_contexts อัพเดททีละรายการเมื่อสถานะเปลี่ยน
+
+    - manual: ลูกค้าที่รอแอดมิน (manual_mode=True)
+    - by_intent: ลูกค้าจัดกลุ่มตาม last_intent (เช่น address_incomplete)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self.manual = _OrderedUserSet()
+        self.by_intent: Dict[str, _OrderedUserSet] = {}
+        self._intent_of: Dict[str, str] = {}
+
+    def set_manual(self, user_id: str, enabled: bool) -> None:
+        with self._lock:
+            if enabled and user_id not in self.manual:
+                self.manual.add(user_id, next(self._seq), time.time())
+            elif not enabled:
+                self.manual.discard(user_id)
+
+    def set_intent(self, user_id: str, intent: Optional[str]) -> None:
+        """ย้าย user ไปกลุ่มของ intent ใหม่ (เวลาใน 'since' คือเวลาที่เข้าสู่ intent นั้น)"""
+        with self._lock:
+            previous = self._intent_of.get(user_id)
+            if previous == intent:
+                return
+            if previous is not None:
+                self.by_intent[previous].discard(user_id)
+            if intent is None:
+                self._intent_of.pop(user_id, None)
+                return
+            self._intent_of[user_id] = intent
+            self.by_intent.setdefault(intent, _OrderedUserSet()).add(user_id, next(self._seq), time.time())
+
+    def remove_user(self, user_id: str) -> None:
+        self.set_manual(user_id, False)
+        self.set_intent(user_id, None)
+
+    def list_manual(self, cursor: int = 0, limit: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            items, next_cursor = self.manual.page(cursor, limit)
+            return {'total': len(self.manual), 'items': items, 'next_cursor': next_cursor}
+
+    def list_intent(self, intent: str, cursor: int = 0, limit: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            users = self.by_intent.get(intent)
+            if users is None:
+                return {'total': 0, 'items': [], 'next_cursor': None}
+            items, next_cursor = users.page(cursor, limit)
+            return {'total': len(users), 'items': items, 'next_cursor': next_cursor}
+
+    def manual_user_ids(self) -> List[str]:
+        with self._lock:
+            return list(self.manual._live)
+
+    def intent_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {intent: len(users) for intent, users in self.by_intent.items() if len(users)}
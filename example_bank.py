@@ -0,0 +1,132 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from fact_index import query_ngrams
+
+
+class ExampleBank:
+    """ตัวอย่างข้อความ -> intent สำหรับใส่ใน prompt ของ detect_intent (few-shot) เลือกเฉพาะที่คล้ายข้อความลูกค้า
+
+    เทียบ n-gram ของตัวอักษร (cosine ถ่วงน้ำหนักด้วย idf) ทำงานออฟไลน์
+    โหลดไฟล์ใหม่เองเมื่อถูกแก้ไข (ตรวจ mtime ไม่เกินทุก check_interval วินาที)
+
+    รูปแบบไฟล์ intent_examples.json:
+    {
+      "examples": [
+        {"text": "ดำ M 2 ตัว", "intent": "order_confirm", "note": "มีครบ สี+ไซส์+จำนวน"},
+        {"text": "M", "intent": "size_after_color_quantity", "stages": ["color_quantity"]}
+      ]
+    }
+    stages (ไม่บังคับ): ใช้ตัวอย่างเฉพาะเมื่อลูกค้าอยู่ในขั้นตอนเหล่านี้ของ order_flow (ไม่ระบุ = ทุกขั้นตอน)
+    """
+
+    def __init__(self, file_path: str, min_similarity: float = 0.15, check_interval: float = 5.0):
+        self.file_path = file_path
+        self.min_similarity = min_similarity  # ตัวอย่างที่คล้ายน้อยกว่านี้ไม่ช่วย GPT และเปลือง token
+        self.check_interval = check_interval
+        self.examples: List[Dict[str, Any]] = []
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._build(self._load() or [])
+
+    def _load(self) -> Optional[List[Dict[str, Any]]]:
+        """โหลดไฟล์ คืน None ถ้า JSON เสีย (เช่นกำลังแก้ไฟล์อยู่)"""
+        try:
+            self._mtime = os.stat(self.file_path).st_mtime_ns
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('examples', [])
+        except FileNotFoundError:
+            print(f"Info: {self.file_path} not found. Running without few-shot examples.")
+            return []
+        except json.JSONDecodeError as e:
+            print(f"Warning: {self.file_path} is not valid JSON: {e}")
+            return None
+
+    def _build(self, examples: List[Dict[str, Any]]) -> None:
+        """คำนวณ n-gram และน้ำหนัก idf ของทุกตัวอย่าง"""
+        examples = [example for example in examples if example.get('text') and example.get('intent')]
+        grams = [set(query_ngrams(example['text'])) for example in examples]
+        document_frequency: Dict[str, int] = {}
+        for example_grams in grams:
+            for gram in example_grams:
+                document_frequency[gram] = document_frequency.get(gram, 0) + 1
+        count = len(examples)
+        idf = {gram: math.log(1 + count / df) for gram, df in document_frequency.items()}
+        vectors = [(example_grams, math.sqrt(sum(idf[gram] ** 2 for gram in example_grams)))
+                   for example_grams in grams]
+        # แทนที่ทั้งชุดในครั้งเดียว thread ที่กำลังเลือกตัวอย่างอยู่ใช้ชุดเดิมต่อได้
+        self._index = (examples, vectors, idf, math.log(1 + count) if count else 1.0)
+        self.examples = examples
+
+    def refresh(self) -> bool:
+        """โหลดใหม่ถ้าไฟล์เปลี่ยน คืน True เมื่อโหลดใหม่"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.file_path).st_mtime_ns
+            except FileNotFoundError:
+                return False
+            if mtime == self._mtime:
+                return False
+            examples = self._load()
+            if examples is None:
+                return False  # ใช้ชุดเดิมจนกว่าไฟล์จะถูกแก้ให้ถูกต้อง
+            self._build(examples)
+        print(f"Reloaded {len(self.examples)} intent examples from {self.file_path}")
+        return True
+
+    def select(self, message: str, stage: str, intents: List[str], k: int = 6) -> List[Dict[str, Any]]:
+        """ตัวอย่าง k รายการที่คล้ายข้อความที่สุด เฉพาะ intent ที่เลือกได้และใช้กับขั้นตอน stage (ไม่รวมที่คล้ายน้อยกว่า min_similarity)"""
+        examples, vectors, idf, unknown_weight = self._index
+        grams = set(query_ngrams(message))
+        if not grams or k <= 0:
+            return []
+        # n-gram ที่ไม่มีในตัวอย่างไหนเลยยังนับในความยาวของข้อความ (ข้อความยาวที่คล้ายแค่บางส่วนได้คะแนนต่ำ)
+        norm = math.sqrt(sum(idf.get(gram, unknown_weight) ** 2 for gram in grams))
+        allowed = set(intents)
+        scored = []
+        for index, (example_grams, example_norm) in enumerate(vectors):
+            example = examples[index]
+            if example['intent'] not in allowed or (example.get('stages') and stage not in example['stages']):
+                continue
+            similarity = sum(idf[gram] ** 2 for gram in grams & example_grams) / (norm * example_norm)
+            if similarity >= self.min_similarity:
+                scored.append((similarity, index))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [examples[index] for _, index in scored[:k]]
+
+    def add(self, text: str, intent: str, stages: List[str] = None, note: str = None) -> Dict[str, Any]:
+        """เพิ่มตัวอย่างลงไฟล์ (ข้อความเดิมที่มีอยู่แล้วจะถูกแทนที่ ใช้แก้ตัวอย่างที่ผิด) และใช้ทันที"""
+        example = {'text': text.strip(), 'intent': intent}
+        if stages:
+            example['stages'] = list(stages)
+        if note:
+            example['note'] = note
+        with self._lock:
+            try:
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {'examples': []}
+            key = query_ngrams(example['text'])
+            examples = [item for item in data.get('examples', []) if query_ngrams(item.get('text', '')) != key]
+            examples.append(example)
+            data['examples'] = examples
+            # เขียนไฟล์ชั่วคราวแล้วแทนที่ ไม่ให้ refresh ของ thread อื่นอ่านเจอไฟล์ที่เขียนไม่เสร็จ
+            temp_path = f"{self.file_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False, indent=2) + "\n")
+            os.replace(temp_path, self.file_path)
+            self._mtime = os.stat(self.file_path).st_mtime_ns
+            self._build(examples)
+        return example
@@ -0,0 +1,189 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from text_normalizer import normalize_text
+
+# คำไทยที่ลูกค้ามักใช้ถามถึงข้อมูลแต่ละ key (ช่วยให้ค้นเจอเมื่อคำถามไม่ตรงกับคำในข้อมูล)
+KEY_HINTS = {
+    "name": "ชื่อร้าน",
+    "description": "รายละเอียด สินค้า",
+    "products": "สินค้า",
+    "price": "ราคา เท่าไหร่",
+    "features": "จุดเด่น คุณสมบัติ ผ้า",
+    "material": "ผ้า เนื้อผ้า วัสดุ หนา บาง ร้อน",
+    "care_instructions": "ซัก ดูแล สีตก",
+    "made_in": "ผลิตที่ไหน ผลิต ประเทศ",
+    "pregnancy_period": "อายุครรภ์ ท้องกี่เดือน ใส่ได้ถึง ตั้งครรภ์",
+    "usage_occasions": "ใส่ทำงาน ออกงาน ใส่นอน ใส่ไปไหน",
+    "postpartum_use": "หลังคลอด คลอดแล้ว",
+    "colors": "สี มีสี สีไหน",
+    "sizes": "ไซส์ ขนาด",
+    "size_chart": "ไซส์ เอว ขนาด รอบเอว",
+    "pricing": "ราคา ค่าส่ง ส่งฟรี โปร กี่บาท เท่าไหร่",
+    "services": "บริการ",
+    "policies": "นโยบาย",
+    "shipping": "ส่ง จัดส่ง กี่วันถึง ขนส่ง ไปรษณีย์",
+    "return": "เปลี่ยน คืน เปลี่ยนไซส์",
+    "payment": "จ่ายเงิน จ่ายยังไง ชำระ ช่องทาง โอน ปลายทาง",
+    "location": "ร้านอยู่ที่ไหน ที่ตั้ง หน้าร้าน ส่งจากไหน",
+    "bank_account": "เลขบัญชี บัญชี โอน ธนาคาร",
+    "working_hours": "เวลาทำการ เปิดกี่โมง วันหยุด ส่งทุกวัน",
+}
+
+_NON_WORD = re.compile(r'[\s\W_]+')
+# คำถาม/คำลงท้ายท้ายประโยคที่มีในเกือบทุกคำถาม ตัดออกก่อนค้นหา
+_QUESTION_WORDS = re.compile(r'(?:ไหม|มั้ย|มั๊ย|หรือเปล่า|ป่าว|หรอ|บ้าง|อะไร|ยังไง|คะ|ค่ะ|ค่า|ครับ|คับ|จ้า|นะ)+(?=\s|$)')
+_MAX_INLINE_CHARS = 120  # dict/list ของค่าเดี่ยวที่สั้นกว่านี้รวมเป็นข้อเท็จจริงเดียว
+
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = (2, 3)) -> List[str]:
+    """แบ่งข้อความ (ที่ normalize แล้ว) เป็น n-gram ของตัวอักษร (ภาษาไทยไม่มีช่องว่างระหว่างคำ จึงไม่ตัดคำ)"""
+    grams = []
+    for chunk in _NON_WORD.split(text):
+        if len(chunk) < min(sizes):
+            if chunk:
+                grams.append(chunk)
+            continue
+        for size in sizes:
+            grams.extend(chunk[i:i + size] for i in range(len(chunk) - size + 1))
+    return grams
+
+
+def query_ngrams(query: str) -> List[str]:
+    """n-gram ของคำถามลูกค้า (normalize และตัดคำถาม/คำลงท้ายท้ายประโยคออกก่อน)"""
+    return char_ngrams(_QUESTION_WORDS.sub(' ', normalize_text(query)))
+
+
+def _is_scalar(value: Any) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def flatten_facts(data: Any, path: Tuple[str, ...] = ()) -> List[Tuple[Tuple[str, ...], str, str]]:
+    """แตก JSON เป็นข้อเท็จจริงสั้นๆ [(keys, "a > b: ค่า", ค่า)]
+
+    dict/list ที่มีแต่ค่าเดี่ยวและสั้นรวมเป็นข้อเท็จจริงเดียว (เช่น pricing.1_piece, colors)
+    list ของ dict ใช้ name ของแต่ละรายการเป็นส่วนหนึ่งของ path
+    """
+    label = " > ".join(path)
+    if _is_scalar(data):
+        return [(path, f"{label}: {data}", str(data))]
+    if isinstance(data, list):
+        if all(_is_scalar(item) for item in data):
+            value = ", ".join(str(item) for item in data)
+            return [(path, f"{label}: {value}", value)]
+        facts = []
+        for index, item in enumerate(data):
+            name = item.get('name', str(index)) if isinstance(item, dict) else str(index)
+            facts.extend(flatten_facts(item, path + (name,)))
+        return facts
+    if isinstance(data, dict):
+        if path and all(_is_scalar(value) for value in data.values()):
+            inline = ", ".join(f"{key}={value}" for key, value in data.items())
+            if len(inline) <= _MAX_INLINE_CHARS:
+                return [(path, f"{label}: {inline}", " ".join(str(value) for value in data.values()))]
+        facts = []
+        for key, value in data.items():
+            facts.extend(flatten_facts(value, path + (key,)))
+        return facts
+    return []
+
+
+class FactIndex:
+    """ค้นหาข้อเท็จจริงใน business_context ที่เกี่ยวกับคำถามด้วย BM25 บน n-gram ของตัวอักษร (ทำงานออฟไลน์)
+
+    สร้าง index ใหม่เองเมื่อไฟล์ถูกแก้ไข (ตรวจ mtime ไม่เกินทุก check_interval วินาที)
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, file_path: str, section: str = "business_info", check_interval: float = 5.0):
+        self.file_path = file_path
+        self.section = section
+        self.check_interval = check_interval
+        self.data: Dict[str, Any] = {}
+        self.facts: List[str] = []
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._build(self._load() or {})
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        """โหลดไฟล์ คืน None ถ้า JSON เสีย (เช่นกำลังแก้ไฟล์อยู่)"""
+        try:
+            self._mtime = os.stat(self.file_path).st_mtime_ns
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            print(f"Info: {self.file_path} not found. Running without business context.")
+            return {}
+        except json.JSONDecodeError as e:
+            print(f"Warning: {self.file_path} is not valid JSON: {e}")
+            return None
+
+    def _build(self, data: Dict[str, Any]) -> None:
+        """แตกข้อเท็จจริงและสร้าง inverted index (n-gram -> [(fact_id, tf)])"""
+        facts, postings, lengths = [], {}, []
+        for keys, text, value in flatten_facts(data.get(self.section, {})):
+            # index เฉพาะค่าและคำใบ้ของ key (ไม่รวมชื่อ key ภาษาอังกฤษที่ลูกค้าไม่ได้ใช้ถาม)
+            hints = " ".join(KEY_HINTS.get(key, "") for key in keys)
+            counts = Counter(char_ngrams(normalize_text(f"{value} {hints}")))
+            for gram, tf in counts.items():
+                postings.setdefault(gram, []).append((len(facts), tf))
+            lengths.append(sum(counts.values()))
+            facts.append(text)
+
+        count = len(facts)
+        # แทนที่ทั้งชุดในครั้งเดียว thread ที่กำลังค้นหาอยู่ใช้ชุดเดิมต่อได้
+        self._index = (
+            facts,
+            {gram: (math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)), docs) for gram, docs in postings.items()},
+            lengths,
+            sum(lengths) / count if count else 1.0
+        )
+        self.data = data
+        self.facts = facts
+
+    def refresh(self) -> bool:
+        """สร้าง index ใหม่ถ้าไฟล์เปลี่ยน คืน True เมื่อสร้างใหม่"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.file_path).st_mtime_ns
+            except FileNotFoundError:
+                return False
+            if mtime == self._mtime:
+                return False
+            data = self._load()
+            if data is None:
+                return False  # ใช้ index เดิมจนกว่าไฟล์จะถูกแก้ให้ถูกต้อง
+            self._build(data)
+        print(f"Rebuilt fact index from {self.file_path}: {len(self.facts)} facts")
+        return True
+
+    def search(self, query: str, k: int = 5) -> List[str]:
+        """ข้อเท็จจริง k รายการที่เกี่ยวข้องกับคำถามมากที่สุด (เรียงตามคะแนน ไม่รวมที่ไม่เกี่ยวเลย)"""
+        facts, postings, lengths, average = self._index
+        scores: Dict[int, float] = {}
+        for gram in set(query_ngrams(query)):
+            entry = postings.get(gram)
+            if entry is None:
+                continue
+            idf, docs = entry
+            for fact_id, tf in docs:
+                norm = self.K1 * (1 - self.B + self.B * lengths[fact_id] / average)
+                scores[fact_id] = scores.get(fact_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [facts[fact_id] for fact_id, _ in best]
@@ -0,0 +1,151 @@
+import math
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+from fact_index import query_ngrams
+from metrics import Metrics
+
+# คำถามที่ตอบได้ตรงๆ จากค่าใน business_info: key (หรือ path คั่นด้วยจุด) -> (รูปแบบคำถาม, แม่แบบคำตอบ)
+DERIVED_FAQ = {
+    "material": (("ผ้าอะไร", "เนื้อผ้าเป็นยังไง", "ผ้าร้อนไหม", "ผ้าหนาไหม", "ผ้าบางไหม", "ผ้ายืดไหม"),
+                 "เนื้อผ้าเป็น{value}"),
+    "care_instructions": (("ซักเครื่องได้ไหม", "สีตกไหม", "ซักยังไง", "ดูแลยังไง", "ซักแล้วสีตกไหม"), "{value}"),
+    "made_in": (("ผลิตที่ไหน", "ผลิตในไทยไหม", "ของจีนไหม", "งานไทยไหม"), "{value}"),
+    "pregnancy_period": (("ท้องกี่เดือนใส่ได้", "ท้องแก่ใส่ได้ไหม", "ท้องอ่อนใส่ได้ไหม", "ใส่ได้ถึงกี่เดือน",
+                          "ท้องเดือนใส่ได้ไหม"), "{value}"),
+    "usage_occasions": (("ใส่ทำงานได้ไหม", "ใส่ไปทำงาน", "ใส่ออกงานได้ไหม", "ใส่ไปเที่ยวได้ไหม"), "{value}"),
+    "postpartum_use": (("หลังคลอดใส่ได้ไหม", "คลอดแล้วใส่ได้ไหม", "หลังคลอดยังใส่ได้อยู่ไหม"), "{value}"),
+    "policies.shipping": (("กี่วันถึง", "ส่งกี่วัน", "ส่งขนส่งอะไร", "ส่งไปรษณีย์ไหม", "ได้ของกี่วัน", "กี่วันได้ของ"),
+                          "{value}"),
+    "policies.return": (("เปลี่ยนไซส์ได้ไหม", "ใส่ไม่ได้เปลี่ยนได้ไหม", "คืนสินค้าได้ไหม", "เปลี่ยนของได้ไหม"),
+                        "{value}"),
+    "policies.payment": (("จ่ายยังไง", "ชำระเงินยังไง", "เก็บเงินปลายทางได้ไหม", "มีปลายทางไหม", "โอนได้ไหม"),
+                         "ชำระได้ทาง {value}"),
+    "location": (("ร้านอยู่ที่ไหน", "ส่งจากไหน", "ส่งจากจังหวัดอะไร", "มีหน้าร้านไหม", "ไปรับเองได้ไหม"), "{value}"),
+    "working_hours": (("วันอาทิตย์ส่งไหม", "ส่งทุกวันไหม", "วันหยุดส่งไหม", "ร้านเปิดกี่โมง"), "{value}"),
+}
+
+_POLITE_ENDINGS = ("ค่ะ", "คะ", "ครับ", "ค่า", "จ้า")
+# คำที่ใช้ประกอบคำถามได้ทุกเรื่อง ตัดออกทั้งประโยคก่อนเทียบ (ส่วน fact_index ตัดเฉพาะท้ายประโยค)
+_FILLER_WORDS = re.compile(r'ไหม|มั้ย|มั๊ย|หรือเปล่า|ป่าว|บ้าง|ยังไง|อย่างไร|ได้|ๆ')
+
+
+def _polite(text: str) -> str:
+    text = text.strip()
+    return text if text.endswith(_POLITE_ENDINGS) else f"{text}ค่ะ"
+
+
+def _faq_ngrams(text: str) -> set:
+    return set(query_ngrams(_FILLER_WORDS.sub(' ', text)))
+
+
+def _collect(data: Any, keys: Tuple[str, ...], path: Tuple[str, ...] = ()) -> List[Any]:
+    """ค่าทุกตำแหน่งใน JSON ที่ path ลงท้ายด้วย keys (เช่น material ของสินค้าแต่ละรายการ)"""
+    if path[-len(keys):] == keys:
+        return [data]
+    found = []
+    if isinstance(data, dict):
+        for name, value in data.items():
+            found.extend(_collect(value, keys, path + (name,)))
+    elif isinstance(data, list):
+        for item in data:
+            found.extend(_collect(item, keys, path))
+    return found
+
+
+def derive_faq(context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """รายการ FAQ จาก business_context: คำถามที่ได้จาก DERIVED_FAQ และส่วน "faq" ที่เขียนเอง (id ซ้ำจะแทนที่)
+
+    ส่วน faq: [{"id": "...", "questions": ["...", ...], "answer": "..."}]
+    key ที่มีหลายค่า (เช่น สินค้าหลายรายการ) ไม่สร้าง FAQ เพราะไม่รู้ว่าลูกค้าถามถึงรายการไหน
+    """
+    business_info = context.get('business_info', {})
+    entries: Dict[str, Dict[str, Any]] = {}
+    for key, (questions, template) in DERIVED_FAQ.items():
+        values = _collect(business_info, tuple(key.split('.')))
+        if len(values) != 1 or not isinstance(values[0], (str, list)) or not values[0]:
+            continue
+        value = ", ".join(map(str, values[0])) if isinstance(values[0], list) else values[0]
+        entry_id = key.split('.')[-1]
+        entries[entry_id] = {'id': entry_id, 'questions': list(questions), 'answer': _polite(template.format(value=value))}
+
+    for index, item in enumerate(context.get('faq', [])):
+        if not item.get('questions') or not item.get('answer'):
+            print(f"Warning: skipped faq item {index} without questions/answer")
+            continue
+        entry_id = item.get('id') or f"faq_{index}"
+        entries[entry_id] = {'id': entry_id, 'questions': list(item['questions']), 'answer': item['answer']}
+    return list(entries.values())
+
+
+class FaqEngine:
+    """ตอบคำถามที่พบบ่อยจาก business_context โดยไม่เรียก GPT
+
+    เทียบ n-gram ของตัวอักษรระหว่างข้อความลูกค้ากับรูปแบบคำถามของแต่ละ FAQ (ถ่วงน้ำหนักด้วย idf)
+    คะแนน = ค่าต่ำกว่าระหว่างสัดส่วนของรูปแบบคำถามที่พบในข้อความ กับสัดส่วนของข้อความที่รูปแบบคำถามครอบคลุม
+    ตอบเมื่อคะแนนถึง min_score และทิ้งห่าง FAQ อันดับสองอย่างน้อย min_margin เท่านั้น
+    (ข้อความที่ถามหลายเรื่องหรือมีรายละเอียดอื่นปนจะไม่ผ่าน และไปที่ smart fallback ตามเดิม)
+    """
+
+    def __init__(self, context: Dict[str, Any], min_score: float = 0.6, min_margin: float = 0.15,
+                 metrics: Metrics = None):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.metrics = metrics or Metrics()
+        self.entries = derive_faq(context)
+
+        patterns: List[Tuple[int, set]] = []
+        document_frequency: Dict[str, int] = {}
+        for entry_id, entry in enumerate(self.entries):
+            for question in entry['questions']:
+                grams = _faq_ngrams(question)
+                if grams:
+                    patterns.append((entry_id, grams))
+                    for gram in grams:
+                        document_frequency[gram] = document_frequency.get(gram, 0) + 1
+        count = len(patterns)
+        self._idf = {gram: math.log(1 + count / df) for gram, df in document_frequency.items()}
+        # n-gram ที่ไม่อยู่ในรูปแบบคำถามไหนเลยถือว่าเป็นรายละเอียดที่ FAQ ไม่ได้ตอบ (น้ำหนักสูงสุด)
+        self._unknown_weight = math.log(1 + count) if count else 1.0
+        self._patterns = [(entry_id, grams, sum(self._idf[gram] for gram in grams)) for entry_id, grams in patterns]
+
+    def score(self, message: str) -> List[Tuple[float, Dict[str, Any]]]:
+        """คะแนนสูงสุดของแต่ละ FAQ เรียงจากมากไปน้อย"""
+        grams = _faq_ngrams(message)
+        if not grams:
+            return []
+        message_weight = sum(self._idf.get(gram, self._unknown_weight) for gram in grams)
+        best: Dict[int, float] = {}
+        for entry_id, pattern, pattern_weight in self._patterns:
+            shared = sum(self._idf[gram] for gram in pattern & grams)
+            if not shared:
+                continue
+            score = min(shared / pattern_weight, shared / message_weight)
+            if score > best.get(entry_id, 0.0):
+                best[entry_id] = score
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        return [(score, self.entries[entry_id]) for entry_id, score in ranked]
+
+    def match(self, message: str) -> Optional[Dict[str, Any]]:
+        """FAQ ที่ตอบข้อความนี้ได้อย่างมั่นใจ (None = ให้ smart fallback ตอบ) และนับ hit/miss"""
+        ranked = self.score(message)
+        runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+        if ranked and ranked[0][0] >= self.min_score and ranked[0][0] - runner_up >= self.min_margin:
+            entry = ranked[0][1]
+            self.metrics.incr("faq.hit")
+            self.metrics.incr(f"faq.hit.{entry['id']}")
+            return entry
+        self.metrics.incr("faq.miss")
+        return None
+
+
+def faq_stats(metrics: Metrics) -> Dict[str, Any]:
+    """อัตราที่ FAQ ตอบแทน smart fallback ได้ (จากตัวนับใน metrics)"""
+    counters = metrics.snapshot()['counters']
+    hits, misses = counters.get("faq.hit", 0), counters.get("faq.miss", 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        'by_id': {name[len("faq.hit."):]: value for name, value in counters.items() if name.startswith("faq.hit.")}
+    }
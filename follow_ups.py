@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Hashable, List, Optional, Tuple
+
+from metrics import Metrics
+
+# Messenger ให้ส่งข้อความหาลูกค้าได้ภายใน 24 ชั่วโมงหลังข้อความล่าสุดของลูกค้าเท่านั้น
+MESSAGING_WINDOW_SECONDS = 24 * 3600
+
+
+class TimingWheel:
+    """Hashed timing wheel: ตั้ง/ยกเลิก timer ได้ใน O(1) รองรับ timer ค้างหลายหมื่นรายการ
+
+    แบ่งเวลาเป็นช่องละ tick วินาที วนใช้ slots ช่อง timer ที่ไกลกว่าหนึ่งรอบอยู่ในช่องเดียวกับรอบปัจจุบัน
+    และจะครบกำหนดเมื่อวนมาถึงในรอบที่ deadline ผ่านไปแล้ว (เทียบ deadline ตอนไล่ช่อง)
+    """
+
+    def __init__(self, tick: float = 5.0, slots: int = 4096, now: float = None):
+        self.tick = tick
+        self.slots = slots
+        self._wheel: List[Dict[Hashable, Tuple[float, Any]]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current = int((now if now is not None else time.time()) // tick)  # tick ที่ยังไล่ไม่เสร็จ
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot_of
+
+    def schedule(self, key: Hashable, deadline: float, value: Any = None) -> None:
+        """ตั้ง timer ของ key (แทนที่ timer เดิมของ key เดียวกัน) deadline ที่ผ่านไปแล้วครบกำหนดใน advance ถัดไป"""
+        self.cancel(key)
+        slot = max(int(deadline // self.tick), self._current) % self.slots
+        self._wheel[slot][key] = (deadline, value)
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable) -> bool:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del self._wheel[slot][key]
+        return True
+
+    def advance(self, now: float = None) -> List[Tuple[Hashable, float, Any]]:
+        """ไล่ช่องจนถึงเวลา now คืน timer ที่ครบกำหนด [(key, deadline, value)]"""
+        now = now if now is not None else time.time()
+        target = int(now // self.tick)
+        due = []
+        # ห่างกันเกินหนึ่งรอบ (เช่นหลังเริ่มโปรเซสใหม่) ไล่ทุกช่องครั้งเดียวก็พอ
+        for offset in range(min(max(target - self._current, 0), self.slots)):
+            self._collect((self._current + offset) % self.slots, now, due)
+        self._current = max(self._current, target)
+        # ช่องของ tick ปัจจุบันยังไม่ข้าม timer ที่ deadline อยู่ท้าย tick นี้จะครบในรอบถัดไป
+        self._collect(self._current % self.slots, now, due)
+        return due
+
+    def _collect(self, slot: int, now: float, due: List[Tuple[Hashable, float, Any]]) -> None:
+        timers = self._wheel[slot]
+        if not timers:
+            return
+        for key, (deadline, value) in list(timers.items()):
+            if deadline <= now:
+                del timers[key]
+                del self._slot_of[key]
+                due.append((key, deadline, value))
+
+    def items(self) -> List[Tuple[Hashable, float, Any]]:
+        return [(key, deadline, value) for timers in self._wheel for key, (deadline, value) in timers.items()]
+
+
+class FollowUpScheduler:
+    """ตั้งเวลาส่งข้อความตามลูกค้าที่หยุดกลางขั้นตอนสั่งซื้อ (ลูกค้าละ 1 timer ต่อเพจ)
+
+    - schedule: ลูกค้าเข้าสู่ intent ที่ยังสั่งไม่เสร็จ (ตั้งใหม่ทับของเดิม)
+    - cancel: ลูกค้าตอบต่อ/แอดมินรับเรื่อง
+    - due: timer ที่ครบกำหนด ให้ผู้เรียกส่งข้อความ
+    timer ที่ยังไม่ครบบันทึกลงไฟล์ (save) และโหลดกลับตอนเริ่มโปรเซส (load)
+    timer ที่เลยกำหนดเกิน max_late วินาทีตอนโหลดจะถูกทิ้ง (ลูกค้าคงไม่ได้รอแล้ว)
+
+    timer ที่ยังอยู่แปลว่าลูกค้ายังค้างที่ intent นั้นและไม่ได้อยู่ใน manual mode (ทุกทางที่เปลี่ยนสองอย่างนี้ยกเลิก timer)
+    ไฟล์จึงเก็บสถานะที่ต้องใช้ตรวจก่อนส่งไว้แล้ว timer ที่โหลดจากไฟล์มี 'restored': True ใน due()
+    ให้ส่งได้แม้ context ของลูกค้าจะหายไปกับการเริ่มโปรเซสใหม่
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None, tick: float = 5.0, slots: int = 4096,
+                 max_late: float = 3600, metrics: Metrics = None):
+        self.snapshot_path = snapshot_path
+        self.max_late = max_late
+        self.metrics = metrics or Metrics()
+        self._wheel = TimingWheel(tick=tick, slots=slots)
+        self._restored = set()  # key ของ timer ที่โหลดจากไฟล์และยังไม่ถูกตั้งใหม่/ยกเลิกในโปรเซสนี้
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def schedule(self, page_id: str, user_id: str, intent: str, delay: float, now: float = None) -> None:
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._wheel.schedule((page_id, user_id), now + delay, intent)
+            self._restored.discard((page_id, user_id))
+            self._dirty = True
+            pending = len(self._wheel)
+        self.metrics.incr("follow_up.scheduled")
+        self.metrics.set_gauge("follow_up.pending", pending)
+
+    def cancel(self, page_id: str, user_id: str) -> bool:
+        with self._lock:
+            cancelled = self._wheel.cancel((page_id, user_id))
+            self._restored.discard((page_id, user_id))
+            self._dirty = self._dirty or cancelled
+            pending = len(self._wheel)
+        if cancelled:
+            self.metrics.incr("follow_up.cancelled")
+            self.metrics.set_gauge("follow_up.pending", pending)
+        return cancelled
+
+    def due(self, now: float = None) -> List[Dict[str, Any]]:
+        """timer ที่ครบกำหนดแล้ว (ถูกลบออกจาก scheduler) restored = โหลดมาจากไฟล์"""
+        with self._lock:
+            timers = self._wheel.advance(now)
+            restored = {key for key, _, _ in timers if key in self._restored}
+            self._restored -= restored
+            self._dirty = self._dirty or bool(timers)
+            pending = len(self._wheel)
+        if timers:
+            self.metrics.set_gauge("follow_up.pending", pending)
+        return [{'page_id': key[0], 'user_id': key[1], 'intent': intent, 'deadline': deadline, 'restored': key in restored}
+                for key, deadline, intent in sorted(timers, key=lambda timer: timer[1])]
+
+    def save(self, force: bool = False) -> bool:
+        """บันทึก timer ที่ค้างอยู่ลงไฟล์ (เฉพาะเมื่อมีการเปลี่ยนแปลง) คืน True เมื่อเขียนไฟล์"""
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            if not self._dirty and not force:
+                return False
+            timers = [[page_id, user_id, intent, round(deadline, 1)]
+                      for (page_id, user_id), deadline, intent in self._wheel.items()]
+            self._dirty = False
+        # เขียนไฟล์ชั่วคราวแล้วแทนที่ ไฟล์เดิมยังใช้ได้ถ้าโปรเซสตายระหว่างเขียน
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'timers': timers}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, self.snapshot_path)
+        return True
+
+    def load(self, now: float = None) -> int:
+        """โหลด timer จากไฟล์ คืนจำนวนที่โหลด"""
+        if not self.snapshot_path:
+            return 0
+        now = now if now is not None else time.time()
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                timers = json.load(f).get('timers', [])
+        except FileNotFoundError:
+            return 0
+        except json.JSONDecodeError as e:
+            print(f"Warning: {self.snapshot_path} is not valid JSON: {e}")
+            return 0
+
+        loaded = 0
+        with self._lock:
+            for page_id, user_id, intent, deadline in timers:
+                if now - deadline > self.max_late:
+                    continue
+                self._wheel.schedule((page_id, user_id), deadline, intent)
+                self._restored.add((page_id, user_id))
+                loaded += 1
+            pending = len(self._wheel)
+        self.metrics.set_gauge("follow_up.pending", pending)
+        print(f"Loaded {loaded} follow-up timers from {self.snapshot_path} ({len(timers) - loaded} expired)")
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.metrics.snapshot()['counters']
+        return {
+            'pending': len(self._wheel),
+            **{name: counters.get(f"follow_up.{name}", 0) for name in ('scheduled', 'cancelled', 'sent', 'skipped', 'failed')}
+        }
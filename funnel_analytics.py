@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Funnel Analytics
+วิเคราะห์ว่าลูกค้าหลุดจากขั้นตอนการสั่งซื้อตรงไหน จากไฟล์ที่ส่งออกด้วย /admin/contexts.ndjson (ต้องติดตั้ง numpy)
+
+ตัวอย่าง:
+    curl -o contexts.ndjson "http://localhost:8000/admin/contexts.ndjson"
+    python funnel_analytics.py contexts.ndjson
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Any, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # ใช้เฉพาะสคริปต์นี้ ไม่ได้อยู่ใน requirements.txt ของ server
+    np = None
+
+from intent_detector import IntentDetector
+
+ORDERED_STAGE = "ordered"
+
+# dtype ของแต่ละคอลัมน์ (คอลัมน์ข้อความเก็บเป็น object)
+COLUMN_TYPES = {
+    'stage': 'int16',
+    'manual_mode': 'bool',
+    'total_quantity': 'int32',
+    'has_address': 'bool',
+    'path_lengths': 'int32',
+    'path_stages': 'int16',
+}
+
+
+def load_export(file_path: str) -> Tuple[Dict[str, Any], Dict[str, "np.ndarray"]]:
+    """อ่านไฟล์ export เป็น header และ dict ของ numpy array (ต่อคอลัมน์ของทุก block เข้าด้วยกัน)"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != 'columns':
+            raise ValueError(f"{file_path} is not a /admin/contexts.ndjson export")
+        blocks = [json.loads(line) for line in f if line.strip()]
+
+    columns = {}
+    for name in ('user_id', 'last_intent', 'payment_method', *COLUMN_TYPES):
+        dtype = COLUMN_TYPES.get(name, object)
+        parts = [np.asarray(block[name], dtype=dtype) for block in blocks]
+        columns[name] = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+    return header, columns
+
+
+def transition_matrix(path_stages: "np.ndarray", path_lengths: "np.ndarray", stage_count: int) -> "np.ndarray":
+    """จำนวนครั้งที่ข้อความถัดไปของลูกค้าคนเดียวกันเปลี่ยนจาก stage แถว ไปเป็น stage คอลัมน์"""
+    owner = np.repeat(np.arange(len(path_lengths)), path_lengths)
+    same_user = owner[1:] == owner[:-1]
+    pairs = path_stages[:-1][same_user].astype(np.int64) * stage_count + path_stages[1:][same_user]
+    return np.bincount(pairs, minlength=stage_count * stage_count).reshape(stage_count, stage_count)
+
+
+def reached_counts(path_stages: "np.ndarray", path_lengths: "np.ndarray", stage: "np.ndarray",
+                   stage_count: int) -> "np.ndarray":
+    """จำนวนลูกค้าที่เคยอยู่ใน stage นั้น (จาก history และ stage ปัจจุบัน นับคนละครั้ง)"""
+    visited = np.zeros((len(stage), stage_count), dtype=bool)
+    visited[np.repeat(np.arange(len(path_lengths)), path_lengths), path_stages] = True
+    visited[np.arange(len(stage)), stage] = True
+    return visited.sum(axis=0)
+
+
+def order_totals(quantity: "np.ndarray") -> "np.ndarray":
+    """ยอดรวม (รวมค่าส่ง) ของแต่ละคนตามขั้นราคาใน IntentDetector._calculate_price (0 ถ้ายังไม่เลือกจำนวน)
+
+    คำนวณราคาครั้งเดียวต่อจำนวนที่เป็นไปได้ แล้วเปิดตารางด้วยจำนวนของทุกคนพร้อมกัน
+    """
+    table = np.array([0] + [IntentDetector._calculate_price(q)['total'] for q in range(1, int(quantity.max(initial=0)) + 1)])
+    return table[np.maximum(quantity, 0)]
+
+
+def analyze(header: Dict[str, Any], columns: Dict[str, "np.ndarray"]) -> Dict[str, Any]:
+    """คำนวณ funnel ทั้งหมดจากคอลัมน์ (ไม่มี loop ต่อลูกค้า)"""
+    stages: List[str] = header['stages']
+    stage_count = len(stages)
+    stage = columns['stage']
+    quantity = columns['total_quantity']
+    ordered = stage == stages.index(ORDERED_STAGE)
+    totals = order_totals(quantity)
+    with_basket = quantity > 0
+
+    return {
+        'customers': len(stage),
+        'current': np.bincount(stage, minlength=stage_count),
+        'reached': reached_counts(columns['path_stages'], columns['path_lengths'], stage, stage_count),
+        # ลูกค้าที่ยังไม่สั่งเสร็จค้างอยู่ที่ stage ไหน (แยกคนที่แอดมินดูแลอยู่)
+        'dropped': np.bincount(stage[~ordered & ~columns['manual_mode']], minlength=stage_count),
+        'manual': np.bincount(stage[columns['manual_mode']], minlength=stage_count),
+        'transitions': transition_matrix(columns['path_stages'], columns['path_lengths'], stage_count),
+        'orders': int(ordered.sum()),
+        'avg_basket': float(quantity[with_basket].mean()) if with_basket.any() else 0.0,
+        'avg_basket_ordered': float(quantity[ordered & with_basket].mean()) if (ordered & with_basket).any() else 0.0,
+        'revenue': int(totals[ordered].sum()),
+        'pipeline': int(totals[~ordered].sum()),
+    }
+
+
+def print_report(header: Dict[str, Any], report: Dict[str, Any]) -> None:
+    stages = header['stages']
+    width = max(len(stage) for stage in stages)
+    print(f"📊 {report['customers']} customers on page {header.get('page_id')} "
+          f"(exported {time.strftime('%Y-%m-%d %H:%M', time.localtime(header.get('exported_at', 0)))})")
+
+    print(f"\n{'stage':<{width}}  {'reached':>8} {'current':>8} {'dropped':>8} {'manual':>7}")
+    for index, stage in enumerate(stages):
+        print(f"{stage:<{width}}  {report['reached'][index]:>8} {report['current'][index]:>8} "
+              f"{report['dropped'][index]:>8} {report['manual'][index]:>7}")
+
+    print("\ntransitions (แถว = จาก, คอลัมน์ = ไป)")
+    labels = [stage[:8] for stage in stages]
+    print(" " * width + "  " + " ".join(f"{label:>8}" for label in labels))
+    for index, stage in enumerate(stages):
+        print(f"{stage:<{width}}  " + " ".join(f"{count:>8}" for count in report['transitions'][index]))
+
+    print(f"\norders={report['orders']} revenue={report['revenue']:,} บาท "
+          f"pipeline={report['pipeline']:,} บาท (ยังไม่สั่งเสร็จ)")
+    print(f"avg basket={report['avg_basket']:.2f} ตัว (สั่งเสร็จ {report['avg_basket_ordered']:.2f} ตัว)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Funnel analytics over exported conversation state")
+    parser.add_argument('export', help="ไฟล์จาก /admin/contexts.ndjson")
+    args = parser.parse_args()
+
+    if np is None:
+        print("❌ numpy is required: pip install numpy")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    header, columns = load_export(args.export)
+    loaded = time.perf_counter()
+    report = analyze(header, columns)
+    print_report(header, report)
+    print(f"\n⏱ load {(loaded - started) * 1000:.0f}ms, analyze {(time.perf_counter() - loaded) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
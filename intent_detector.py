@@ -1,13 +1,46 @@
+import functools
 import json
 import re
+import threading
+import time
+import uuid
+from contextlib import nullcontext
 import openai
-from typing import Dict, Any
+from typing import Dict, Any, List, Callable, Optional, Tuple
 from pydantic import BaseModel
 
+from context_index import ContextIndex
+from example_bank import ExampleBank
+from fact_index import FactIndex
+from faq import FaqEngine
+from follow_ups import MESSAGING_WINDOW_SECONDS
+from metrics import Metrics
+from model_router import ModelRouter
+from order_flow import FlowStage, OrderFlow
+from order_ledger import OrderLedger
+from quick_replies import build_quick_replies, parse_payload
+from request_trace import Trace
+from resilience import CircuitOpenError, ResilientCaller
+from text_normalizer import clean_text, normalize_text
+from thai_address import get_address_parser
+from token_budget import TokenBudget
+
+def _traced(stage: str):
+    """จับเวลาเมธอดเป็นขั้นตอนหนึ่งใน trace ของข้อความที่กำลังประมวลผล (ถ้าเปิด trace)"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._trace_stage(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class IntentResult(BaseModel):
     intent: str
     confidence: float
-    reason: str
+    reason: str = ''
+    answer: str = ''  # คำตอบสำเร็จรูปเมื่อไม่มี intent ตรง (เฉพาะ fallback_mode="single_call")
+    source: str = 'gpt'  # gpt, parse_error, error (เรียก API ไม่สำเร็จ), degraded (circuit breaker เปิด), order_flow (ไม่ได้เรียก GPT), quick_reply (payload ของปุ่ม)
 
 class IntentDetector:
     # Constants
@@ -15,23 +48,105 @@ class IntentDetector:
     SIZES_ORDERED = ["XXL", "XL", "M", "L"]  # สำหรับ regex matching
     AVAILABLE_COLORS = ["โกโก้", "โกโก", "ดำ", "ขาว", "ครีม", "ชมพู", "ฟ้า", "เทา", "กรม"]
 
-    def __init__(self, openai_api_key: str, replies_file: str = "replies.json", context_file: str = "business_context.json"):
-        self.client = openai.OpenAI(api_key=openai_api_key)
+    # รูปแบบคำตอบของ detect_intent
+    # - text: ให้ GPT ตอบ JSON อิสระแล้ว parse เอง (แบบเดิม)
+    # - json_schema: ใช้ structured output แบบ strict (ต้องใช้โมเดลที่รองรับ เช่น gpt-4o-mini)
+    # - function: บังคับให้เรียก function classify_intent (ใช้ได้กับ gpt-3.5-turbo)
+    INTENT_OUTPUT_MODES = ["text", "json_schema", "function"]
+
+    # วิธีตอบเมื่อไม่มี intent ตรง
+    # - two_call: detect_intent แล้วค่อยเรียก _generate_smart_fallback อีกครั้ง (แบบเดิม)
+    # - single_call: ให้ detect_intent ตอบคำตอบสั้นๆ มาพร้อมกันในการเรียกครั้งเดียว
+    FALLBACK_MODES = ["two_call", "single_call"]
+
+    # จุดตัดประโยคภาษาไทยสำหรับ streaming (คำลงท้ายที่ตามด้วยช่องว่าง หรือขึ้นบรรทัดใหม่)
+    SENTENCE_BOUNDARY = re.compile(r'(?:ค่ะ|คะ|ครับ|จ้า)[!.?~]*(?=\s)|\n+')
+    MIN_SEGMENT_CHARS = 15
+
+    # ความยาวข้อความย่อใน history แบบ compact
+    BOT_DIGEST_CHARS = 40
+    USER_DIGEST_CHARS = 120
+
+    # จำนวนข้อความใน history เมื่อ token_budget อยู่ในโหมด economy/static
+    ECONOMY_HISTORY_MESSAGES = 4
+
+    def __init__(self, openai_api_key: str = None, replies_file: str = "replies.json", context_file: str = "business_context.json",
+                 images_file: str = "product_images.json", examples_file: str = "intent_examples.json", client: openai.OpenAI = None,
+                 intent_output_mode: str = "text", include_reason: bool = True, metrics: Metrics = None,
+                 stream_fallback: bool = False, max_stream_segments: int = 3, fallback_mode: str = "two_call",
+                 resilience: ResilientCaller = None, compact_history: bool = False, history_token_budget: int = 300,
+                 narrow_intents: bool = True, order_ledger: OrderLedger = None, page_id: str = "default",
+                 normalize_messages: bool = True, token_budget: TokenBudget = None,
+                 fallback_top_facts: int = 6, faq_answers: bool = True, faq_min_score: float = 0.6,
+                 model_router: ModelRouter = None, few_shot_examples: int = 6,
+                 user_contexts: Dict[str, Dict[str, Any]] = None, context_index: ContextIndex = None):
+        if intent_output_mode not in self.INTENT_OUTPUT_MODES:
+            raise ValueError(f"Unknown intent_output_mode: {intent_output_mode}")
+        if fallback_mode not in self.FALLBACK_MODES:
+            raise ValueError(f"Unknown fallback_mode: {fallback_mode}")
+
+        # ใช้ OpenAI client ร่วมกันได้เมื่อให้บริการหลายเพจในโปรเซสเดียว
+        self.client = client or openai.OpenAI(api_key=openai_api_key)
         self.replies = self._load_replies(replies_file)
-        self.business_context = self._load_business_context(context_file)
-        self.product_images = self._load_product_images("product_images.json")
-        self.user_contexts = {}  # เก็บ context แยกตาม user_id
+        # แตก business_context เป็นข้อเท็จจริงและ index ไว้ค้นหา (โหลดใหม่เองเมื่อไฟล์ถูกแก้ไข)
+        self.fact_index = FactIndex(context_file)
+        self.business_context = self.fact_index.data
+        self.fallback_top_facts = fallback_top_facts  # 0 = ใส่ข้อมูลร้านทั้งหมดใน prompt ของ smart fallback
+        self.product_images = self._load_product_images(images_file)
+        # ตัวอย่างข้อความ -> intent ที่เลือกเฉพาะรายการที่คล้ายข้อความลูกค้ามาใส่ใน prompt ของ detect_intent
+        self.example_bank = ExampleBank(examples_file)
+        self.few_shot_examples = few_shot_examples
+        # ปุ่ม quick reply ที่ส่งไปพร้อมคำตอบของแต่ละ intent (ส่วน quick_replies ใน replies.json)
+        self.quick_replies = {
+            intent: build_quick_replies(entry['quick_replies'])
+            for intent, entry in self.replies.items() if isinstance(entry, dict) and entry.get('quick_replies')
+        }
+        # ข้อความตามลูกค้าที่หยุดอยู่ที่ intent นั้น (ส่วน follow_up ใน replies.json)
+        self.follow_ups = self._load_follow_ups()
+        # เก็บ context แยกตาม user_id (ส่งมาจาก PageRegistry เพื่อให้อยู่ต่อเมื่อ detector ถูกปลด)
+        self.user_contexts = user_contexts if user_contexts is not None else {}
+        # index ของ manual_mode / last_intent สำหรับ admin query
+        self.context_index = context_index if context_index is not None else ContextIndex()
+        self.intent_output_mode = intent_output_mode
+        self.include_reason = include_reason  # ปิดได้ใน production เพื่อลด completion tokens
+        self.metrics = metrics or Metrics()
+        self.stream_fallback = stream_fallback
+        self.max_stream_segments = max(1, max_stream_segments)  # กันการส่งข้อความถี่เกินไป
+        self.fallback_mode = fallback_mode
+        # deadline / hedge / circuit breaker ครอบทุกการเรียก OpenAI
+        self.resilience = resilience or ResilientCaller(metrics=self.metrics)
+        # model / max_tokens / temperature / timeout ของแต่ละ call site และ model สำรอง (ใช้ร่วมกันทุกเพจ)
+        self.model_router = model_router or ModelRouter(metrics=self.metrics)
+        self.compact_history = compact_history
+        self.history_token_budget = history_token_budget
+        self.order_flow = OrderFlow()
+        self.narrow_intents = narrow_intents  # ให้ GPT เลือกเฉพาะ intent ที่เป็นไปได้ในขั้นตอนการสั่งซื้อปัจจุบัน
+        self.order_ledger = order_ledger  # บันทึกออเดอร์ที่สั่งเสร็จแล้ว (None = ไม่บันทึก)
+        self.page_id = page_id
+        self.address_parser = get_address_parser()  # ข้อมูลจังหวัด/อำเภอโหลดครั้งเดียวใช้ร่วมกันทุกเพจ
+        self.normalize_messages = normalize_messages  # False = แปลงเป็นตัวพิมพ์เล็กอย่างเดียว (ใช้เปรียบเทียบใน benchmark)
+        # นับ token แยกตาม call site/intent/user และลดการใช้ GPT เมื่อใกล้หมดงบ (ใช้ร่วมกันทุกเพจ)
+        self.token_budget = token_budget or TokenBudget(metrics=self.metrics)
+        # ตอบคำถามที่พบบ่อยจาก business_context โดยไม่เรียก GPT ก่อนใช้ smart fallback (None = ปิด)
+        self.faq_min_score = faq_min_score
+        self.faq = FaqEngine(self.business_context, min_score=faq_min_score, metrics=self.metrics) if faq_answers else None
+        self._request_scope = threading.local()  # usage ที่รอบันทึกและ trace ของข้อความที่กำลังประมวลผลใน thread นี้
+
+    @staticmethod
+    def _new_user_context(last_intent: str = None) -> Dict[str, Any]:
+        return {
+            'last_intent': last_intent,
+            'last_message': None,
+            'order_info': {},
+            'manual_mode': False,
+            'manual_until': None,
+            'conversation_history': []
+        }
 
     def _get_user_context(self, user_id: str) -> Dict[str, Any]:
         """ดึงหรือสร้าง context สำหรับ user"""
         if user_id not in self.user_contexts:
-            self.user_contexts[user_id] = {
-                'last_intent': None,
-                'last_message': None,
-                'order_info': {},
-                'manual_mode': False,
-                'conversation_history': []
-            }
+            self.user_contexts[user_id] = self._new_user_context()
         return self.user_contexts[user_id]
 
     def _load_replies(self, file_path: str) -> Dict[str, Any]:
@@ -43,14 +158,19 @@ class IntentDetector:
             print(f"Warning: {file_path} not found. Using empty replies.")
             return {}
 
-    def _load_business_context(self, file_path: str) -> Dict[str, Any]:
-        """โหลดข้อมูลธุรกิจจากไฟล์ JSON"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Info: {file_path} not found. Running without business context.")
-            return {}
+    def _load_follow_ups(self) -> Dict[str, Dict[str, Any]]:
+        """{"intent": {"delay": วินาที, "message": "..."}} จาก follow_up ของแต่ละ intent ใน replies.json"""
+        follow_ups = {}
+        for intent, entry in self.replies.items():
+            follow_up = entry.get('follow_up') if isinstance(entry, dict) else None
+            if not follow_up:
+                continue
+            delay = float(follow_up.get('after_minutes', 60)) * 60
+            if not follow_up.get('message') or not 0 < delay < MESSAGING_WINDOW_SECONDS:
+                print(f"Warning: follow_up of {intent} needs a message and after_minutes under 24 hours")
+                continue
+            follow_ups[intent] = {'delay': delay, 'message': follow_up['message']}
+        return follow_ups
 
     def _load_product_images(self, file_path: str) -> Dict[str, Any]:
         """โหลดข้อมูลรูปภาพสินค้าจากไฟล์ JSON"""
@@ -61,16 +181,247 @@ class IntentDetector:
             print(f"Info: {file_path} not found. Running without product images.")
             return {}
 
-    def _generate_smart_fallback(self, message: str) -> str:
-        """สร้างคำตอบอัจฉริยะจาก business context เมื่อไม่สามารถจับ intent ได้"""
-        try:
-            business_info = self.business_context.get('business_info', {})
+    def _chat_completion(self, call_site: str, **kwargs):
+        """เรียก OpenAI chat completion พร้อมเก็บ latency และ token usage ลง metrics
+
+        model และค่าที่ route ของ call site กำหนด (model_router) ใช้แทน kwargs ที่ส่งมา
+        ถ้า model แรกล้มเหลว/หมดเวลาจะลอง model สำรองถัดไปของ route
+        """
+        self.metrics.incr(f"{call_site}.calls")
+        route = self.model_router.route(call_site)
+        for name in ('max_tokens', 'temperature'):
+            if getattr(route, name) is not None:
+                kwargs[name] = getattr(route, name)
+        deadline = route.timeout or self.resilience.deadline
+        started = time.perf_counter()
+        models = self.model_router.candidates(call_site)
+        for attempt, model in enumerate(models):
+            model_started = time.perf_counter()
+            try:
+                with self._trace_stage(f"{call_site}.completion"):
+                    response = self.resilience.call(
+                        call_site,
+                        lambda model=model: self.client.chat.completions.create(model=model, timeout=deadline, **kwargs),
+                        deadline=deadline
+                    )
+            except CircuitOpenError:
+                self.metrics.incr(f"{call_site}.errors")
+                raise
+            except Exception as e:
+                self.model_router.record(call_site, model, (time.perf_counter() - model_started) * 1000, ok=False)
+                if attempt + 1 < len(models):
+                    print(f"{call_site}: {model} failed ({type(e).__name__}), retrying with {models[attempt + 1]}")
+                    self.metrics.incr(f"{call_site}.model_fallback")
+                    continue
+                self.metrics.incr(f"{call_site}.errors")
+                raise
+            self.model_router.record(call_site, model, (time.perf_counter() - model_started) * 1000, ok=True)
+            break
+        self.metrics.observe(f"{call_site}.latency_ms", (time.perf_counter() - started) * 1000)
+
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self._account_usage(call_site, usage)
+        return response
+
+    def _account_usage(self, call_site: str, usage) -> None:
+        """เก็บ token usage ลง metrics และ token_budget
+
+        ระหว่าง process_message จะรอจนรู้ intent สุดท้ายของข้อความก่อนแล้วค่อยบันทึก
+        """
+        prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        self.metrics.observe(f"{call_site}.prompt_tokens", prompt_tokens)
+        self.metrics.observe(f"{call_site}.completion_tokens", completion_tokens)
+        trace = getattr(self._request_scope, 'trace', None)
+        if trace is not None:
+            trace.add_tokens(call_site, prompt_tokens, completion_tokens)
+        pending = getattr(self._request_scope, 'pending', None)
+        if pending is not None:
+            pending.append((call_site, prompt_tokens, completion_tokens))
+        else:
+            self.token_budget.record(call_site, prompt_tokens, completion_tokens)
+
+    def _trace_stage(self, name: str):
+        """context manager จับเวลาขั้นตอน name ใน trace ปัจจุบัน (ไม่ทำอะไรถ้าไม่ได้เปิด trace)"""
+        trace = getattr(self._request_scope, 'trace', None)
+        return trace.stage(name) if trace is not None else nullcontext()
+
+    def _trace_add(self, name: str, ms: float) -> None:
+        trace = getattr(self._request_scope, 'trace', None)
+        if trace is not None:
+            trace.add_stage(name, ms)
+
+    def is_degraded(self) -> bool:
+        """True เมื่อ circuit breaker ของ OpenAI เปิดอยู่ (ตอบได้เฉพาะจาก rules และ static replies)"""
+        return self.resilience.breaker.is_open()
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """ประมาณจำนวน tokens แบบคร่าวๆ (ภาษาไทยใช้ประมาณ 1 token ต่อตัวอักษร อังกฤษ ~4 ตัวอักษรต่อ token)"""
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+    @staticmethod
+    def _digest(text: str, limit: int) -> str:
+        """ย่อข้อความเหลือบรรทัดแรกไม่เกิน limit ตัวอักษร"""
+        first_line = text.strip().split('\n', 1)[0].strip()
+        if len(first_line) > limit or '\n' in text.strip():
+            return first_line[:limit].rstrip() + '…'
+        return first_line
+
+    def _order_state_summary(self, order_info: Dict[str, Any]) -> str:
+        """สรุป order_info เป็นสถานะแบบมีโครงสร้างแทนการส่งข้อความตอบกลับเต็มๆ"""
+        parts = []
+        colors = order_info.get('colors', [])
+        if colors:
+            parts.append("สี=" + ", ".join(f"{item['color']} {item['quantity']}" for item in colors))
+        if order_info.get('size'):
+            parts.append(f"ไซส์={order_info['size']}")
+        if order_info.get('total_quantity'):
+            parts.append(f"จำนวน={order_info['total_quantity']}")
+        if order_info.get('address_info'):
+            parts.append("ที่อยู่=ได้รับแล้ว")
+        return " | ".join(parts)
+
+    def _build_history_context(self, user_context: Dict[str, Any], economy: bool = False) -> str:
+        """สร้างส่วนประวัติการสนทนาใน prompt
+
+        compact_history=False: ส่งทุกข้อความแบบเต็ม (แบบเดิม)
+        compact_history=True: ข้อความบอทเหลือ intent + ข้อความย่อ, แนบสถานะออเดอร์,
+        และเลือกข้อความล่าสุดย้อนหลังจนเต็ม history_token_budget
+        economy=True: ใกล้หมดงบ token ใช้เฉพาะ ECONOMY_HISTORY_MESSAGES ข้อความล่าสุด
+        """
+        history = user_context.get('conversation_history', [])
+        if economy:
+            history = history[-self.ECONOMY_HISTORY_MESSAGES:]
+        if not history:
+            return ""
+
+        if not self.compact_history:
+            # ส่งประวัติการสนทนาทั้งหมด (สูงสุด 10 ข้อความ)
+            history_text = "\n".join([f"- {msg['role']}: {msg['content']}" for msg in history])
+            return f"""
+ประวัติการสนทนาทั้งหมด:
+{history_text}
+"""
+
+        order_state = self._order_state_summary(user_context.get('order_info', {}))
+        budget = self.history_token_budget - self._estimate_tokens(order_state)
+
+        lines = []
+        for msg in reversed(history):
+            if msg['role'] == 'bot':
+                line = f"- bot[{msg.get('intent', '')}]: {self._digest(msg['content'], self.BOT_DIGEST_CHARS)}"
+            else:
+                line = f"- user: {self._digest(msg['content'], self.USER_DIGEST_CHARS)}"
+            cost = self._estimate_tokens(line)
+            if cost > budget:
+                break
+            budget -= cost
+            lines.append(line)
+        lines.reverse()
+
+        history_text = "\n".join(lines)
+        order_text = f"\nสถานะออเดอร์ปัจจุบัน: {order_state}" if order_state else ""
+        return f"""
+ประวัติการสนทนาล่าสุด:
+{history_text}{order_text}
+"""
+
+    def _intent_schema(self, intents: List[str], with_answer: bool = False) -> Dict[str, Any]:
+        """สร้าง JSON schema ของคำตอบ detect_intent โดยจำกัด intent ให้อยู่ใน replies.json เท่านั้น
+
+        with_answer: ขอ "answer" สำหรับลูกค้ามาด้วย (single_call ที่มีข้อมูลธุรกิจใน prompt)
+        """
+        properties = {
+            "intent": {"type": "string", "enum": intents + ["none"]},
+            "confidence": {"type": "number"},
+        }
+        if self.include_reason:
+            properties["reason"] = {"type": "string"}
+        if with_answer:
+            properties["answer"] = {"type": "string"}
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties.keys()),
+            "additionalProperties": False,
+        }
+
+    def _intent_output_kwargs(self, intents: List[str], with_answer: bool = False) -> Dict[str, Any]:
+        """พารามิเตอร์ของ API ตาม intent_output_mode"""
+        schema = self._intent_schema(intents, with_answer)
+        if self.intent_output_mode == "json_schema":
+            return {
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {"name": "intent_result", "strict": True, "schema": schema},
+                }
+            }
+        if self.intent_output_mode == "function":
+            return {
+                "tools": [{
+                    "type": "function",
+                    "function": {
+                        "name": "classify_intent",
+                        "description": "บันทึก intent ของข้อความลูกค้า",
+                        "parameters": schema,
+                    },
+                }],
+                "tool_choice": {"type": "function", "function": {"name": "classify_intent"}},
+            }
+        return {}
+
+    def _extract_intent_payload(self, response) -> str:
+        """ดึงข้อความ JSON ของผลลัพธ์ออกจาก response ตาม intent_output_mode"""
+        message = response.choices[0].message
+        if self.intent_output_mode == "function":
+            return message.tool_calls[0].function.arguments
+
+        result_text = (message.content or "").strip()
+        if self.intent_output_mode == "text":
+            # ลบ markdown code block ถ้ามี
+            if result_text.startswith('```json'):
+                result_text = result_text[7:-3]
+            elif result_text.startswith('```'):
+                result_text = result_text[3:-3]
+        return result_text
+
+    def _refresh_business_context(self) -> None:
+        """โหลด business_context ใหม่ถ้าไฟล์ถูกแก้ไข"""
+        if self.fact_index.refresh():
+            self.business_context = self.fact_index.data
+            if self.faq:
+                self.faq = FaqEngine(self.business_context, min_score=self.faq_min_score, metrics=self.metrics)
+
+    def _match_faq(self, message: str) -> Optional[Dict[str, Any]]:
+        """FAQ ที่ตอบข้อความนี้ได้โดยไม่ต้องเรียก smart fallback (None ถ้าปิดหรือไม่มั่นใจ)"""
+        if not self.faq:
+            return None
+        self._refresh_business_context()
+        with self._trace_stage("faq"):
+            return self.faq.match(message)
 
-            # สร้าง prompt สำหรับ AI
-            prompt = f"""คุณเป็นพนักงานขายกางเกงคนท้องที่เป็นมิตรและมีความรู้เรื่องผลิตภัณฑ์ดี
+    def _business_facts(self, message: str) -> str:
+        """ข้อมูลร้านสำหรับ smart fallback: ชื่อ/คำอธิบายร้าน และข้อเท็จจริงที่เกี่ยวกับคำถาม fallback_top_facts รายการ"""
+        business_info = self.business_context.get('business_info', {})
+        if not self.fallback_top_facts:
+            return json.dumps(business_info, ensure_ascii=False, indent=2)
+
+        with self._trace_stage("smart_fallback.facts"):
+            facts = self.fact_index.search(message, self.fallback_top_facts)
+        self.metrics.observe("smart_fallback.facts", len(facts))
+        header = [f"{key}: {business_info[key]}" for key in ('name', 'description') if isinstance(business_info.get(key), str)]
+        return "\n".join(header + [f"- {fact}" for fact in facts])
+
+    def _build_smart_fallback_prompt(self, message: str) -> str:
+        """สร้าง prompt สำหรับ smart fallback"""
+        self._refresh_business_context()
+
+        return f"""คุณเป็นพนักงานขายกางเกงคนท้องที่เป็นมิตรและมีความรู้เรื่องผลิตภัณฑ์ดี
 
 ข้อมูลร้านค้า:
-{json.dumps(business_info, ensure_ascii=False, indent=2)}
+{self._business_facts(message)}
 
 ลูกค้าถาม: "{message}"
 
@@ -87,8 +438,36 @@ class IntentDetector:
 
 ตอบ:"""
 
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+    def _few_shot_examples(self, message: str, stage: FlowStage, intents: List[str]) -> str:
+        """ส่วน "ตัวอย่างรูปแบบสำคัญ" ของ prompt (ว่างถ้าไม่มีตัวอย่างที่คล้ายข้อความ)"""
+        self.example_bank.refresh()
+        examples = self.example_bank.select(message, stage.name, intents, self.few_shot_examples)
+        self.metrics.observe("detect_intent.few_shot_examples", len(examples))
+        if not examples:
+            return ""
+        lines = [
+            f'- "{example["text"]}" = {example["intent"]}' + (f' ({example["note"]})' if example.get('note') else '')
+            for example in examples
+        ]
+        return "ตัวอย่างรูปแบบสำคัญ:\n" + "\n".join(lines) + "\n\n"
+
+    def add_example(self, text: str, intent: str, stages: List[str] = None, note: str = None) -> Dict[str, Any]:
+        """เพิ่ม/แก้ตัวอย่างใน example bank (เช่นเมื่อแอดมินพบว่า GPT จับ intent ผิด) มีผลกับข้อความถัดไปทันที"""
+        if intent not in self.replies or intent == 'fallback':
+            raise ValueError(f"Unknown intent: {intent}")
+        unknown_stages = set(stages or []) - {stage.name for stage in self.order_flow.stages}
+        if unknown_stages:
+            raise ValueError(f"Unknown stages: {sorted(unknown_stages)}")
+        return self.example_bank.add(text, intent, stages, note)
+
+    @_traced("smart_fallback")
+    def _generate_smart_fallback(self, message: str) -> str:
+        """สร้างคำตอบอัจฉริยะจาก business context เมื่อไม่สามารถจับ intent ได้"""
+        try:
+            prompt = self._build_smart_fallback_prompt(message)
+
+            response = self._chat_completion(
+                "smart_fallback",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=200,
                 temperature=0.7
@@ -100,16 +479,105 @@ class IntentDetector:
             print(f"Error generating smart fallback: {e}")
             return "ขออภัยค่ะ มีปัญหาเทคนิค กรุณาลองใหม่อีกครั้งค่ะ"
 
+    def _next_segment_end(self, buffer: str) -> int:
+        """หาตำแหน่งตัดประโยคแรกใน buffer (ต้องยาวอย่างน้อย MIN_SEGMENT_CHARS) คืน -1 ถ้ายังตัดไม่ได้"""
+        for match in self.SENTENCE_BOUNDARY.finditer(buffer):
+            if match.end() >= self.MIN_SEGMENT_CHARS:
+                return match.end()
+        return -1
+
+    @_traced("smart_fallback_stream")
+    def _stream_smart_fallback(self, message: str, on_segment: Callable[[str], Any]) -> str:
+        """สร้างคำตอบ smart fallback แบบ streaming ส่งทีละประโยคผ่าน on_segment แล้วคืนข้อความเต็ม"""
+        segments = []
+        buffer = ""
+        full_text = ""
+
+        def emit(text: str) -> None:
+            text = text.strip()
+            if not text:
+                return
+            if not segments:
+                self.metrics.observe("smart_fallback_stream.first_segment_ms", (time.perf_counter() - started) * 1000)
+            segments.append(text)
+            on_segment(text)
+
+        started = time.perf_counter()
+        try:
+            stream = self._chat_completion(
+                "smart_fallback_stream",
+                messages=[{"role": "user", "content": self._build_smart_fallback_prompt(message)}],
+                max_tokens=200,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+
+            for chunk in stream:
+                if chunk.usage is not None:
+                    self._account_usage("smart_fallback_stream", chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                buffer += delta
+                full_text += delta
+
+                # ตัดประโยคที่สมบูรณ์ออกมาส่งก่อน จนกว่าจะถึงจำนวน segment สูงสุด (ส่วนที่เหลือรวมเป็น segment สุดท้าย)
+                while len(segments) < self.max_stream_segments - 1:
+                    cut = self._next_segment_end(buffer)
+                    if cut < 0:
+                        break
+                    emit(buffer[:cut])
+                    buffer = buffer[cut:]
+
+            emit(buffer)
+            self.metrics.observe("smart_fallback_stream.total_ms", (time.perf_counter() - started) * 1000)
+
+        except Exception as e:
+            print(f"Error streaming smart fallback: {e}")
+            self.metrics.incr("smart_fallback_stream.errors")
+            if not segments:
+                full_text = "ขออภัยค่ะ มีปัญหาเทคนิค กรุณาลองใหม่อีกครั้งค่ะ"
+                emit(full_text)
+
+        # เก็บข้อความเต็มตามที่ GPT สร้างไว้ใน conversation_history
+        return full_text.strip()
+
+    @_traced("detect_intent")
     def detect_intent(self, message: str, user_context: Dict[str, Any]) -> IntentResult:
         """วิเคราะห์ intent จากข้อความของผู้ใช้"""
 
+        # OpenAI ล่มอยู่ ไม่ต้องสร้าง prompt ปล่อยให้ keyword/regex overrides ใน process_message ตัดสินใจ
+        if self.is_degraded():
+            return IntentResult(
+                intent='none',
+                confidence=0.0,
+                reason='OpenAI unavailable - degraded mode',
+                source='degraded'
+            )
+
+        prompt_started = time.perf_counter()
+
         # สร้าง prompt สำหรับ GPT
         available_intents = list(self.replies.keys())
         available_intents.remove('fallback')  # ไม่ต้องให้ GPT เลือก fallback
 
+        # จำกัดตัวเลือกตามขั้นตอนการสั่งซื้อ และใช้คำอธิบายบริบทของขั้นตอนนั้น
+        stage = self.order_flow.stage_for(user_context)
+        if self.narrow_intents:
+            available_intents = self.order_flow.candidates(stage, available_intents)
+        self.metrics.observe("detect_intent.candidates", len(available_intents))
+        conversation_context = stage.hint
+
+        # ใกล้หมดงบ token: prompt แบบสั้น ไม่แนบข้อมูลธุรกิจ และใช้ history น้อยลง
+        economy = self.token_budget.mode() != TokenBudget.NORMAL
+        if economy:
+            self.metrics.incr("token_budget.economy_prompts")
+
         # เพิ่มข้อมูลธุรกิจเข้าไปใน context
+        self._refresh_business_context()
         business_info = ""
-        if self.business_context and "business_info" in self.business_context:
+        if self.business_context and "business_info" in self.business_context and not economy:
             business_info = f"""
 ข้อมูลธุรกิจ:
 {json.dumps(self.business_context['business_info'], ensure_ascii=False, indent=2)}
@@ -118,25 +586,37 @@ class IntentDetector:
 ไซส์ที่มี: M, L, XL, XXL
 """
 
-        # เพิ่ม context จากการสนทนาก่อนหน้า
-        conversation_context = ""
-        if user_context.get('last_intent') in ["color_with_quantity", "color_multiple"]:
-            conversation_context = f"""
-🚨 บริบทสำคัญ: ลูกค้าเพิ่งแจ้งสี+จำนวนในข้อความก่อนหน้านี้แล้ว (intent: {user_context.get('last_intent')})
-ดังนั้นถ้าข้อความปัจจุบันเป็นไซส์เดียว (M, L, XL, XXL) ต้องเลือก size_after_color_quantity
-ห้ามเลือก size_only เด็ดขาด เพราะลูกค้าแจ้งจำนวนไปแล้ว
+        # single_call: ขอคำตอบสำหรับลูกค้ามาพร้อมกัน กรณีไม่มี intent ตรง
+        # โหมด economy ไม่มีข้อมูลธุรกิจใน prompt จึงไม่ขอคำตอบ (กันคำตอบที่ GPT แต่งเอง)
+        single_call = self.fallback_mode == "single_call" and not economy
+        answer_instruction = ""
+        if single_call:
+            answer_instruction = """
+ถ้า intent เป็น 'none' หรือ confidence < 0.45 ให้ใส่ "answer" เป็นคำตอบสำหรับลูกค้าโดย:
+- ใช้ข้อมูลธุรกิจข้างต้นเท่านั้น ตอบภาษาไทยสุภาพ สั้นๆ กระชับ ไม่เกิน 1-2 ประโยค ลงท้ายด้วย ค่ะ
+- ถ้าไม่เกี่ยวกับธุรกิจเลย (เช่น อากาศ การเมือง กีฬา ข่าว) ให้ตอบ "ขออภัยค่ะ ฉันตอบได้เฉพาะเรื่องกางเกงคนท้องเท่านั้นค่ะ มีอะไรเกี่ยวกับสินค้าให้ช่วยไหมคะ"
+ถ้ามี intent ตรงให้ "answer" เป็นข้อความว่าง ""
 """
 
+        # รูปแบบคำตอบ: โหมด structured ให้ schema บังคับรูปแบบแทนคำอธิบายยาวๆ
+        if self.intent_output_mode == "text":
+            reason_line = ',\n  "reason": "เหตุผลสั้นๆ ที่เลือก intent นี้"' if self.include_reason else ''
+            answer_line = ',\n  "answer": "คำตอบสำหรับลูกค้า หรือข้อความว่างถ้ามี intent ตรง"' if single_call else ''
+            output_format = f"""กรุณาวิเคราะห์และตอบกลับในรูปแบบ JSON เท่านั้น:
+{{
+  "intent": "ชื่อ intent ที่ตรงที่สุด หรือ 'none' ถ้าไม่ตรงอะไรเลย",
+  "confidence": ระดับความมั่นใจ 0.0-1.0{reason_line}{answer_line}
+}}
+{answer_instruction}"""
+        else:
+            output_format = "ตอบตาม schema ที่กำหนด (intent, confidence" + (", reason สั้นๆ" if self.include_reason else "") + (", answer" if single_call else "") + ")\n" + answer_instruction
+
+        # ตัวอย่างที่คล้ายข้อความนี้ที่สุด k รายการ (เฉพาะ intent ที่เลือกได้ในขั้นตอนปัจจุบัน)
+        few_shot = self._few_shot_examples(message, stage, available_intents)
+
         # เพิ่มประวัติการสนทนา (sliding window)
-        conversation_history = ""
-        history = user_context.get('conversation_history', [])
-        if history:
-            # ส่งประวัติการสนทนาทั้งหมด (สูงสุด 10 ข้อความ)
-            history_text = "\n".join([f"- {msg['role']}: {msg['content']}" for msg in history])
-            conversation_history = f"""
-ประวัติการสนทนาทั้งหมด:
-{history_text}
-"""
+        conversation_history = self._build_history_context(user_context, economy=economy)
+        self.metrics.observe("detect_intent.history_tokens_est", self._estimate_tokens(conversation_history))
 
         prompt = f"""
 คุณเป็น AI ที่ช่วยวิเคราะห์ความตั้งใจ (intent) ของข้อความลูกค้าในร้านกางเกงคนท้อง
@@ -144,7 +624,7 @@ class IntentDetector:
 ข้อความจากลูกค้า: "{message}"
 
 Intent ที่มีให้เลือก:
-{json.dumps({k: v['description'] for k, v in self.replies.items() if k != 'fallback'}, ensure_ascii=False, indent=2)}
+{json.dumps({k: self.replies[k]['description'] for k in available_intents}, ensure_ascii=False, indent=2)}
 
 หลักการวิเคราะห์:
 - วิเคราะห์ context จากประวัติการสนทนา
@@ -152,38 +632,15 @@ Intent ที่มีให้เลือก:
 - ใช้ confidence threshold ≥ 0.45
 - ⚠️ ตอบเฉพาะ intent ที่มีในรายการข้างต้นเท่านั้น หรือ 'none'
 
-ตัวอย่างรูปแบบสำคัญ:
-- "เอาดำ ครีม ฟ้า XL ปลายทางค่ะ" = order_confirm (มีครบ สี+ไซส์+จำนวน)
-- "Lสีโกโก้1ตัวก่อน" = order_confirm (มีครบ ไซส์+สี+จำนวน)
-- "ดำ M 2 ตัว" = order_confirm (มีครบ สี+ไซส์+จำนวน)
-- "ดำ 2 ตัว" = color_with_quantity (สี+จำนวน ไม่มีไซส์)
-- "M" = size_after_color_quantity (ไซส์เดียว หลังแจ้งสี+จำนวนแล้ว)
-- "รับ 2 ตัว 340 ค่าส่ง 30" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
-- "รับ 1 ตัว 180" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
-- "รับ 3 ตัว 490 ส่งฟรี" = price_inquiry (เริ่มด้วยราคา ต้องการสั่งซื้อ)
-- "ราคาเท่าไหร่" = price (ถามราคาเฉยๆ ไม่ได้สั่งซื้อ)
-- "มีสีดำไหม" = color_availability (ถามว่ามีสีนั้นไหม)
-- "สีชมพูมีไหมคะ" = color_availability (ถามว่ามีสีนั้นไหม)
-- "ดำ" = color (เลือกสีเดียว ไม่ถาม)
-- "ผ้าบางไหม" = fabric_quality (ถามคุณภาพผ้า)
-- "กี่วันถึง" = shipping (ถามระยะเวลาจัดส่ง)
-- "ขอเปลี่ยนเทาเป็นโกโก้" = order_edit (แก้ไขสีในออเดอร์)
-- "แก้ไขครีมเป็นดำ" = order_edit (แก้ไขออเดอร์ที่สั่งแล้ว)
-- "ปลายทาง" = payment_cod (เลือกเก็บเงินปลายทาง)
-
-กรุณาวิเคราะห์และตอบกลับในรูปแบบ JSON เท่านั้น:
-{{
-  "intent": "ชื่อ intent ที่ตรงที่สุด หรือ 'none' ถ้าไม่ตรงอะไรเลย",
-  "confidence": ระดับความมั่นใจ 0.0-1.0,
-  "reason": "เหตุผลสั้นๆ ที่เลือก intent นี้"
-}}
-
+{few_shot}{output_format}
 หลักเกณฑ์:
 - confidence ≥ 0.45 ถึงจะถือว่าตรง
 - ถ้าไม่แน่ใจให้ใส่ "none" และ confidence ต่ำ
 - วิเคราะห์จากความหมายโดยรวม ไม่ใช่แค่คำเดียว
 """
 
+        self._trace_add("detect_intent.prompt", (time.perf_counter() - prompt_started) * 1000)
+
         # Debug: แสดง prompt ที่ส่งไป GPT (เฉพาะการทดสอบ)
         print("=" * 80)
         print("🔍 DEBUG: GPT PROMPT")
@@ -192,18 +649,28 @@ Intent ที่มีให้เลือก:
         print("=" * 80)
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            response = self._chat_completion(
+                "detect_intent",
                 messages=[
                     {"role": "system", "content": "คุณเป็น AI ที่ช่วยวิเคราะห์ intent ของข้อความ ตอบเป็น JSON เท่านั้น"},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=200
+                max_tokens=200 if (self.include_reason or single_call) else 60,
+                **self._intent_output_kwargs(available_intents, with_answer=single_call)
+            )
+        except Exception as e:
+            print(f"Error in intent detection: {e}")
+            return IntentResult(
+                intent='none',
+                confidence=0.0,
+                reason=f'Error: {str(e)}',
+                source='error'
             )
 
+        try:
             # Parse JSON response
-            result_text = response.choices[0].message.content.strip()
+            result_text = self._extract_intent_payload(response)
 
             # Debug: แสดง response จาก GPT
             print("🤖 DEBUG: GPT RESPONSE")
@@ -211,28 +678,29 @@ Intent ที่มีให้เลือก:
             print(result_text)
             print("=" * 80)
 
-            # ลบ markdown code block ถ้ามี
-            if result_text.startswith('```json'):
-                result_text = result_text[7:-3]
-            elif result_text.startswith('```'):
-                result_text = result_text[3:-3]
-
             result_data = json.loads(result_text)
+            intent = result_data.get('intent', 'none')
+            if intent != 'none' and intent not in available_intents:
+                raise ValueError(f"Unknown intent from GPT: {intent}")
 
             return IntentResult(
-                intent=result_data.get('intent', 'none'),
+                intent=intent,
                 confidence=float(result_data.get('confidence', 0.0)),
-                reason=result_data.get('reason', 'No reason provided')
+                reason=result_data.get('reason', ''),
+                answer=(result_data.get('answer') or '').strip() if single_call else ''
             )
 
         except Exception as e:
+            self.metrics.incr("detect_intent.parse_failures")
             print(f"Error in intent detection: {e}")
             return IntentResult(
                 intent='none',
                 confidence=0.0,
-                reason=f'Error: {str(e)}'
+                reason=f'Error: {str(e)}',
+                source='parse_error'
             )
 
+    @_traced("extract_color_quantity")
     def _extract_color_quantity(self, message: str) -> Dict[str, Any]:
         """แยกข้อมูลสีและจำนวนจากข้อความ"""
         result = {'colors': [], 'total_quantity': 0}
@@ -310,108 +778,16 @@ Intent ที่มีให้เลือก:
         else:
             return "🎯 รอบเอวของคุณใหญ่กว่าไซส์ที่มี (XXL เอว 40-50)\nแนะนำให้ปรึกษาแอดมินก่อนสั่งค่ะ"
 
+    @_traced("analyze_address")
     def _analyze_address(self, message: str) -> Dict[str, Any]:
-        """วิเคราะห์ข้อมูลที่อยู่ว่าครบถ้วนหรือไม่ - ปรับปรุงให้รองรับรูปแบบจริง"""
-
-        result = {
-            'has_name': False,
-            'has_address': False,
-            'has_phone': False,
-            'extracted_name': '',
-            'extracted_address': '',
-            'extracted_phone': ''
-        }
+        """วิเคราะห์ชื่อ ที่อยู่ และเบอร์โทร (ดู thai_address.ThaiAddressParser)
 
-        # ตรวจสอบเบอร์โทร (รองรับรูปแบบหลากหลาย)
-        phone_patterns = [
-            r'Tel:\s*(\d{3}-\d{3}-\d{4})',      # Tel:083-998-9896
-            r'โทร\s+(\d{3}-\d{3}-\d{4})',       # โทร 083-038-9746
-            r'\(\s*โทร\s+(\d{3}-\d{3}-\d{4})\)', # (โทร 083-038-9746)
-            r'(\d{3}-\d{3}-\d{4})',             # 064-653-6992, 098-827-3472
-            r'(\d{3}\s?\d{3}\s?\d{4})',         # 064 653 6992, 0646536992
-            r'\((\d{10,11})\)',                 # (0937619828)
-            r'(\d{10,11})',                     # 0812345678, 081234567
-        ]
-
-        for pattern in phone_patterns:
-            phone_match = re.search(pattern, message)
-            if phone_match:
-                result['has_phone'] = True
-                # ดึงหมายเลขจาก group ที่ 1 (ใน parentheses) หรือ group 0
-                phone_number = phone_match.group(1) if phone_match.groups() else phone_match.group(0)
-                # ทำความสะอาดเบอร์โทร (เอาเครื่องหมายออก)
-                phone_clean = re.sub(r'[\s\-\(\)]', '', phone_number)
-                result['extracted_phone'] = phone_clean
-                break
-
-        # ตรวจสอบที่อยู่ (เพิ่ม keywords ที่หลากหลาย)
-        address_keywords = [
-            # พื้นฐาน
-            'บ้าน', 'ถนน', 'ซอย', 'ตำบล', 'อำเภอ', 'จังหวัด', 'หมู่',
-            # ย่อ
-            'ม.', 'ต.', 'อ.', 'จ.', 'ถ.',
-            # กรุงเทพ
-            'แขวง', 'เขต', 'กทม', 'กรุงเทพ', 'กรุงเทพมหานคร',
-            # อื่นๆ
-            'หมู่บ้าน', 'โครงการ', 'คอนโด', 'อพาร์ท', 'Add:', 'Add', 'Address'
-        ]
+        ส่งข้อความเดิมของลูกค้า (ไม่ใช่ผลของ normalize_text) เพื่อให้ชื่อ/ที่อยู่ที่บันทึกคงตัวพิมพ์และตัวอักษรตามที่พิมพ์
+        """
+        return self.address_parser.parse(clean_text(message))
 
-        has_number = bool(re.search(r'\d+', message))
-        has_address_keyword = any(keyword.lower() in message.lower() for keyword in address_keywords)
-
-        if has_number and has_address_keyword:
-            result['has_address'] = True
-            # แยกที่อยู่ออกมา (ลบเบอร์โทรออก)
-            address_text = message
-            for pattern in phone_patterns:
-                address_text = re.sub(pattern, '', address_text)
-            # ลบคำที่ไม่เกี่ยวข้อง
-            address_text = re.sub(r'Tel:\s*|โทร\s*|เบอร์\s*|\(\s*โทร\s*|\)', '', address_text).strip()
-            result['extracted_address'] = address_text
-
-        # ตรวจสอบชื่อ (ปรับปรุงให้ดีขึ้น)
-        # ลบข้อมูลที่ไม่ใช่ชื่อออกก่อน
-        clean_message = message
-        for pattern in phone_patterns:
-            clean_message = re.sub(pattern, '', clean_message)
-        clean_message = re.sub(r'Tel:\s*|โทร\s*|เบอร์\s*|\(\s*โทร\s*|\)|Add:\s*|Address:\s*', '', clean_message)
-
-        words = clean_message.split()
-        name_words = []
-
-        # ชื่อ indicators
-        name_indicators = ['นาย', 'นาง', 'นางสาว', 'คุณ', 'ร้าน', 'บริษัท', 'ห้าง', 'Mr.', 'Mrs.', 'Ms.']
-
-        # หาชื่อจากคำที่เป็น indicators หรือคำแรกๆ
-        found_indicator = False
-        for i, word in enumerate(words):
-            # ถ้าเจอ indicator ให้เอาคำถัดไปเป็นชื่อ
-            if any(indicator in word for indicator in name_indicators):
-                found_indicator = True
-                name_words.append(word)
-                # เอาคำถัดไปด้วย (สำหรับนามสกุล)
-                if i + 1 < len(words) and not any(keyword.lower() in words[i+1].lower() for keyword in address_keywords):
-                    if not re.search(r'\d{3,}', words[i+1]):  # ไม่ใช่เลขที่บ้าน
-                        name_words.append(words[i+1])
-                break
-
-        # ถ้าไม่เจอ indicator ให้ดูคำแรกๆ ที่ไม่ใช่ address keywords
-        if not found_indicator:
-            for word in words[:4]:  # ดู 4 คำแรก
-                if not any(keyword.lower() in word.lower() for keyword in address_keywords):
-                    if not re.search(r'\d{3,}', word):  # ไม่ใช่เลขที่บ้าน
-                        if not re.search(r'[\d\-\(\)]', word):  # ไม่ใช่เบอร์โทร
-                            name_words.append(word)
-                            if len(name_words) >= 2:  # เอาแค่ 2 คำ
-                                break
-
-        if len(name_words) >= 1:
-            result['has_name'] = True
-            result['extracted_name'] = ' '.join(name_words)
-
-        return result
-
-    def _calculate_price(self, quantity: int) -> Dict[str, Any]:
+    @staticmethod
+    def _calculate_price(quantity: int) -> Dict[str, Any]:
         """คำนวณราคาตามจำนวน"""
         if quantity >= 3:
             price = 490
@@ -513,25 +889,90 @@ Intent ที่มีให้เลือก:
         else:
             return self.replies.get('fallback', {}).get('reply', 'ขอบคุณที่ติดต่อค่ะ')
 
-    def process_message(self, message: str, user_id: str = "default", confidence_threshold: float = 0.45) -> Dict[str, Any]:
-        """ประมวลผลข้อความและคืนค่าผลลัพธ์พร้อมข้อความตอบกลับ"""
-        # ดึง context ของ user นี้
-        user_context = self._get_user_context(user_id)
+    def process_message(self, message: str, user_id: str = "default", confidence_threshold: float = 0.45,
+                        reply_callback: Callable[[str], Any] = None, user_context: Dict[str, Any] = None,
+                        trace: Trace = None, payload: str = None) -> Dict[str, Any]:
+        """ประมวลผลข้อความและคืนค่าผลลัพธ์พร้อมข้อความตอบกลับ
+
+        ถ้าเปิด stream_fallback และส่ง reply_callback มา คำตอบ smart fallback จะถูกส่งทีละประโยค
+        ผ่าน reply_callback ระหว่างที่ GPT กำลังสร้าง และผลลัพธ์จะมี 'streamed': True
+
+        ส่ง user_context มาเพื่อใช้ context แยก (เช่น batch classify) จะไม่บันทึกลง user_contexts, index และ ledger
+        ผลลัพธ์มี 'decided_by': ขั้นตอนที่ตัดสิน intent (manual_mode, order_flow, quick_reply, gpt, rules, fallback, faq, degraded)
+
+        ส่ง trace (request_trace.Trace) มาเพื่อจับเวลาแต่ละขั้นตอนและ token ที่ใช้ ผลลัพธ์จะมี 'trace' เป็น object เดียวกัน
+
+        ส่ง payload ของ quick reply/postback มา (message = ชื่อปุ่ม) จะบันทึกลง order_info และเปลี่ยนขั้นตอนทันที
+        โดยไม่เรียก GPT ('decided_by': 'quick_reply') payload ที่ใช้ไม่ได้จะประมวลผล message แบบข้อความปกติ
+        ผลลัพธ์มี 'quick_replies' เมื่อ intent ที่ตอบมีปุ่มกำหนดไว้ใน replies.json
+        """
+        # token ที่ใช้ระหว่างประมวลผลข้อความนี้บันทึกพร้อม intent สุดท้ายและ user_id
+        self._request_scope.pending = []
+        self._request_scope.trace = trace
+        result = None
+        try:
+            with self._trace_stage("process_message"):
+                if payload:
+                    result = self._process_payload(payload, message, user_id, user_context)
+                if result is None:
+                    result = self._process_message(message, user_id, confidence_threshold, reply_callback, user_context)
+            if trace is not None:
+                result['trace'] = trace
+            return result
+        finally:
+            self._request_scope.trace = None
+            pending, self._request_scope.pending = self._request_scope.pending, None
+            intent = result['used_intent'] if result else ''
+            # context แยก (batch classify) ไม่ใช่ลูกค้าจริง นับแยกไม่ให้ดันข้อความจริงเข้าโหมด economy/static
+            governed = user_context is None
+            for call_site, prompt_tokens, completion_tokens in pending:
+                self.token_budget.record(call_site, prompt_tokens, completion_tokens, intent=intent, user_id=user_id,
+                                         governed=governed)
+
+    def _process_message(self, message: str, user_id: str, confidence_threshold: float,
+                         reply_callback: Callable[[str], Any], user_context: Dict[str, Any] = None) -> Dict[str, Any]:
+        # ดึง context ของ user นี้ (context แยกไม่ถูกเก็บไว้ใน detector)
+        isolated = user_context is not None
+        if not isolated:
+            user_context = self._get_user_context(user_id)
+
+        # ทำข้อความให้เป็นรูปแบบมาตรฐานครั้งเดียว ทุก rule และ prompt ใช้ข้อความนี้
+        original_message = message
+        with self._trace_stage("normalize"):
+            message = normalize_text(message) if self.normalize_messages else message.lower()
 
         # ตรวจสอบ manual mode - ถ้าเป็น manual mode ให้หยุดตอบ
-        if user_context.get('manual_mode', False):
+        if self._manual_mode_active(user_id, user_context):
             return {
                 'detected_intent': 'manual_mode',
                 'confidence': 1.0,
                 'reason': 'User is in manual mode - admin handling required',
                 'used_intent': 'manual_mode',
                 'reply': None,  # ไม่ส่งข้อความตอบกลับ
-                'original_message': message,
+                'original_message': original_message,
                 'order_info': user_context['order_info'].copy(),
-                'manual_mode': True
+                'manual_mode': True,
+                'decided_by': 'manual_mode'
             }
 
-        intent_result = self.detect_intent(message, user_context)
+        # ขั้นตอนการสั่งซื้อปัจจุบัน: ข้อความที่ตีความได้แน่นอนไม่ต้องเรียก GPT
+        stage = self.order_flow.stage_for(user_context)
+        with self._trace_stage("order_flow"):
+            resolved_intent, address_info = self._resolve_by_flow(stage, message, original_message)
+
+        if resolved_intent:
+            self.metrics.incr("order_flow.resolved")
+            intent_result = IntentResult(
+                intent=resolved_intent,
+                confidence=1.0,
+                reason=f'order_flow: {stage.name}',
+                source='order_flow'
+            )
+        else:
+            intent_result = self.detect_intent(message, user_context)
+
+        # OpenAI ล่มหรือหมดเวลา: ไม่เรียก smart fallback ซ้ำ ใช้ rules และ static replies เท่านั้น
+        degraded = intent_result.source in ('error', 'degraded')
 
         # ตัดสินใจว่าจะใช้ intent ที่ตรวจจับได้หรือใช้ fallback
         if intent_result.confidence >= confidence_threshold and intent_result.intent != 'none':
@@ -539,11 +980,10 @@ Intent ที่มีให้เลือก:
         else:
             used_intent = 'smart_fallback'
 
-        # แก้ไข intent ตาม business logic หากจำเป็น
-        if user_context.get('last_intent') in ["color_with_quantity", "color_multiple"] and used_intent == "size_only":
-            # ถ้าเพิ่งแจ้งสี+จำนวน และตอนนี้แจ้งไซส์ ให้เปลี่ยนเป็น size_after_color_quantity
-            if any(size in message.upper() for size in self.AVAILABLE_SIZES):
-                used_intent = "size_after_color_quantity"
+        # แก้ไข intent ตามขั้นตอนการสั่งซื้อ (เช่น เพิ่งแจ้งสี+จำนวน แล้วแจ้งไซส์ = size_after_color_quantity)
+        used_intent = self.order_flow.remap(stage, used_intent)
+        classified_intent = used_intent  # ใช้ตัดสิน decided_by ว่า keyword rules ด้านล่างเปลี่ยน intent หรือไม่
+        overrides_started = time.perf_counter()
 
         # ตรวจสอบ size_after_color_quantity + payment method
         if used_intent == "size_after_color_quantity":
@@ -556,7 +996,7 @@ Intent ที่มีให้เลือก:
                 # ข้อความมีครบทั้งสี+ไซส์+จำนวน ให้เป็น order_confirm
                 used_intent = "order_confirm"
                 # บันทึกข้อมูลทั้งสีและไซส์
-                user_context['order_info'].update(color_info)
+                self._order_for_update(user_context).update(color_info)
                 for size in self.SIZES_ORDERED:
                     if size in message.upper():
                         user_context['order_info']['size'] = size
@@ -569,8 +1009,8 @@ Intent ที่มีให้เลือก:
                         break
 
                 # ตรวจสอบว่ามี payment method ไหม
-                cod_words = ["ปลายทาง", "COD", "เก็บปลายทาง"]
-                transfer_words = ["โอน", "ธนาคาร", "PromptPay"]
+                cod_words = ["ปลายทาง", "cod", "เก็บปลายทาง"]
+                transfer_words = ["โอน", "ธนาคาร", "promptpay"]
 
                 has_cod = any(word in message for word in cod_words)
                 has_transfer = any(word in message for word in transfer_words)
@@ -592,7 +1032,7 @@ Intent ที่มีให้เลือก:
                 # มีครบทั้งสี จำนวน และไซส์ ให้เป็น order_confirm
                 used_intent = "order_confirm"
                 # เก็บข้อมูลทั้งสีและไซส์
-                user_context['order_info'].update(color_info)
+                self._order_for_update(user_context).update(color_info)
                 # ค้นหาไซส์ (เรียงจากยาวไปสั้นเพื่อไม่ให้ XXL ถูกจับเป็น XL)
                 for size in self.SIZES_ORDERED:
                     if size in message.upper():
@@ -650,7 +1090,7 @@ Intent ที่มีให้เลือก:
             "บวกเพิ่ม", "ค่าธรรมเนียม", "ค่าบวก", "เพิ่มค่า", "บวกค่า",
             "เพิ่ม", "บวก", "ค่าส่งเพิ่ม"
         ]
-        cod_words = ["ปลายทาง", "COD", "เก็บปลายทาง"]
+        cod_words = ["ปลายทาง", "cod", "เก็บปลายทาง"]
 
         has_cod_inquiry = any(pattern in message for pattern in cod_inquiry_patterns)
         has_cod_word = any(word in message for word in cod_words)
@@ -692,7 +1132,7 @@ Intent ที่มีให้เลือก:
         payment_cod_response_patterns = [
             "ปลายทางค่ะ", "ปลายทางจ้า", "ปลายทางครับ", "ปลายทางคะ",
             "เก็บปลายทางค่ะ", "เก็บปลายทางจ้า", "เก็บปลายทางครับ",
-            "CODค่ะ", "CODจ้า", "codค่ะ", "codจ้า"
+            "codค่ะ", "codจ้า"
         ]
         payment_transfer_response_patterns = [
             "โอนค่ะ", "โอนจ้า", "โอนครับ", "โอนคะ",
@@ -710,8 +1150,8 @@ Intent ที่มีให้เลือก:
 
         # ตรวจสอบ payment intents หาก GPT ไม่จับได้ และยังไม่เป็น cod_inquiry
         elif used_intent == "fallback" or intent_result.confidence < 0.5:
-            payment_cod_keywords = ["ปลายทาง", "เก็บปลายทาง", "COD", "cod"]
-            payment_transfer_keywords = ["โอน", "ธนาคาร", "PromptPay", "promptpay", "บัญชี"]
+            payment_cod_keywords = ["ปลายทาง", "เก็บปลายทาง", "cod"]
+            payment_transfer_keywords = ["โอน", "ธนาคาร", "promptpay", "บัญชี"]
             order_edit_keywords = ["แก้ไข", "เปลี่ยน", "ยกเลิก", "แก้", "เปลี่ยนสี", "แก้ไขออเดอร์", "มันขาวไป", "ให้เป็นสีอื่น"]
             fabric_quality_keywords = ["ผ้า", "บาง", "หนา", "นุ่ม", "แข็ง", "ซัก", "วัสดุ", "คอตตอน", "สแปนเด็กซ์", "ยืด", "คุณภาพ"]
             product_length_keywords = ["ยาว", "ความยาว", "ขนาด", "เซนติเมตร", "ซม", "เมตร", "เท่าไหร่", "กี่", "มิติ"]
@@ -737,11 +1177,11 @@ Intent ที่มีให้เลือก:
             elif any(keyword in message for keyword in fabric_quality_keywords):
                 used_intent = "fabric_quality"
 
-        # ตรวจสอบ address intents หลังจากเลือก payment_cod
-        if user_context.get('last_intent') == "payment_cod":
-            address_info = self._analyze_address(message)
-            if address_info['has_phone'] or address_info['has_address'] or address_info['has_name']:
-                # มีข้อมูลที่อยู่บางส่วน ตรวจสอบว่าครบหรือไม่
+        # ตรวจสอบ address intents เมื่อกำลังรอที่อยู่ (หลังเลือก payment_cod)
+        if stage.expects_address:
+            address_info = address_info or self._analyze_address(original_message)
+            if address_info['has_phone'] or address_info['extracted_address']:
+                # มีเบอร์โทรหรือส่วนของที่อยู่ (ชื่ออย่างเดียวอาจเป็นข้อความทั่วไป) ตรวจสอบว่าครบหรือไม่
                 if address_info['has_name'] and address_info['has_address'] and address_info['has_phone']:
                     used_intent = "address_received"
                     user_context['order_info']['address_info'] = address_info
@@ -752,11 +1192,11 @@ Intent ที่มีให้เลือก:
         if used_intent == 'color_with_quantity':
             # แยกข้อมูลสีและจำนวน
             color_info = self._extract_color_quantity(message)
-            user_context['order_info'].update(color_info)
+            self._order_for_update(user_context).update(color_info)
         elif used_intent == 'color_multiple':
             # แยกข้อมูลหลายสี (1 สี = 1 ตัว)
             color_info = self._extract_color_quantity(message)
-            user_context['order_info'].update(color_info)
+            self._order_for_update(user_context).update(color_info)
         elif used_intent == 'size_after_color_quantity':
             # เก็บไซส์ (ค้นหาไซส์ที่ยาวที่สุดก่อน เพื่อไม่ให้ XXL ถูกจับเป็น XL)
             sizes = ["XXL", "XL", "M", "L"]  # เรียงจากยาวไปสั้น
@@ -784,13 +1224,115 @@ Intent ที่มีให้เลือก:
         elif used_intent == 'order_edit':
             # จัดการการแก้ไขออเดอร์
             self._process_order_edit(message, user_context)
-        elif used_intent == 'address_received' and 'address_info' not in user_context['order_info']:
-            # เก็บข้อมูลที่อยู่หากยังไม่ได้เก็บ
-            address_info = self._analyze_address(message)
-            user_context['order_info']['address_info'] = address_info
+        elif used_intent == 'address_received' and self._order_editable(user_context['order_info']):
+            # เก็บข้อมูลที่อยู่หากยังไม่ได้เก็บ หรือแทนที่ด้วยที่อยู่ที่ลูกค้าส่งมาแก้ (ครบถ้วน) ก่อนชำระเงิน
+            address_info = self._analyze_address(original_message)
+            if 'address_info' not in user_context['order_info'] or \
+                    (address_info['has_name'] and address_info['has_address'] and address_info['has_phone']):
+                user_context['order_info']['address_info'] = address_info
+        elif used_intent in ('payment_cod', 'payment_transfer'):
+            user_context['order_info']['payment_method'] = 'cod' if used_intent == 'payment_cod' else 'transfer'
+
+        # บันทึกออเดอร์ที่ได้ที่อยู่ครบแล้วลง ledger (ส่งที่อยู่แก้ก่อนชำระเงินจะอัพเดทออเดอร์เดิม)
+        if self.order_ledger and not isolated and used_intent == 'address_received' \
+                and self._order_editable(user_context['order_info']):
+            self._record_order(user_id, user_context['order_info'])
+        elif self.order_ledger and not isolated and used_intent == 'slip_received' \
+                and user_context['order_info'].get('order_id'):
+            user_context['order_info']['status'] = OrderLedger.STATUS_PAID
+            self.order_ledger.update_status(user_context['order_info']['order_id'], OrderLedger.STATUS_PAID)
+
+        self._trace_add("overrides", (time.perf_counter() - overrides_started) * 1000)
+        return self._respond(message, original_message, user_id, user_context, isolated, intent_result,
+                             used_intent, classified_intent, degraded, reply_callback)
+
+    def _process_payload(self, payload: str, message: str, user_id: str,
+                         user_context: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """ตอบ payload ของปุ่มโดยไม่เรียก GPT คืน None ถ้า payload ใช้ไม่ได้หรืออยู่ใน manual mode"""
+        isolated = user_context is not None
+        if not isolated:
+            user_context = self._get_user_context(user_id)
+        action = parse_payload(payload)
+        if action is None or self._manual_mode_active(user_id, user_context):
+            return None
 
+        stage = self.order_flow.stage_for(user_context)
+        if action.get('color') in self.AVAILABLE_COLORS:
+            self._order_for_update(user_context)  # ปุ่มเลือกสีหลังสั่งเสร็จแล้ว = ออเดอร์ใหม่
+        intent = self._apply_payload(action, stage, user_context['order_info'])
+        if intent not in self.replies:
+            print(f"Warning: unknown quick reply payload {payload!r}")
+            self.metrics.incr("quick_reply.unknown")
+            return None
+        self.metrics.incr("quick_reply.applied")
+
+        message = message or payload
+        intent_result = IntentResult(intent=intent, confidence=1.0, reason=f'payload: {payload}', source='quick_reply')
+        return self._respond(message, message, user_id, user_context, isolated, intent_result, intent, intent,
+                             False, None)
+
+    def _apply_payload(self, action: Dict[str, Any], stage: FlowStage, order_info: Dict[str, Any]) -> Optional[str]:
+        """บันทึกสี/ไซส์/วิธีชำระเงินจาก payload ลง order_info และคืน intent ตามขั้นตอนปัจจุบัน
+
+        payload: {"color": "ดำ", "quantity": 2}, {"size": "M"}, {"payment": "cod"|"transfer"}
+        หรือ {"intent": "..."} เพื่อระบุ intent เอง (ใช้ร่วมกับ key อื่นได้)
+        """
+        intent = None
+        color = action.get('color')
+        if color in self.AVAILABLE_COLORS:
+            try:
+                quantity = max(1, int(action.get('quantity', 1)))
+            except (TypeError, ValueError):
+                quantity = 1
+            order_info.update({'colors': [{'color': color, 'quantity': quantity}], 'total_quantity': quantity})
+            intent = 'color_with_quantity'
+
+        size = str(action.get('size', '')).upper()
+        if size in self.AVAILABLE_SIZES:
+            order_info['size'] = size
+            if intent:
+                intent = 'order_confirm'  # สี+จำนวน+ไซส์ในปุ่มเดียว
+            else:
+                # เหมือนพิมพ์ไซส์: หลังแจ้งสี+จำนวน = size_after_color_quantity, มีจำนวนแล้ว = order_confirm
+                intent = self.order_flow.remap(stage, 'size_only')
+                if intent == 'size_only' and order_info.get('total_quantity', 0) > 0:
+                    intent = 'order_confirm'
+
+        intent = action.get('intent') or intent
+        payment = action.get('payment') or {'payment_cod': 'cod', 'payment_transfer': 'transfer'}.get(intent)
+        if payment in ('cod', 'transfer'):
+            order_info['payment_method'] = payment
+            intent = 'payment_cod' if payment == 'cod' else 'payment_transfer'
+        return intent
+
+    def _respond(self, message: str, original_message: str, user_id: str, user_context: Dict[str, Any],
+                 isolated: bool, intent_result: IntentResult, used_intent: str, classified_intent: str,
+                 degraded: bool, reply_callback: Callable[[str], Any]) -> Dict[str, Any]:
+        """สร้างคำตอบของ intent ที่ตัดสินแล้ว บันทึกลง context/history และคืนผลลัพธ์"""
         # ดึงข้อความตอบกลับ
-        if used_intent == 'smart_fallback':
+        reply_started = time.perf_counter()
+        streamed = False
+        faq_entry = None
+        if used_intent == 'smart_fallback' and not intent_result.answer:
+            faq_entry = self._match_faq(message)
+        if faq_entry:
+            # คำตอบมีอยู่แล้วใน business_context ไม่ต้องเรียก GPT
+            reply = faq_entry['answer']
+        elif used_intent == 'smart_fallback' and degraded:
+            reply = self.get_reply('fallback')
+            self.metrics.incr("degraded.static_fallback")
+        elif used_intent == 'smart_fallback' and self.token_budget.mode() == TokenBudget.STATIC:
+            # ใช้ token ครบงบแล้ว ตอบ static fallback แทนการเรียก GPT อีกครั้ง
+            reply = self.get_reply('fallback')
+            self.metrics.incr("token_budget.static_fallback")
+        elif used_intent == 'smart_fallback' and intent_result.answer:
+            # single_call: ได้คำตอบมาพร้อมกับการวิเคราะห์ intent แล้ว ไม่ต้องเรียก GPT ซ้ำ
+            reply = intent_result.answer
+            self.metrics.incr("smart_fallback.answered_in_classification")
+        elif used_intent == 'smart_fallback' and self.stream_fallback and reply_callback:
+            reply = self._stream_smart_fallback(message, reply_callback)
+            streamed = True
+        elif used_intent == 'smart_fallback':
             reply = self._generate_smart_fallback(message)
         else:
             reply = self.get_reply(used_intent, message, user_context)
@@ -799,10 +1341,13 @@ Intent ที่มีให้เลือก:
         image_url = None
         if used_intent in self.replies and self.replies[used_intent].get('image_required', False):
             image_url = self._get_image_url(used_intent, message)
+        self._trace_add("reply", (time.perf_counter() - reply_started) * 1000)
 
         # เก็บ intent และข้อความล่าสุดเพื่อใช้ในการวิเคราะห์ครั้งต่อไป
         user_context['last_intent'] = used_intent
         user_context['last_message'] = message
+        if not isolated:
+            self.context_index.set_intent(user_id, used_intent)
 
         # เพิ่มข้อความใน conversation history (sliding window)
         if 'conversation_history' not in user_context:
@@ -833,16 +1378,118 @@ Intent ที่มีให้เลือก:
             'reason': intent_result.reason,
             'used_intent': used_intent,
             'reply': reply,
-            'original_message': message,
-            'order_info': user_context['order_info'].copy()
+            'original_message': original_message,
+            'order_info': user_context['order_info'].copy(),
+            'decided_by': 'faq' if faq_entry else self._decided_by(intent_result, classified_intent, used_intent, degraded)
         }
 
+        if faq_entry:
+            result['faq_id'] = faq_entry['id']
+
+        # ปุ่มให้ลูกค้ากดตอบขั้นตอนถัดไป (ไม่ส่งเมื่อคำตอบถูก stream ไปแล้ว)
+        if used_intent in self.quick_replies and reply and not streamed:
+            result['quick_replies'] = self.quick_replies[used_intent]
+
         # เพิ่ม image_url ถ้ามี
         if image_url:
             result['image_url'] = image_url
 
+        # คำตอบถูกส่งไปแล้วระหว่าง streaming
+        if streamed:
+            result['streamed'] = True
+
+        if degraded:
+            result['degraded'] = True
+
         return result
 
+    def _resolve_by_flow(self, stage: FlowStage, message: str,
+                         original_message: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """intent ที่ตัดสินได้จากขั้นตอนการสั่งซื้อโดยไม่เรียก GPT (None ถ้าไม่ได้) พร้อมผลวิเคราะห์ที่อยู่ (ถ้ามี)
+
+        message: ข้อความที่ normalize แล้ว ใช้เทียบ rule, original_message: ใช้แยกชื่อ/ที่อยู่
+        """
+        resolved_intent = self.order_flow.resolve(stage, message)
+        address_info = None
+        if resolved_intent is None and stage.expects_address:
+            address_info = self._analyze_address(original_message)
+            if address_info['has_name'] and address_info['has_address'] and address_info['has_phone']:
+                resolved_intent = "address_received"
+        return resolved_intent, address_info
+
+    @staticmethod
+    def _decided_by(intent_result: IntentResult, classified_intent: str, used_intent: str, degraded: bool) -> str:
+        """ขั้นตอนที่ตัดสิน intent สุดท้ายของข้อความ"""
+        if intent_result.source in ('order_flow', 'quick_reply'):
+            return intent_result.source
+        if used_intent != classified_intent:
+            return 'rules'
+        if degraded:
+            return 'degraded'
+        if used_intent == 'smart_fallback':
+            return 'fallback'
+        return 'gpt'
+
+    def resolves_without_gpt(self, message: str, last_intent: str = None) -> bool:
+        """ข้อความแรกของบทสนทนาใหม่ (last_intent ที่กำหนด) ตัดสินได้จาก order flow โดยไม่เรียก GPT หรือไม่"""
+        normalized = normalize_text(message) if self.normalize_messages else message.lower()
+        stage = self.order_flow.stage_for(self._new_user_context(last_intent))
+        return self._resolve_by_flow(stage, normalized, message)[0] is not None
+
+    def classify_conversation(self, messages: List[str], last_intent: str = None,
+                              user_id: str = "batch") -> List[Dict[str, Any]]:
+        """ประมวลผลข้อความต่อเนื่องด้วย context แยก (ไม่กระทบลูกค้าจริง) คืนผลและเวลาที่ใช้ของแต่ละข้อความ"""
+        user_context = self._new_user_context(last_intent)
+        results = []
+        for message in messages:
+            started = time.perf_counter()
+            result = self.process_message(message, user_id=user_id, user_context=user_context)
+            results.append({
+                'text': message,
+                'detected_intent': result['detected_intent'],
+                'confidence': result['confidence'],
+                'used_intent': result['used_intent'],
+                'decided_by': result['decided_by'],
+                'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+                'reply': result['reply']
+            })
+        return results
+
+    @staticmethod
+    def _order_for_update(user_context: Dict[str, Any]) -> Dict[str, Any]:
+        """order_info ที่จะบันทึกสี/จำนวนลงไป ถ้าออเดอร์เดิมบันทึกลง ledger แล้วให้เริ่มออเดอร์ใหม่ (order_id ใหม่)"""
+        if user_context['order_info'].get('order_id'):
+            user_context['order_info'] = {}
+        return user_context['order_info']
+
+    @staticmethod
+    def _order_editable(order_info: Dict[str, Any]) -> bool:
+        """ยังแก้ที่อยู่ของออเดอร์ได้ (ยังไม่ได้รับชำระเงิน)"""
+        return order_info.get('status') != OrderLedger.STATUS_PAID
+
+    def _record_order(self, user_id: str, order_info: Dict[str, Any]) -> None:
+        """ส่งออเดอร์ไปบันทึกใน ledger (ไม่บล็อก) บันทึกซ้ำด้วย order_id เดิมจะอัพเดทแถวเดิม"""
+        order_id = order_info.setdefault('order_id', uuid.uuid4().hex)
+        payment_method = order_info.get('payment_method', 'cod')
+        order_info['status'] = OrderLedger.STATUS_PENDING_SHIPMENT if payment_method == 'cod' \
+            else OrderLedger.STATUS_AWAITING_PAYMENT
+        quantity = order_info.get('total_quantity', 0)
+        totals = self._calculate_price(quantity) if quantity > 0 else {}
+        self.order_ledger.record({
+            'order_id': order_id,
+            'page_id': self.page_id,
+            'sender_id': user_id,
+            'status': order_info['status'],
+            'colors': order_info.get('colors', []),
+            'size': order_info.get('size'),
+            'total_quantity': quantity,
+            'price': totals.get('price'),
+            'shipping': totals.get('shipping'),
+            'total': totals.get('total'),
+            'payment_method': payment_method,
+            'address_info': order_info.get('address_info'),
+        })
+
     def _get_image_url(self, intent: str, message: str) -> str:
         """ดึง URL รูปภาพตาม intent และข้อความ"""
         if not self.product_images:
@@ -912,14 +1559,132 @@ Intent ที่มีให้เลือก:
 
             user_context['order_info']['colors'] = colors_list
 
+    def set_manual_mode(self, user_id: str, enabled: bool = True, expires_in: float = None) -> None:
+        """เปิด/ปิด manual mode ของ user (ให้แอดมินตอบเอง) พร้อมอัพเดท index
+
+        expires_in: ให้บอทกลับมาตอบเองหลังจากนี้กี่วินาที (None = จนกว่าแอดมินจะรีเซ็ต)
+        """
+        user_context = self._get_user_context(user_id)
+        user_context['manual_mode'] = enabled
+        user_context['manual_until'] = time.time() + expires_in if enabled and expires_in else None
+        self.context_index.set_manual(user_id, enabled)
+
+    def extend_manual_mode(self, user_id: str, expires_in: float) -> bool:
+        """เปิด manual mode อย่างน้อย expires_in วินาที (แอดมินตอบเอง) คืนค่า True ถ้าเพิ่งเปิด
+
+        ไม่ย่อ manual mode ที่มีอยู่: แบบไม่มีกำหนด (manual_until=None) หรือหมดเวลาช้ากว่าคงไว้ตามเดิม
+        """
+        user_context = self._get_user_context(user_id)
+        if not self._manual_mode_active(user_id, user_context):
+            self.set_manual_mode(user_id, True, expires_in=expires_in)
+            return True
+        manual_until = user_context.get('manual_until')
+        if manual_until is not None and manual_until < time.time() + expires_in:
+            user_context['manual_until'] = time.time() + expires_in
+        return False
+
     def reset_manual_mode(self, user_id: str) -> bool:
         """รีเซ็ต manual mode สำหรับ user คืนค่า True ถ้าสำเร็จ"""
         if user_id in self.user_contexts:
             self.user_contexts[user_id]['manual_mode'] = False
+            self.user_contexts[user_id]['manual_until'] = None
+            self.context_index.set_manual(user_id, False)
             return True
         return False
 
+    def _manual_mode_active(self, user_id: str, user_context: Dict[str, Any]) -> bool:
+        """manual mode ยังมีผลอยู่ไหม (ปิดให้เองเมื่อเลยเวลา manual_until)"""
+        if not user_context.get('manual_mode', False):
+            return False
+        manual_until = user_context.get('manual_until')
+        if manual_until is None or time.time() < manual_until:
+            return True
+        # context แยก (เช่น batch-classify) ไม่อยู่ใน user_contexts จึงไม่ต้องอัพเดท index
+        if self.user_contexts.get(user_id) is user_context:
+            self.reset_manual_mode(user_id)
+            self.metrics.incr("manual_mode.expired")
+        else:
+            user_context['manual_mode'] = False
+        return False
+
+    def follow_up_message(self, user_id: str, intent: str, restored: bool = False) -> Optional[Dict[str, Any]]:
+        """ข้อความตามลูกค้าที่ยังค้างอยู่ที่ intent (None = ลูกค้าไปต่อแล้ว/แอดมินดูแลอยู่/ไม่ได้ตั้งค่า)
+
+        ไม่มี context: ส่งเฉพาะ timer ที่โหลดจากไฟล์ (restored) ซึ่งบันทึกไว้ตอนลูกค้ายังค้างที่ intent นี้และไม่อยู่ใน manual mode
+        หลังเริ่มโปรเซสใหม่ ข้อความใหม่ของลูกค้าหรือการเปิด manual mode จะยกเลิก timer ก่อนถึงตรงนี้
+        """
+        follow_up = self.follow_ups.get(intent)
+        if not follow_up:
+            return None
+        user_context = self.user_contexts.get(user_id)
+        if user_context is None:
+            if not restored:
+                return None
+        elif user_context.get('last_intent') != intent or self._manual_mode_active(user_id, user_context):
+            return None
+        return {'text': follow_up['message'], 'quick_replies': self.quick_replies.get(intent)}
+
+    def expire_manual_mode(self) -> List[str]:
+        """ปิด manual mode ที่หมดเวลาแล้วของทุก user คืนรายชื่อที่ปิด"""
+        return [
+            user_id for user_id in self.context_index.manual_user_ids()
+            if user_id in self.user_contexts and not self._manual_mode_active(user_id, self.user_contexts[user_id])
+        ]
+
+    def bulk_reset_manual_mode(self, user_ids: List[str] = None) -> List[str]:
+        """รีเซ็ต manual mode หลาย user พร้อมกัน (ไม่ระบุ user_ids = ทุกคนที่อยู่ใน manual mode)"""
+        if user_ids is None:
+            user_ids = self.context_index.manual_user_ids()
+        return [user_id for user_id in user_ids if self.reset_manual_mode(user_id)]
+
     def get_manual_mode_status(self, user_id: str) -> bool:
-        """ตรวจสอบสถานะ manual mode ของ user"""
-        user_context = self._get_user_context(user_id)
-        return user_context.get('manual_mode', False)
+        """ตรวจสอบสถานะ manual mode ของ user (ไม่สร้าง context ใหม่)"""
+        user_context = self.user_contexts.get(user_id)
+        return bool(user_context) and self._manual_mode_active(user_id, user_context)
+
+    def in_order_funnel(self, user_id: str) -> bool:
+        """ลูกค้าอยู่ระหว่างขั้นตอนสั่งซื้อ (เลือกสี/ไซส์/ชำระเงิน/ที่อยู่) หรือไม่ (ไม่สร้าง context ใหม่)"""
+        user_context = self.user_contexts.get(user_id)
+        return bool(user_context) and self.order_flow.stage_for(user_context).in_funnel
+
+    def list_manual_mode_users(self, cursor: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """รายชื่อ user ที่อยู่ใน manual mode เรียงตามเวลาที่เข้า (แบ่งหน้าด้วย cursor)"""
+        self.expire_manual_mode()
+        return self.context_index.list_manual(cursor, limit)
+
+    def iter_context_columns(self, block_size: int = 5000):
+        """snapshot ของ user_contexts ทั้งหมดเป็นชุดคอลัมน์ ครั้งละไม่เกิน block_size คน (สำหรับ funnel analytics)
+
+        stage / path_stages เป็นลำดับของ stage ใน order_flow.stages
+        path_stages: stage ของข้อความลูกค้าใน conversation_history ต่อกันทุกคน แบ่งด้วย path_lengths
+        """
+        stage_index = {stage.name: index for index, stage in enumerate(self.order_flow.stages)}
+
+        def stage_of(intent: Optional[str]) -> int:
+            return stage_index[self.order_flow.stage_for({'last_intent': intent}).name]
+
+        # คัดลอกรายการก่อน ลูกค้าใหม่ที่เข้ามาระหว่าง export จะไม่อยู่ใน snapshot นี้
+        contexts = list(self.user_contexts.items())
+        for start in range(0, len(contexts), block_size):
+            block = {name: [] for name in (
+                'user_id', 'last_intent', 'stage', 'manual_mode', 'total_quantity', 'payment_method',
+                'has_address', 'path_lengths', 'path_stages'
+            )}
+            for user_id, user_context in contexts[start:start + block_size]:
+                order_info = user_context.get('order_info') or {}
+                path = [stage_of(turn.get('intent')) for turn in user_context.get('conversation_history', [])
+                        if turn.get('role') == 'user']
+                block['user_id'].append(user_id)
+                block['last_intent'].append(user_context.get('last_intent'))
+                block['stage'].append(stage_of(user_context.get('last_intent')))
+                block['manual_mode'].append(bool(user_context.get('manual_mode')))
+                block['total_quantity'].append(int(order_info.get('total_quantity') or 0))
+                block['payment_method'].append(order_info.get('payment_method'))
+                block['has_address'].append(bool(order_info.get('address_info')))
+                block['path_lengths'].append(len(path))
+                block['path_stages'].extend(path)
+            yield block
+
+    def list_users_by_intent(self, intent: str, cursor: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """รายชื่อ user ที่ last_intent ตรงกับ intent เรียงตามเวลาที่เข้าสู่ intent นั้น"""
+        return self.context_index.list_intent(intent, cursor, limit)
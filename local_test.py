@@ -7,6 +7,7 @@ Local Interactive Testing for Facebook Messenger Chatbot
 
 import os
 from intent_detector import IntentDetector
+from request_trace import Trace
 
 def main():
     """ฟังก์ชันหลัก - เริ่มทดสอบแบบ interactive"""
@@ -67,7 +68,7 @@ def main():
 
             # Process message
             try:
-                result = detector.process_message(user_input, user_id)
+                result = detector.process_message(user_input, user_id, trace=Trace())
 
                 # Show response
                 reply = result.get('reply')
@@ -81,7 +82,8 @@ def main():
                 used_intent = result.get('used_intent', 'unknown')
                 confidence = result.get('confidence', 0.0)
 
-                print(f"🔍 Debug: detected='{detected_intent}' → used='{used_intent}' (conf: {confidence:.2f})")
+                print(f"🔍 Debug: detected='{detected_intent}' → used='{used_intent}' (conf: {confidence:.2f}, decided_by: {result.get('decided_by')})")
+                print(f"⏱️  Trace: {result['trace'].finish().format()}")
 
                 # Show order info if available
                 order_info = result.get('order_info', {})
@@ -1,33 +1,370 @@
+import time
+
+# วัดเวลา import ของโมดูลนี้ (แสดงใน /readyz)
+_module_started = time.perf_counter()
+
+import asyncio
 import hashlib
 import hmac
 import json
 import os
-from typing import Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 
 import httpx
 from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from dotenv import load_dotenv
-
-from intent_detector import IntentDetector
 
-# โหลด environment variables
-load_dotenv()
-
-app = FastAPI(title="Facebook Messenger Chatbot", version="1.0.0")
+from faq import faq_stats
+from follow_ups import FollowUpScheduler
+from metrics import Metrics
+from model_router import ModelRouter
+from order_ledger import OrderLedger
+from page_registry import PageConfig, PageConversations, PageRegistry
+from rate_limiter import PriorityScheduler, SenderRateLimiter
+from request_trace import Trace
+from resilience import CircuitBreaker, ResilientCaller
+from token_budget import TokenBudget
+from webhook_events import ACTIONABLE, ADMIN_ECHO, BOT_MESSAGE_METADATA, PAYLOAD, classify_event, customer_id
+
+if TYPE_CHECKING:
+    # intent_detector ดึง openai มาด้วย จึง import จริงเมื่อสร้าง detector ครั้งแรกเท่านั้น
+    from intent_detector import IntentDetector
+
+# โหลด environment variables (บน Render ตั้งค่าผ่าน dashboard ไม่มีไฟล์ .env จึงไม่ต้องโหลด dotenv)
+if os.path.exists(".env"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Environment variables
 PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 APP_SECRET = os.getenv("APP_SECRET")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-# ตรวจสอบว่ามี environment variables ครบถ้วน
-if not all([PAGE_ACCESS_TOKEN, VERIFY_TOKEN, APP_SECRET, OPENAI_API_KEY]):
+# app ID ของบอท ใช้แยก echo ของบอทออกจากข้อความที่แอดมินตอบเอง (ไม่ตั้งก็ได้ บอทใส่ metadata ในข้อความที่ส่งไว้แล้ว)
+APP_ID = os.getenv("APP_ID")
+
+# โหมดคำตอบของ detect_intent: text, json_schema, function
+INTENT_OUTPUT_MODE = os.getenv("INTENT_OUTPUT_MODE", "function")
+INTENT_INCLUDE_REASON = os.getenv("INTENT_INCLUDE_REASON", "false").lower() == "true"
+
+# ส่งคำตอบ smart fallback ทีละประโยคระหว่างที่ GPT กำลังสร้าง
+STREAM_SMART_FALLBACK = os.getenv("STREAM_SMART_FALLBACK", "false").lower() == "true"
+STREAM_MAX_SEGMENTS = int(os.getenv("STREAM_MAX_SEGMENTS", "3"))
+
+# two_call = วิเคราะห์ intent แล้วค่อยสร้างคำตอบ, single_call = ให้ GPT ตอบมาพร้อมกันในครั้งเดียว
+FALLBACK_MODE = os.getenv("FALLBACK_MODE", "two_call")
+# จำนวนข้อเท็จจริงจาก business_context ที่ค้นมาใส่ใน prompt ของ smart fallback (0 = ใส่ข้อมูลร้านทั้งหมด)
+FALLBACK_TOP_FACTS = int(os.getenv("FALLBACK_TOP_FACTS", "6"))
+# ตอบคำถามที่พบบ่อย (FAQ จาก business_context) โดยไม่เรียก GPT เมื่อคะแนนความเหมือนถึง FAQ_MIN_SCORE (0-1)
+FAQ_ANSWERS = os.getenv("FAQ_ANSWERS", "true").lower() == "true"
+FAQ_MIN_SCORE = float(os.getenv("FAQ_MIN_SCORE", "0.6"))
+# จำนวนตัวอย่างจาก intent_examples.json ที่คล้ายข้อความลูกค้าที่สุดที่ใส่ใน prompt ของ detect_intent (0 = ไม่ใส่)
+FEW_SHOT_EXAMPLES = int(os.getenv("FEW_SHOT_EXAMPLES", "6"))
+
+# ย่อประวัติการสนทนาใน prompt ของ detect_intent ให้อยู่ใน token budget
+COMPACT_HISTORY = os.getenv("COMPACT_HISTORY", "true").lower() == "true"
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "300"))
+
+# ให้ GPT เลือกเฉพาะ intent ที่เป็นไปได้ในขั้นตอนการสั่งซื้อปัจจุบัน (ดู order_flow.py)
+NARROW_INTENTS = os.getenv("NARROW_INTENTS", "true").lower() == "true"
+
+# ทำข้อความลูกค้าเป็นรูปแบบมาตรฐาน (เลขไทย, ตัวอักษรเต็มความกว้าง, ตัวอักษรซ้ำ) ก่อนเทียบ rules
+NORMALIZE_MESSAGES = os.getenv("NORMALIZE_MESSAGES", "true").lower() == "true"
+
+# บันทึกออเดอร์ที่สั่งเสร็จลง SQLite (ว่าง = ไม่บันทึก)
+ORDER_DB_PATH = os.getenv("ORDER_DB_PATH", "orders.db")
+ORDER_WRITE_BATCH = int(os.getenv("ORDER_WRITE_BATCH", "50"))
+ORDER_FLUSH_SECONDS = float(os.getenv("ORDER_FLUSH_SECONDS", "1.0"))
+
+# เมื่อแอดมินตอบลูกค้าเองผ่าน inbox (ต้อง subscribe message_echoes) เปิด manual mode ของลูกค้าคนนั้น
+# และให้บอทกลับมาตอบเองหลังแอดมินตอบครั้งล่าสุดกี่วินาที (0 = ไม่เปิด manual mode อัตโนมัติ)
+ADMIN_REPLY_MANUAL_SECONDS = float(os.getenv("ADMIN_REPLY_MANUAL_SECONDS", "1800"))
+
+# จำกัดข้อความต่อลูกค้า (token bucket: ส่งติดกันได้ RATE_LIMIT_BURST ข้อความ แล้วเติม RATE_LIMIT_PER_MINUTE ต่อนาที, 0 = ไม่จำกัด)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "8"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+# ข้อความแจ้งลูกค้าเมื่อเกิน limit ครั้งแรก (ว่าง = เงียบ)
+RATE_LIMIT_REPLY = os.getenv("RATE_LIMIT_REPLY", "ขออภัยค่ะ ข้อความเข้ามาถี่เกินไป รอสักครู่แล้วส่งใหม่นะคะ")
+
+# ส่งข้อความตามลูกค้าที่หยุดกลางขั้นตอนสั่งซื้อ (ตั้งเวลาและข้อความในส่วน follow_up ของ replies.json)
+FOLLOW_UPS = os.getenv("FOLLOW_UPS", "true").lower() == "true"
+# ไฟล์เก็บ timer ที่ยังไม่ถึงเวลา ให้ส่งต่อได้หลังเริ่มโปรเซสใหม่ (ว่าง = ไม่บันทึก)
+# timer ในไฟล์คือลูกค้าที่ยังค้างที่ขั้นตอนเดิมและไม่อยู่ใน manual mode จึงส่งได้แม้ context จะหายไปหลังเริ่มใหม่
+FOLLOW_UP_SNAPSHOT = os.getenv("FOLLOW_UP_SNAPSHOT", "follow_ups.json")
+FOLLOW_UP_TICK_SECONDS = float(os.getenv("FOLLOW_UP_TICK_SECONDS", "5"))
+# ส่งครั้งละกี่ข้อความ และไม่เกินกี่ข้อความต่อวินาที (ไม่แย่ง Send API กับคำตอบปกติ)
+FOLLOW_UP_BATCH_SIZE = int(os.getenv("FOLLOW_UP_BATCH_SIZE", "20"))
+FOLLOW_UP_PER_SECOND = float(os.getenv("FOLLOW_UP_PER_SECOND", "10"))
+
+# งบ token ของ OpenAI (0 = ไม่จำกัด) ใช้ถึง TOKEN_BUDGET_ECONOMY_AT ของงบจะตัด prompt ให้สั้นลง ครบงบจะตอบ static fallback
+TOKEN_BUDGET_DAILY = int(os.getenv("TOKEN_BUDGET_DAILY", "0"))
+TOKEN_BUDGET_HOURLY = int(os.getenv("TOKEN_BUDGET_HOURLY", "0"))
+TOKEN_BUDGET_ECONOMY_AT = float(os.getenv("TOKEN_BUDGET_ECONOMY_AT", "0.8"))
+
+# พิมพ์เวลาแต่ละขั้นตอนของข้อความที่ใช้เวลารวมเกินค่านี้ (ms, 0 = ปิด trace)
+SLOW_REQUEST_TRACE_MS = float(os.getenv("SLOW_REQUEST_TRACE_MS", "0"))
+
+# Resilience ของการเรียก OpenAI
+OPENAI_DEADLINE_SECONDS = float(os.getenv("OPENAI_DEADLINE_SECONDS", "8"))
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "false").lower() == "true"
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "1.0"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# model / max_tokens / temperature / timeout ของแต่ละ call site และ model สำรอง (ดู model_routes.example.json)
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE", "model_routes.json")
+# พัก model ที่ error rate ล่าสุดถึงค่านี้ (0-1) เป็นเวลา MODEL_COOLDOWN_SECONDS แล้วใช้ model สำรองแทน
+MODEL_MAX_ERROR_RATE = float(os.getenv("MODEL_MAX_ERROR_RATE", "0.5"))
+MODEL_COOLDOWN_SECONDS = float(os.getenv("MODEL_COOLDOWN_SECONDS", "60"))
+
+# หลายเพจในโปรเซสเดียว (ดู pages.example.json) และ pool ที่ใช้ร่วมกันทุกเพจ
+PAGES_CONFIG = os.getenv("PAGES_CONFIG", "pages.json")
+PAGE_IDLE_TTL_SECONDS = float(os.getenv("PAGE_IDLE_TTL_SECONDS", "1800"))
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "50"))
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "16"))
+
+# lazy = โหลด detector เมื่อมีข้อความแรก, warm = โหลดใน background หลังเริ่ม server, eager = โหลดก่อนรับ request
+STARTUP_MODE = os.getenv("STARTUP_MODE", "warm")
+
+# /admin/batch-classify: จำนวนรายการสูงสุดต่อ request และจำนวนรายการที่เรียก GPT พร้อมกัน
+BATCH_CLASSIFY_MAX_ITEMS = int(os.getenv("BATCH_CLASSIFY_MAX_ITEMS", "2000"))
+BATCH_CLASSIFY_CONCURRENCY = int(os.getenv("BATCH_CLASSIFY_CONCURRENCY", "4"))
+
+GRAPH_API_URL = "https://graph.facebook.com/v18.0/me/messages"
+ADMIN_PAGE_LIMIT = 500  # จำนวนรายการสูงสุดต่อหน้าของ admin list endpoints
+
+# ตรวจสอบว่ามี environment variables ครบถ้วน (โหมดหลายเพจใช้ token จาก PAGES_CONFIG แทน PAGE_ACCESS_TOKEN)
+if not all([PAGE_ACCESS_TOKEN or os.path.exists(PAGES_CONFIG), VERIFY_TOKEN, APP_SECRET, OPENAI_API_KEY]):
     print("Warning: Some environment variables are missing. Check your .env file.")
 
-# สร้าง Intent Detector
-intent_detector = IntentDetector(OPENAI_API_KEY) if OPENAI_API_KEY else None
+
+# ทรัพยากรที่ใช้ร่วมกันทุกเพจ
+metrics = Metrics()
+resilience = ResilientCaller(
+    breaker=CircuitBreaker(
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_SECONDS,
+        metrics=metrics
+    ),
+    metrics=metrics,
+    deadline=OPENAI_DEADLINE_SECONDS,
+    hedge=OPENAI_HEDGE,
+    hedge_min_delay=OPENAI_HEDGE_MIN_DELAY,
+    concurrency=WORKER_POOL_SIZE
+)
+model_router = ModelRouter(
+    MODEL_ROUTES_FILE,
+    max_error_rate=MODEL_MAX_ERROR_RATE,
+    cooldown=MODEL_COOLDOWN_SECONDS,
+    metrics=metrics
+)
+token_budget = TokenBudget(
+    daily_budget=TOKEN_BUDGET_DAILY,
+    hourly_budget=TOKEN_BUDGET_HOURLY,
+    economy_at=TOKEN_BUDGET_ECONOMY_AT,
+    metrics=metrics
+)
+order_ledger = OrderLedger(
+    ORDER_DB_PATH,
+    batch_size=ORDER_WRITE_BATCH,
+    flush_interval=ORDER_FLUSH_SECONDS,
+    metrics=metrics
+) if ORDER_DB_PATH else None
+worker_pool = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix="detector")
+# ข้อความของลูกค้าที่อยู่ระหว่างสั่งซื้อได้ใช้ worker ก่อนเมื่อ pool เต็ม
+scheduler = PriorityScheduler(WORKER_POOL_SIZE, metrics=metrics)
+rate_limiter = SenderRateLimiter(
+    burst=RATE_LIMIT_BURST,
+    per_minute=RATE_LIMIT_PER_MINUTE,
+    metrics=metrics
+) if RATE_LIMIT_BURST > 0 else None
+follow_up_scheduler = FollowUpScheduler(
+    snapshot_path=FOLLOW_UP_SNAPSHOT or None,
+    tick=FOLLOW_UP_TICK_SECONDS,
+    metrics=metrics
+) if FOLLOW_UPS else None
+graph_client: Optional[httpx.AsyncClient] = None
+# detector_ready: สร้าง detector ได้สำเร็จแล้วอย่างน้อยหนึ่งครั้ง (import openai และอ่านไฟล์ข้อมูลร้านได้)
+startup_state = {'detector_ready': False, 'graph_warmed': False, 'warmup_ms': None}
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+def get_openai_client():
+    """สร้าง OpenAI client ร่วมกันเมื่อใช้งานครั้งแรก (import openai ช้า จึงไม่ทำตอนเริ่มโปรเซส)"""
+    global _openai_client
+    if _openai_client is None and OPENAI_API_KEY:
+        with _openai_lock:
+            if _openai_client is None:
+                import openai
+                _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+def create_detector(page: PageConfig, conversations: PageConversations) -> "IntentDetector":
+    """สร้าง Intent Detector ของเพจ โดยใช้ OpenAI client, metrics และ circuit breaker ร่วมกัน
+
+    context ของลูกค้า (conversations) เป็นของ PageRegistry ใช้ต่อได้เมื่อ detector ถูกปลดแล้วโหลดใหม่
+    """
+    from intent_detector import IntentDetector
+
+    return IntentDetector(
+        replies_file=page.replies_file,
+        context_file=page.context_file,
+        images_file=page.images_file,
+        examples_file=page.examples_file,
+        client=get_openai_client(),
+        intent_output_mode=INTENT_OUTPUT_MODE,
+        include_reason=INTENT_INCLUDE_REASON,
+        stream_fallback=STREAM_SMART_FALLBACK,
+        max_stream_segments=STREAM_MAX_SEGMENTS,
+        fallback_mode=FALLBACK_MODE,
+        metrics=metrics,
+        resilience=resilience,
+        compact_history=COMPACT_HISTORY,
+        history_token_budget=HISTORY_TOKEN_BUDGET,
+        narrow_intents=NARROW_INTENTS,
+        order_ledger=order_ledger,
+        page_id=page.page_id,
+        normalize_messages=NORMALIZE_MESSAGES,
+        token_budget=token_budget,
+        fallback_top_facts=FALLBACK_TOP_FACTS,
+        faq_answers=FAQ_ANSWERS,
+        faq_min_score=FAQ_MIN_SCORE,
+        model_router=model_router,
+        few_shot_examples=FEW_SHOT_EXAMPLES,
+        user_contexts=conversations.user_contexts,
+        context_index=conversations.context_index
+    )
+
+page_registry = PageRegistry(
+    create_detector,
+    config_file=PAGES_CONFIG,
+    idle_ttl=PAGE_IDLE_TTL_SECONDS,
+    default_access_token=PAGE_ACCESS_TOKEN
+)
+
+def get_detector(page_id: Optional[str] = None) -> Optional["IntentDetector"]:
+    """ดึง Intent Detector ของเพจ (None ถ้ายังไม่ได้ตั้งค่า OpenAI หรือไม่รู้จักเพจ)
+
+    การสร้างครั้งแรกอาจใช้เวลา (import openai + อ่านไฟล์ JSON) ให้เรียกจาก worker pool
+    """
+    if not OPENAI_API_KEY:
+        return None
+    detector = page_registry.get_detector(page_id)
+    if detector is not None:
+        startup_state['detector_ready'] = True
+    return detector
+
+async def get_detector_async(page_id: Optional[str] = None) -> Optional["IntentDetector"]:
+    """get_detector ที่ไม่บล็อก event loop ระหว่างโหลด (เพจที่โหลดแล้วคืนทันที ไม่ใช้ lock)"""
+    detector = page_registry.loaded_detector(page_id) if OPENAI_API_KEY else None
+    if detector is not None:
+        return detector
+    return await asyncio.get_running_loop().run_in_executor(worker_pool, get_detector, page_id)
+
+async def _warm_up() -> None:
+    """โหลด detector ของเพจหลักและเปิด connection ไปยัง Graph API ล่วงหน้า"""
+    started = time.perf_counter()
+    try:
+        await get_detector_async()
+        # เปิด TLS connection ไว้ใน pool ก่อนมีข้อความจริง (สถานะที่ตอบกลับไม่สำคัญ)
+        await graph_client.get(GRAPH_API_URL)
+        startup_state['graph_warmed'] = True
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+    startup_state['warmup_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Warm-up finished in {startup_state['warmup_ms']}ms")
+
+async def _evict_idle_pages() -> None:
+    """ปลด detector ของเพจที่ไม่มีการใช้งานเป็นระยะ"""
+    while True:
+        await asyncio.sleep(60)
+        page_registry.evict_idle()
+
+async def _send_follow_up(timer: Dict[str, Any]) -> None:
+    """ส่งข้อความตามลูกค้าหนึ่งคน (ข้ามถ้าลูกค้าไปต่อแล้วหรือแอดมินดูแลอยู่)"""
+    intent_detector = await get_detector_async(timer['page_id'])
+    follow_up = intent_detector.follow_up_message(timer['user_id'], timer['intent'], timer.get('restored', False)) \
+        if intent_detector else None
+    if not follow_up:
+        metrics.incr("follow_up.skipped")
+        return
+    sent = await send_message(timer['user_id'], follow_up['text'], page_id=timer['page_id'],
+                              quick_replies=follow_up['quick_replies'])
+    metrics.incr("follow_up.sent" if sent else "follow_up.failed")
+
+async def _deliver_follow_ups() -> None:
+    """ส่งข้อความตามลูกค้าที่ครบกำหนดเป็นชุด ชุดละ FOLLOW_UP_BATCH_SIZE ไม่เกิน FOLLOW_UP_PER_SECOND ข้อความต่อวินาที"""
+    while True:
+        await asyncio.sleep(FOLLOW_UP_TICK_SECONDS)
+        try:
+            due = follow_up_scheduler.due()
+            for start in range(0, len(due), FOLLOW_UP_BATCH_SIZE):
+                batch = due[start:start + FOLLOW_UP_BATCH_SIZE]
+                started = time.monotonic()
+                await asyncio.gather(*(_send_follow_up(timer) for timer in batch))
+                await asyncio.sleep(max(0.0, len(batch) / FOLLOW_UP_PER_SECOND - (time.monotonic() - started)))
+            follow_up_scheduler.save()
+        except Exception as e:
+            print(f"Error delivering follow-ups: {e}")
+
+def _track_follow_up(sender_id: str, intent_detector: "IntentDetector", intent: str) -> None:
+    """ตั้งเวลาตามลูกค้าเมื่อค้างอยู่ที่ intent ที่มี follow_up และยกเลิกเมื่อไปขั้นตอนอื่น
+
+    ใช้ page_id ของ detector (เพจที่ resolve แล้ว) เป็น key เพื่อให้ endpoint ที่ไม่ระบุ page_id ยกเลิกได้ตรงกัน
+    """
+    if not follow_up_scheduler:
+        return
+    follow_up = intent_detector.follow_ups.get(intent)
+    if follow_up:
+        follow_up_scheduler.schedule(intent_detector.page_id, sender_id, intent, follow_up['delay'])
+    else:
+        follow_up_scheduler.cancel(intent_detector.page_id, sender_id)
+
+def _cancel_follow_ups(intent_detector: "IntentDetector", user_ids: List[str]) -> None:
+    """ยกเลิกข้อความตามลูกค้าเมื่อแอดมินเปลี่ยน manual mode (แอดมินดูแลแล้ว ข้อความตามขั้นตอนเดิมไม่ตรงแล้ว)"""
+    if follow_up_scheduler:
+        for user_id in user_ids:
+            follow_up_scheduler.cancel(intent_detector.page_id, user_id)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """เปิด Graph connection pool ร่วมกันตอนเริ่ม และปิดตอนหยุด"""
+    global graph_client
+    graph_client = httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_connections=GRAPH_MAX_CONNECTIONS, max_keepalive_connections=GRAPH_MAX_CONNECTIONS)
+    )
+    eviction_task = asyncio.create_task(_evict_idle_pages())
+    follow_up_task = None
+    if follow_up_scheduler:
+        follow_up_scheduler.load()
+        follow_up_task = asyncio.create_task(_deliver_follow_ups())
+    warmup_task = None
+    if STARTUP_MODE == "eager":
+        await _warm_up()
+    elif STARTUP_MODE == "warm":
+        warmup_task = asyncio.create_task(_warm_up())
+    try:
+        yield
+    finally:
+        eviction_task.cancel()
+        if warmup_task:
+            warmup_task.cancel()
+        if follow_up_task:
+            follow_up_task.cancel()
+            follow_up_scheduler.save(force=True)
+        await graph_client.aclose()
+        worker_pool.shutdown(wait=False)
+        if order_ledger:
+            order_ledger.close()
+
+app = FastAPI(title="Facebook Messenger Chatbot", version="1.0.0", lifespan=lifespan)
 
 class WebhookEntry(BaseModel):
     object: str
@@ -46,18 +383,43 @@ def verify_signature(payload: bytes, signature: str) -> bool:
 
     return hmac.compare_digest(f"sha256={expected_signature}", signature)
 
-async def send_message(recipient_id: str, message: str = None, image_url: str = None) -> bool:
-    """ส่งข้อความหรือรูปภาพกลับไปยังผู้ใช้ผ่าน Facebook Send API"""
-    if not PAGE_ACCESS_TOKEN:
-        print("PAGE_ACCESS_TOKEN not found")
+async def _post_to_graph(data: Dict[str, Any], description: str, page_id: Optional[str] = None) -> bool:
+    """ส่ง request ไปยัง Facebook Send API ด้วย token ของเพจ"""
+    access_token = page_registry.get_access_token(page_id)
+    if not access_token:
+        print(f"Access token for page {page_id} not found")
         return False
 
-    url = f"https://graph.facebook.com/v18.0/me/messages"
+    url = GRAPH_API_URL
 
     headers = {
         "Content-Type": "application/json"
     }
 
+    data["access_token"] = access_token
+
+    try:
+        if graph_client is not None:
+            response = await graph_client.post(url, json=data, headers=headers)
+        else:
+            async with httpx.AsyncClient() as client:
+                response = await client.post(url, json=data, headers=headers)
+
+        startup_state['graph_warmed'] = True
+        if response.status_code == 200:
+            print(f"{description} sent successfully to {data['recipient']['id']}")
+            return True
+        else:
+            print(f"Failed to send {description.lower()}: {response.status_code} - {response.text}")
+            return False
+
+    except Exception as e:
+        print(f"Error sending {description.lower()}: {e}")
+        return False
+
+async def send_message(recipient_id: str, message: str = None, image_url: str = None, page_id: Optional[str] = None,
+                       quick_replies: Optional[List[Dict[str, str]]] = None) -> bool:
+    """ส่งข้อความหรือรูปภาพกลับไปยังผู้ใช้ผ่าน Facebook Send API (ข้อความแนบปุ่ม quick reply ได้)"""
     # สร้าง message payload ตามประเภทที่ส่ง
     if image_url:
         message_content = {
@@ -71,70 +433,169 @@ async def send_message(recipient_id: str, message: str = None, image_url: str =
         }
     else:
         message_content = {"text": message}
+        if quick_replies:
+            message_content["quick_replies"] = quick_replies
+
+    # echo ของข้อความนี้จะมี metadata เดียวกัน ใช้แยกจากข้อความที่แอดมินตอบเอง
+    message_content["metadata"] = BOT_MESSAGE_METADATA
 
     data = {
         "recipient": {"id": recipient_id},
-        "message": message_content,
-        "access_token": PAGE_ACCESS_TOKEN
+        "message": message_content
     }
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
+    return await _post_to_graph(data, "Message", page_id)
 
-            if response.status_code == 200:
-                print(f"Message sent successfully to {recipient_id}")
-                return True
-            else:
-                print(f"Failed to send message: {response.status_code} - {response.text}")
-                return False
+async def send_sender_action(recipient_id: str, action: str, page_id: Optional[str] = None) -> bool:
+    """ส่ง sender action (mark_seen, typing_on, typing_off) ไปยังผู้ใช้"""
+    data = {
+        "recipient": {"id": recipient_id},
+        "sender_action": action
+    }
 
-    except Exception as e:
-        print(f"Error sending message: {e}")
-        return False
+    return await _post_to_graph(data, f"Sender action {action}", page_id)
 
-async def process_message(sender_id: str, message_text: str):
-    """ประมวลผลข้อความและส่งกลับ"""
-    print(f"Processing message from {sender_id}: {message_text}")
+async def _acknowledge_message(recipient_id: str, page_id: Optional[str] = None) -> None:
+    """แจ้งลูกค้าว่าอ่านแล้วและกำลังพิมพ์ ระหว่างที่บอทกำลังวิเคราะห์ข้อความ"""
+    await send_sender_action(recipient_id, "mark_seen", page_id)
+    await send_sender_action(recipient_id, "typing_on", page_id)
 
+async def process_message(sender_id: str, message_text: str, page_id: Optional[str] = None,
+                          payload: Optional[str] = None):
+    """ประมวลผลข้อความ (หรือ payload ของปุ่มที่ลูกค้ากด) และส่งกลับ"""
+    print(f"Processing message from {sender_id} on page {page_id}: {message_text}"
+          + (f" (payload {payload})" if payload else ""))
+
+    # จับเวลาแต่ละขั้นตอนเมื่อเปิด SLOW_REQUEST_TRACE_MS
+    trace = Trace() if SLOW_REQUEST_TRACE_MS > 0 else None
+
+    def traced(stage: str):
+        return trace.stage(stage) if trace else nullcontext()
+
+    with traced("get_detector"):
+        intent_detector = await get_detector_async(page_id)
     if not intent_detector:
-        await send_message(sender_id, "ระบบไม่พร้อมใช้งาน กรุณาลองใหม่ภายหลัง")
+        await send_message(sender_id, "ระบบไม่พร้อมใช้งาน กรุณาลองใหม่ภายหลัง", page_id=page_id)
         return
 
+    # ส่งข้อความถี่เกิน limit: แจ้งครั้งแรกแล้วเงียบ (ไม่เรียก GPT) จนกว่า bucket จะเติม
+    if rate_limiter:
+        decision = rate_limiter.check(f"{page_id}:{sender_id}")
+        if decision != SenderRateLimiter.ALLOW:
+            print(f"Rate limited {sender_id} on page {page_id}: {decision}")
+            if decision == SenderRateLimiter.THROTTLE and RATE_LIMIT_REPLY \
+                    and not intent_detector.get_manual_mode_status(sender_id):
+                await send_message(sender_id, RATE_LIMIT_REPLY, page_id=page_id)
+            return
+
+    # ส่ง mark_seen + typing_on ใน background โดยไม่รอ ให้การวิเคราะห์เริ่มทันที
+    typing_task = asyncio.create_task(_acknowledge_message(sender_id, page_id))
+    replied = False
+    loop = asyncio.get_running_loop()
+
+    async def send_segment(segment: str) -> bool:
+        await typing_task
+        with traced("send_message"):
+            return await send_message(sender_id, segment, page_id=page_id)
+
+    def deliver_segment(segment: str) -> None:
+        """ส่งคำตอบ streaming ทีละประโยคจาก worker thread (รอส่งเสร็จเพื่อรักษาลำดับข้อความ)"""
+        nonlocal replied
+        replied = asyncio.run_coroutine_threadsafe(send_segment(segment), loop).result() or replied
+
     try:
-        # วิเคราะห์ intent และได้รับข้อความตอบกลับ
-        result = intent_detector.process_message(message_text, user_id=sender_id)
+        # วิเคราะห์ intent และได้รับข้อความตอบกลับ (รันใน worker pool ร่วม เพื่อไม่บล็อก event loop)
+        priority = PriorityScheduler.FUNNEL if intent_detector.in_order_funnel(sender_id) else PriorityScheduler.DEFAULT
+        queued = time.perf_counter()
+        async with scheduler.slot(priority):
+            if trace:
+                trace.add_stage("scheduler_wait", (time.perf_counter() - queued) * 1000)
+            with traced("worker"):
+                result = await loop.run_in_executor(worker_pool, partial(
+                    intent_detector.process_message, message_text, user_id=sender_id,
+                    reply_callback=deliver_segment, trace=trace, payload=payload
+                ))
+        result.pop('trace', None)
 
         # Log ผลลัพธ์
         print(f"Intent analysis result: {json.dumps(result, ensure_ascii=False, indent=2)}")
 
+        # รอให้ typing_on ส่งเสร็จก่อน เพื่อไม่ให้ typing แสดงหลังข้อความตอบกลับ
+        await typing_task
+
+        _track_follow_up(sender_id, intent_detector, result.get('used_intent'))
+
         # ตรวจสอบ manual mode - ถ้าเป็น manual mode ไม่ต้องส่งข้อความ
         if result.get('used_intent') == 'manual_mode':
             print(f"User {sender_id} is in manual mode - bot will not respond")
             return
 
+        # คำตอบถูกส่งไปทีละประโยคแล้วระหว่าง streaming
+        if result.get('streamed'):
+            return
 
         # ส่งข้อความตอบกลับ
-        if 'image_url' in result and result['image_url']:
-            # ส่งรูปภาพ
-            await send_message(sender_id, image_url=result['image_url'])
-            # ส่งข้อความตอบกลับ (ถ้ามี)
-            if result['reply']:
-                await send_message(sender_id, result['reply'])
-        else:
-            # ส่งเฉพาะข้อความ
-            if result['reply']:
-                await send_message(sender_id, result['reply'])
+        with traced("send_message"):
+            if 'image_url' in result and result['image_url']:
+                # ส่งรูปภาพ
+                replied = await send_message(sender_id, image_url=result['image_url'], page_id=page_id)
+                # ส่งข้อความตอบกลับ (ถ้ามี)
+                if result['reply']:
+                    replied = await send_message(sender_id, result['reply'], page_id=page_id,
+                                                 quick_replies=result.get('quick_replies')) or replied
+            else:
+                # ส่งเฉพาะข้อความ
+                if result['reply']:
+                    replied = await send_message(sender_id, result['reply'], page_id=page_id,
+                                                 quick_replies=result.get('quick_replies'))
 
     except Exception as e:
         print(f"Error processing message: {e}")
-        await send_message(sender_id, "เกิดข้อผิดพลาด กรุณาลองใหม่อีกครั้ง")
+        await typing_task
+        replied = await send_message(sender_id, "เกิดข้อผิดพลาด กรุณาลองใหม่อีกครั้ง", page_id=page_id)
+
+    finally:
+        # ไม่ได้ส่งข้อความตอบกลับ (เช่น manual mode) ให้ปิด typing indicator
+        if not replied:
+            await send_sender_action(sender_id, "typing_off", page_id)
+
+        if trace and trace.finish().total_ms >= SLOW_REQUEST_TRACE_MS:
+            metrics.incr("slow_requests")
+            print(f"Slow request from {sender_id} on page {page_id}: {trace.format()}")
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"status": "ok", "message": "Facebook Messenger Chatbot is running"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: โปรเซสทำงานอยู่ (ไม่รอโหลด detector)"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: warm-up เสร็จแล้ว (สร้าง detector ได้ และ OpenAI/Graph clients พร้อมใช้งาน)
+
+    ไม่ดูว่าตอนนี้มี detector อยู่ในหน่วยความจำไหม เพจที่ถูกปลดเพราะไม่มีการใช้งานโหลดใหม่ได้ทันที
+    graph_warmed (เปิด connection ไป Graph API แล้วหรือยัง) เป็นข้อมูลประกอบเท่านั้น
+    warm-up ยิงครั้งเดียวและโหมด lazy ไม่ได้ยิง pool เปิด connection เองเมื่อส่งข้อความแรก
+    """
+    checks = {
+        "detector_ready": startup_state['detector_ready'],
+        "openai_client": _openai_client is not None,
+        "graph_pool": graph_client is not None
+    }
+    body = {
+        "status": "ready" if all(checks.values()) else "starting",
+        "checks": checks,
+        "graph_warmed": startup_state['graph_warmed'],
+        "startup_mode": STARTUP_MODE,
+        "import_ms": IMPORT_MS,
+        "warmup_ms": startup_state['warmup_ms']
+    }
+    return JSONResponse(status_code=200 if all(checks.values()) else 503, content=body)
+
 @app.get("/webhook")
 async def verify_webhook(request: Request):
     """Webhook verification สำหรับ Facebook"""
@@ -169,15 +630,37 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
         # ประมวลผล webhook entries
         if data.get("object") == "page":
             for entry in data.get("entry", []):
-                for messaging in entry.get("messaging", []):
-
-                    # ตรวจสอบว่าเป็นข้อความที่เข้ามา
-                    if "message" in messaging and "text" in messaging["message"]:
-                        sender_id = messaging["sender"]["id"]
-                        message_text = messaging["message"]["text"]
+                # entry.id คือ page ID ใช้เลือก detector และ token ของเพจนั้น
+                page_id = page_registry.resolve_page_id(entry.get("id"))
+                if page_id is None:
+                    print(f"Ignoring webhook entry for unknown page {entry.get('id')}")
+                    continue
 
-                        # ประมวลผลข้อความใน background
-                        background_tasks.add_task(process_message, sender_id, message_text)
+                for messaging in entry.get("messaging", []):
+                    # แยกประเภท event ก่อน: delivery / read / reaction / สติกเกอร์ / echo ของบอทเอง ทิ้งทันที
+                    kind = classify_event(messaging, APP_ID)
+                    metrics.incr(f"webhook.{kind}")
+                    if kind not in ACTIONABLE:
+                        continue
+
+                    message = messaging.get("message", {})
+                    postback = messaging.get("postback")
+                    sender_id = customer_id(messaging, kind)
+
+                    # แอดมินตอบลูกค้าเอง: ให้บอทหยุดตอบลูกค้าคนนี้ชั่วคราว
+                    if kind == ADMIN_ECHO:
+                        if ADMIN_REPLY_MANUAL_SECONDS > 0 and sender_id:
+                            background_tasks.add_task(handle_admin_reply, sender_id, page_id)
+
+                    # ปุ่ม quick reply / postback: ใช้ payload ตัดสินขั้นตอนถัดไปโดยไม่เรียก GPT
+                    elif kind == PAYLOAD:
+                        payload = (message.get("quick_reply") or postback).get("payload")
+                        title = message.get("text") or (postback or {}).get("title", "")
+                        background_tasks.add_task(process_message, sender_id, title, page_id, payload)
+
+                    # ข้อความที่เข้ามา: ประมวลผลข้อความใน background
+                    else:
+                        background_tasks.add_task(process_message, sender_id, message["text"], page_id)
 
         return {"status": "ok"}
 
@@ -185,27 +668,142 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
         print(f"Error processing webhook: {e}")
         raise HTTPException(status_code=400, detail="Bad request")
 
+async def handle_admin_reply(user_id: str, page_id: Optional[str] = None):
+    """แอดมินตอบลูกค้าเอง: เปิด manual mode และเลื่อนเวลาที่บอทจะกลับมาตอบออกไปทุกครั้งที่แอดมินตอบ
+
+    manual mode ที่แอดมินเปิดไว้แบบไม่มีกำหนดหรือนานกว่านี้ไม่ถูกย่อลง
+    """
+    intent_detector = await get_detector_async(page_id)
+    if not intent_detector:
+        return
+    if intent_detector.extend_manual_mode(user_id, ADMIN_REPLY_MANUAL_SECONDS):
+        print(f"Admin replied to {user_id} on page {page_id}, switching to manual mode")
+    _cancel_follow_ups(intent_detector, [user_id])
+
 @app.post("/test-message")
 async def test_message(message: Dict[str, str]):
     """Endpoint สำหรับทดสอบการวิเคราะห์ intent โดยไม่ต้องใช้ Facebook"""
+    intent_detector = await get_detector_async(message.get("page_id"))
     if not intent_detector:
         raise HTTPException(status_code=500, detail="Intent detector not initialized")
 
     user_message = message.get("text", "")
-    if not user_message:
+    payload = message.get("payload")  # ทดสอบการกดปุ่ม quick reply
+    if not user_message and not payload:
         raise HTTPException(status_code=400, detail="Message text is required")
 
     try:
         # ใช้ test_user_id สำหรับการทดสอบ
         test_user_id = message.get("user_id", "test_user")
-        result = intent_detector.process_message(user_message, user_id=test_user_id)
+        result = await asyncio.get_running_loop().run_in_executor(
+            worker_pool, partial(intent_detector.process_message, user_message, user_id=test_user_id, payload=payload)
+        )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+async def _batch_classify_stream(intent_detector: "IntentDetector", items: List[Dict[str, Any]], concurrency: int):
+    """ประมวลผลแต่ละรายการด้วย context แยก ส่งผลกลับเป็น NDJSON ตามลำดับที่เสร็จ
+
+    รายการที่ order flow ตัดสินได้เองทำทันที รายการที่ต้องเรียก GPT ทำพร้อมกันไม่เกิน concurrency
+    และได้ worker หลังข้อความของลูกค้าจริง
+    """
+    loop = asyncio.get_running_loop()
+    gpt_slots = asyncio.Semaphore(concurrency)
+    local_slots = asyncio.Semaphore(concurrency)
+    finished: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    async def classify(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        messages = item.get("conversation") or [item.get("text", "")]
+        last_intent = item.get("last_intent")
+        local = len(messages) == 1 and intent_detector.resolves_without_gpt(messages[0], last_intent)
+        line = {"index": index, "id": item.get("id", index), "path": "local" if local else "gpt"}
+        item_started = time.perf_counter()
+        try:
+            async with (local_slots if local else gpt_slots), scheduler.slot(PriorityScheduler.BATCH):
+                turns = await loop.run_in_executor(worker_pool, partial(
+                    intent_detector.classify_conversation, messages, last_intent, f"batch:{index}"
+                ))
+            if "conversation" in item:
+                line["turns"] = turns
+            else:
+                line.update(turns[0])
+        except Exception as e:
+            line["error"] = str(e)
+        line["total_ms"] = round((time.perf_counter() - item_started) * 1000, 1)
+        return line
+
+    async def run(index: int, item: Dict[str, Any]) -> None:
+        await finished.put(await classify(index, item))
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    summary = {"local": 0, "gpt": 0, "errors": 0}
+    try:
+        for _ in tasks:
+            line = await finished.get()
+            summary[line["path"]] += 1
+            summary["errors"] += "error" in line
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+    finally:
+        # client ปิดการเชื่อมต่อกลางคัน: ยกเลิกรายการที่ยังไม่ได้เริ่ม
+        for task in tasks:
+            task.cancel()
+    summary.update(done=True, count=len(items), elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+    yield json.dumps(summary) + "\n"
+
+@app.post("/admin/batch-classify")
+async def batch_classify(request: Dict[str, Any]):
+    """Endpoint สำหรับตรวจ intent ของข้อความจำนวนมาก (เช่น หลังแก้ replies.json) ผลลัพธ์เป็น NDJSON
+
+    items: [{"id": ..., "text": "...", "last_intent": "..."} หรือ {"id": ..., "conversation": ["...", "..."]}]
+    แต่ละรายการใช้ context แยก ไม่กระทบลูกค้าจริงและไม่บันทึกออเดอร์
+    """
+    intent_detector = await get_detector_async(request.get("page_id"))
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+
+    items = request.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(items) > BATCH_CLASSIFY_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_CLASSIFY_MAX_ITEMS} items per request")
+    if not all(isinstance(item, dict) and (item.get("text") or item.get("conversation")) for item in items):
+        raise HTTPException(status_code=400, detail="Each item needs text or conversation")
+
+    concurrency = min(max(int(request.get("concurrency", BATCH_CLASSIFY_CONCURRENCY)), 1), BATCH_CLASSIFY_CONCURRENCY)
+    return StreamingResponse(
+        _batch_classify_stream(intent_detector, items, concurrency),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/admin/examples")
+async def add_intent_example(request: Dict[str, Any]):
+    """Endpoint สำหรับเพิ่ม/แก้ตัวอย่าง intent ใน intent_examples.json โดยไม่ต้อง deploy ใหม่
+
+    {"text": "เอา 2", "intent": "quantity_only", "stages": ["color_quantity"], "note": "..."} (stages, note ไม่บังคับ)
+    """
+    intent_detector = await get_detector_async(request.get("page_id"))
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+
+    text, intent = (request.get("text") or "").strip(), request.get("intent", "")
+    if not text or not intent:
+        raise HTTPException(status_code=400, detail="text and intent are required")
+    stages = request.get("stages")
+    if stages is not None and not isinstance(stages, list):
+        raise HTTPException(status_code=400, detail="stages must be a list")
+
+    try:
+        example = intent_detector.add_example(text, intent, stages, request.get("note"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "example": example, "count": len(intent_detector.example_bank.examples)}
+
 @app.post("/admin/reset-manual-mode")
 async def reset_manual_mode(request: Dict[str, str]):
     """Endpoint สำหรับแอดมินรีเซ็ต manual mode ของลูกค้า"""
+    intent_detector = await get_detector_async(request.get("page_id"))
     if not intent_detector:
         raise HTTPException(status_code=500, detail="Intent detector not initialized")
 
@@ -215,6 +813,7 @@ async def reset_manual_mode(request: Dict[str, str]):
 
     try:
         success = intent_detector.reset_manual_mode(user_id)
+        _cancel_follow_ups(intent_detector, [user_id])
         if success:
             return {"status": "success", "message": f"Manual mode reset for user {user_id}"}
         else:
@@ -223,8 +822,9 @@ async def reset_manual_mode(request: Dict[str, str]):
         raise HTTPException(status_code=500, detail=f"Error resetting manual mode: {str(e)}")
 
 @app.get("/admin/manual-mode-status/{user_id}")
-async def get_manual_mode_status(user_id: str):
+async def get_manual_mode_status(user_id: str, page_id: Optional[str] = None):
     """Endpoint สำหรับตรวจสอบสถานะ manual mode ของลูกค้า"""
+    intent_detector = await get_detector_async(page_id)
     if not intent_detector:
         raise HTTPException(status_code=500, detail="Intent detector not initialized")
 
@@ -238,6 +838,137 @@ async def get_manual_mode_status(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error checking manual mode status: {str(e)}")
 
+@app.post("/admin/set-manual-mode")
+async def set_manual_mode(request: Dict[str, Any]):
+    """Endpoint สำหรับแอดมินเปิด/ปิด manual mode ของลูกค้า"""
+    intent_detector = await get_detector_async(request.get("page_id"))
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+
+    user_id = request.get("user_id", "")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="User ID is required")
+
+    enabled = bool(request.get("enabled", True))
+    expires_in = request.get("expires_in")  # วินาที (ไม่ระบุ = จนกว่าจะรีเซ็ต)
+    intent_detector.set_manual_mode(user_id, enabled, expires_in=float(expires_in) if expires_in else None)
+    _cancel_follow_ups(intent_detector, [user_id])
+    return {"status": "success", "user_id": user_id, "manual_mode": enabled}
+
+@app.get("/admin/manual-mode-users")
+async def list_manual_mode_users(cursor: int = 0, limit: int = 50, page_id: Optional[str] = None):
+    """Endpoint สำหรับดูรายชื่อลูกค้าที่รอแอดมินตอบ (ส่ง next_cursor กลับมาเพื่อดึงหน้าถัดไป)"""
+    intent_detector = await get_detector_async(page_id)
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+    return intent_detector.list_manual_mode_users(cursor, max(1, min(limit, ADMIN_PAGE_LIMIT)))
+
+@app.get("/admin/users-by-intent/{intent}")
+async def list_users_by_intent(intent: str, cursor: int = 0, limit: int = 50, page_id: Optional[str] = None):
+    """Endpoint สำหรับดูรายชื่อลูกค้าที่ค้างอยู่ที่ intent หนึ่ง (เช่น address_incomplete)"""
+    intent_detector = await get_detector_async(page_id)
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+    result = intent_detector.list_users_by_intent(intent, cursor, max(1, min(limit, ADMIN_PAGE_LIMIT)))
+    result['intent'] = intent
+    return result
+
+@app.get("/admin/intent-counts")
+async def get_intent_counts(page_id: Optional[str] = None):
+    """Endpoint สำหรับดูจำนวนลูกค้าในแต่ละ intent และจำนวนที่อยู่ใน manual mode"""
+    intent_detector = await get_detector_async(page_id)
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+    intent_detector.expire_manual_mode()
+    return {
+        "manual_mode": len(intent_detector.context_index.manual),
+        "intents": intent_detector.context_index.intent_counts()
+    }
+
+@app.post("/admin/bulk-reset-manual-mode")
+async def bulk_reset_manual_mode(request: Dict[str, Any]):
+    """Endpoint สำหรับรีเซ็ต manual mode หลายคนพร้อมกัน ({"user_ids": [...]} หรือ {"all": true})"""
+    intent_detector = await get_detector_async(request.get("page_id"))
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+
+    user_ids = request.get("user_ids")
+    if not request.get("all") and not user_ids:
+        raise HTTPException(status_code=400, detail="user_ids or all=true is required")
+
+    reset = intent_detector.bulk_reset_manual_mode(None if request.get("all") else list(user_ids))
+    _cancel_follow_ups(intent_detector, reset)
+    return {"status": "success", "reset_count": len(reset), "user_ids": reset}
+
+@app.get("/admin/metrics")
+async def get_metrics():
+    """Endpoint สำหรับดูสถิติการเรียก GPT (latency, tokens, parse failures, circuit breaker)"""
+    snapshot = metrics.snapshot()
+    snapshot['circuit_breaker'] = resilience.breaker.state
+    snapshot['scheduler'] = scheduler.stats()
+    snapshot['faq'] = faq_stats(metrics)
+    snapshot['models'] = model_router.stats()
+    if follow_up_scheduler:
+        snapshot['follow_ups'] = follow_up_scheduler.stats()
+    return snapshot
+
+@app.get("/admin/token-usage")
+async def get_token_usage(top: int = 10):
+    """Endpoint สำหรับดูการใช้ token (รายชั่วโมง/รายวัน แยกตาม call site, intent, user) และโหมดของงบ"""
+    return token_budget.snapshot(top=min(max(top, 1), ADMIN_PAGE_LIMIT))
+
+@app.get("/admin/pages")
+async def get_pages():
+    """Endpoint สำหรับดูเพจที่ตั้งค่าไว้และเพจที่โหลดอยู่ในหน่วยความจำ"""
+    return page_registry.status()
+
+@app.get("/admin/orders")
+async def list_orders(cursor: int = 0, limit: int = 50, sender_id: Optional[str] = None, status: Optional[str] = None,
+                      page_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Endpoint สำหรับค้นหาออเดอร์ใน ledger (ใหม่สุดก่อน, วันที่รูปแบบ YYYY-MM-DD)"""
+    if not order_ledger:
+        raise HTTPException(status_code=404, detail="Order ledger is disabled")
+    query = partial(order_ledger.query, cursor, max(1, min(limit, ADMIN_PAGE_LIMIT)), sender_id=sender_id,
+                    status=status, page_id=page_id, date_from=date_from, date_to=date_to)
+    return await asyncio.get_running_loop().run_in_executor(worker_pool, query)
+
+@app.get("/admin/orders.csv")
+async def export_orders(sender_id: Optional[str] = None, status: Optional[str] = None, page_id: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Endpoint สำหรับส่งออกออเดอร์เป็น CSV แบบ streaming"""
+    if not order_ledger:
+        raise HTTPException(status_code=404, detail="Order ledger is disabled")
+    rows = order_ledger.iter_csv(sender_id=sender_id, status=status, page_id=page_id,
+                                 date_from=date_from, date_to=date_to)
+    return StreamingResponse(rows, media_type="text/csv",
+                             headers={"Content-Disposition": "attachment; filename=orders.csv"})
+
+@app.get("/admin/contexts.ndjson")
+async def export_contexts(page_id: Optional[str] = None, block_size: int = 5000):
+    """Endpoint สำหรับส่งออก snapshot ของ context ลูกค้าทุกคนแบบคอลัมน์ (NDJSON) ให้ funnel_analytics.py
+
+    บรรทัดแรกเป็น header (ชื่อ stage และจำนวนลูกค้า) บรรทัดถัดไปเป็นชุดคอลัมน์ครั้งละไม่เกิน block_size คน
+    """
+    intent_detector = await get_detector_async(page_id)
+    if not intent_detector:
+        raise HTTPException(status_code=500, detail="Intent detector not initialized")
+
+    def lines():
+        yield json.dumps({
+            "format": "columns",
+            "page_id": intent_detector.page_id,
+            "exported_at": time.time(),
+            "count": len(intent_detector.user_contexts),
+            "stages": [stage.name for stage in intent_detector.order_flow.stages]
+        }) + "\n"
+        for block in intent_detector.iter_context_columns(max(1, min(block_size, 50000))):
+            yield json.dumps(block, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": "attachment; filename=contexts.ndjson"})
+
+IMPORT_MS = round((time.perf_counter() - _module_started) * 1000, 1)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
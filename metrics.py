@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class Metrics:
+    """ตัวนับและสถิติเวลาแบบเบาๆ ใช้ร่วมกันทั้งโปรเซส (thread-safe)"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._window = window
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, Any] = {}
+        self._observations: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.time()
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """เพิ่มค่าตัวนับ"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: Any) -> None:
+        """ตั้งค่า gauge (ค่าปัจจุบัน เช่น สถานะ circuit breaker)"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """บันทึกค่าที่วัดได้ (เช่น latency, tokens) เก็บ count/sum/max และหน้าต่างล่าสุด"""
+        with self._lock:
+            obs = self._observations.get(name)
+            if obs is None:
+                obs = {'count': 0, 'sum': 0.0, 'max': 0.0, 'recent': deque(maxlen=self._window)}
+                self._observations[name] = obs
+            obs['count'] += 1
+            obs['sum'] += value
+            obs['max'] = max(obs['max'], value)
+            obs['recent'].append(value)
+
+    def count(self, name: str) -> int:
+        """จำนวนครั้งที่บันทึกค่า name ไว้"""
+        with self._lock:
+            obs = self._observations.get(name)
+            return obs['count'] if obs else 0
+
+    def percentile(self, name: str, pct: float) -> Optional[float]:
+        """คำนวณ percentile จากหน้าต่างค่าล่าสุด คืน None ถ้ายังไม่มีข้อมูล"""
+        with self._lock:
+            obs = self._observations.get(name)
+            if not obs or not obs['recent']:
+                return None
+            values = sorted(obs['recent'])
+        index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """สรุปค่าทั้งหมดเป็น dict สำหรับ admin endpoint"""
+        with self._lock:
+            observations = {
+                name: {
+                    'count': obs['count'],
+                    'avg': round(obs['sum'] / obs['count'], 3) if obs['count'] else 0.0,
+                    'max': round(obs['max'], 3),
+                }
+                for name, obs in self._observations.items()
+            }
+            result = {
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'observations': observations,
+            }
+        for name, obs in result['observations'].items():
+            p95 = self.percentile(name, 95)
+            obs['p95'] = round(p95, 3) if p95 is not None else None
+        return result
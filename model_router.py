@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import Metrics
+
+
+class ModelRoute:
+    """การตั้งค่าการเรียก OpenAI ของ call site หนึ่ง
+
+    - models: model หลักตามด้วย model สำรองตามลำดับ
+    - max_tokens / temperature: None = ใช้ค่าที่ call site กำหนดเอง
+    - timeout: deadline ต่อการเรียกหนึ่งครั้ง (วินาที, None = ใช้ deadline ของ ResilientCaller)
+    - slow_ms: latency p95 ล่าสุดของ model ที่เกินค่านี้ถือว่าช้า ให้ใช้ model ถัดไปก่อน (0 = ไม่ตรวจ)
+    """
+
+    def __init__(self, call_site: str, models: List[str], max_tokens: Optional[int] = None,
+                 temperature: Optional[float] = None, timeout: Optional[float] = None, slow_ms: float = 0):
+        self.call_site = call_site
+        self.models = models
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+        self.slow_ms = slow_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'models': self.models, 'max_tokens': self.max_tokens, 'temperature': self.temperature,
+                'timeout': self.timeout, 'slow_ms': self.slow_ms}
+
+
+class ModelRouter:
+    """เลือก model ของแต่ละ call site และสลับไปใช้ model สำรองเมื่อ model หลักช้าหรือผิดพลาดบ่อย
+
+    เก็บผลการเรียกล่าสุด window ครั้งของแต่ละ (call site, model) (สำเร็จ/ล้มเหลว, latency)
+    แยกตาม call site เพราะแต่ละ route ใช้ prompt/max_tokens และ slow_ms ต่างกัน
+    model ที่ error rate ถึง max_error_rate หรือ p95 เกิน slow_ms ของ route จะถูกพักไว้ cooldown วินาทีเฉพาะใน route นั้น
+    (ยังใช้ได้ถ้าไม่มี model อื่นเหลือ) ครบเวลาแล้วล้างสถิติและลองใช้ใหม่
+
+    รูปแบบไฟล์ model_routes.json (call site ที่ไม่ระบุใช้ DEFAULT_ROUTES):
+    {
+      "routes": {
+        "detect_intent": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "timeout": 4, "slow_ms": 2500},
+        "smart_fallback": {"models": ["gpt-3.5-turbo"], "max_tokens": 200, "temperature": 0.7}
+      }
+    }
+    """
+
+    DEFAULT_MODEL = "gpt-3.5-turbo"
+    DEFAULT_ROUTES = {
+        "detect_intent": {"models": [DEFAULT_MODEL]},
+        "smart_fallback": {"models": [DEFAULT_MODEL]},
+        "smart_fallback_stream": {"models": [DEFAULT_MODEL]},
+    }
+    MIN_SAMPLES = 10  # ต้องมีผลการเรียกอย่างน้อยเท่านี้ก่อนตัดสินว่า model ช้าหรือผิดพลาดบ่อย
+
+    def __init__(self, config_file: Optional[str] = None, window: int = 50, max_error_rate: float = 0.5,
+                 cooldown: float = 60.0, metrics: Metrics = None):
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.metrics = metrics or Metrics()
+        self.routes: Dict[str, ModelRoute] = self._load_routes(config_file)
+        self._results: Dict[Tuple[str, str], deque] = {}  # (call_site, model) -> deque[(ok, latency_ms)]
+        self._demoted_until: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def _load_routes(self, file_path: Optional[str]) -> Dict[str, ModelRoute]:
+        """โหลด routes จากไฟล์ JSON ทับค่าเริ่มต้น"""
+        configs = {call_site: dict(config) for call_site, config in self.DEFAULT_ROUTES.items()}
+        if file_path:
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    configs.update(json.load(f).get('routes', {}))
+            except FileNotFoundError:
+                print(f"Info: {file_path} not found. Using {self.DEFAULT_MODEL} for all call sites.")
+
+        routes = {}
+        for call_site, config in configs.items():
+            models = config.get('models') or [self.DEFAULT_MODEL]
+            routes[call_site] = ModelRoute(
+                call_site,
+                models,
+                max_tokens=config.get('max_tokens'),
+                temperature=config.get('temperature'),
+                timeout=config.get('timeout'),
+                slow_ms=config.get('slow_ms', 0)
+            )
+        return routes
+
+    def route(self, call_site: str) -> ModelRoute:
+        route = self.routes.get(call_site)
+        if route is None:
+            route = self.routes[call_site] = ModelRoute(call_site, [self.DEFAULT_MODEL])
+        return route
+
+    def candidates(self, call_site: str, now: float = None) -> List[str]:
+        """model ที่จะลองเรียกตามลำดับ: model ที่ปกติก่อน แล้วจึง model ที่ถูกพักไว้"""
+        now = now if now is not None else time.monotonic()
+        route = self.route(call_site)
+        healthy, demoted = [], []
+        with self._lock:
+            for model in route.models:
+                key = (call_site, model)
+                until = self._demoted_until.get(key)
+                if until is not None and now >= until:
+                    # ครบเวลาพัก เริ่มเก็บสถิติใหม่
+                    del self._demoted_until[key]
+                    self._results.pop(key, None)
+                    self.metrics.set_gauge(f"model.{call_site}.{model}.demoted", False)
+                    until = None
+                (demoted if until is not None else healthy).append(model)
+        return healthy + demoted
+
+    def record(self, call_site: str, model: str, latency_ms: float, ok: bool, now: float = None) -> None:
+        """บันทึกผลการเรียก model หนึ่งครั้ง และพัก model ถ้าช้าหรือผิดพลาดบ่อยเกินไป"""
+        now = now if now is not None else time.monotonic()
+        self.metrics.observe(f"model.{model}.latency_ms", latency_ms)
+        if not ok:
+            self.metrics.incr(f"model.{model}.errors")
+        slow_ms = self.route(call_site).slow_ms
+        key = (call_site, model)
+        with self._lock:
+            results = self._results.get(key)
+            if results is None:
+                results = self._results[key] = deque(maxlen=self.window)
+            results.append((ok, latency_ms))
+            if key in self._demoted_until or len(results) < self.MIN_SAMPLES:
+                return
+            error_rate = sum(1 for success, _ in results if not success) / len(results)
+            p95 = self._percentile([latency for success, latency in results if success], 95)
+            slow = slow_ms and p95 is not None and p95 > slow_ms
+            if error_rate < self.max_error_rate and not slow:
+                return
+            self._demoted_until[key] = now + self.cooldown
+        reason = f"error_rate={error_rate:.0%}" if error_rate >= self.max_error_rate else f"p95={p95:.0f}ms"
+        print(f"Model {model} demoted on {call_site} for {self.cooldown:.0f}s ({reason})")
+        self.metrics.incr(f"model.{call_site}.{model}.demoted")
+        self.metrics.set_gauge(f"model.{call_site}.{model}.demoted", True)
+
+    @staticmethod
+    def _percentile(values: List[float], pct: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+    def stats(self, now: float = None) -> Dict[str, Any]:
+        """สถิติล่าสุดของแต่ละ model แยกตาม call site และ routes สำหรับ admin endpoint"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            models = {}
+            for (call_site, model), results in self._results.items():
+                latencies = [latency for ok, latency in results if ok]
+                p95 = self._percentile(latencies, 95)
+                until = self._demoted_until.get((call_site, model))
+                models.setdefault(call_site, {})[model] = {
+                    'calls': len(results),
+                    'error_rate': round(sum(1 for ok, _ in results if not ok) / len(results), 3),
+                    'p95_ms': round(p95, 1) if p95 is not None else None,
+                    'demoted_for_s': round(until - now, 1) if until is not None and until > now else 0
+                }
+        return {'routes': {call_site: route.to_dict() for call_site, route in self.routes.items()}, 'models': models}
@@ -0,0 +1,136 @@
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+# intent ที่ถามได้ทุกขั้นตอนของการสั่งซื้อ (คำถามทั่วไปเกี่ยวกับสินค้า/ร้าน)
+GENERAL_INTENTS = [
+    "greeting", "price", "price_inquiry", "promotion", "exchange_return", "fabric_quality",
+    "product_length", "size_chart", "size_recommendation", "show_product_image", "show_size_chart",
+    "show_catalog", "color_availability", "shipping", "cod_inquiry", "payment"
+]
+
+_ENDING = r'\s*(?:ค่ะ|คะ|ค่า|ครับ|จ้า|นะคะ|นะ)?\s*[!.~]*'
+
+# ข้อความสั้นที่ตีความได้แน่นอนโดยไม่ต้องถาม GPT
+BARE_SIZE = re.compile(r'^\s*(?:ไซส์|ไซซ์|ไซ|size)?\s*(XXL|XL|M|L)' + _ENDING + r'$', re.IGNORECASE)
+BARE_COD = re.compile(r'^\s*(?:เก็บ(?:เงิน)?)?(?:ปลายทาง|cod)' + _ENDING + r'$', re.IGNORECASE)
+BARE_TRANSFER = re.compile(r'^\s*(?:โอน(?:เงิน)?|โอนธนาคาร|promptpay|พร้อมเพย์)' + _ENDING + r'$', re.IGNORECASE)
+
+
+class FlowStage:
+    """ขั้นตอนหนึ่งของการสั่งซื้อ
+
+    - entered_by: intent ล่าสุดที่ทำให้อยู่ในขั้นตอนนี้
+    - candidates: intent ที่เป็นไปได้ในขั้นตอนนี้ (นอกเหนือจาก GENERAL_INTENTS) ใช้จำกัดตัวเลือกใน prompt
+    - transitions: (pattern, intent) ข้อความที่ตรง pattern เปลี่ยนเป็น intent นั้นทันทีโดยไม่เรียก GPT
+    - remap: แก้ intent ที่ได้จาก GPT ให้ตรงกับบริบทของขั้นตอน
+    - expects_address: ข้อความถัดไปน่าจะเป็นชื่อ/ที่อยู่/เบอร์โทร
+    - in_funnel: ลูกค้ากำลังสั่งซื้ออยู่ ได้คิวก่อนเมื่อระบบยุ่ง
+    """
+
+    def __init__(self, name: str, entered_by: List[str], candidates: List[str],
+                 transitions: List[Tuple[re.Pattern, str]] = None, remap: Dict[str, str] = None,
+                 expects_address: bool = False, in_funnel: bool = False, hint: str = ''):
+        self.name = name
+        self.entered_by = entered_by
+        self.candidates = candidates
+        self.transitions = transitions or []
+        self.remap = remap or {}
+        self.expects_address = expects_address
+        self.in_funnel = in_funnel
+        self.hint = hint
+
+
+ORDER_STAGES = [
+    FlowStage(
+        "browsing",
+        entered_by=[],
+        candidates=["color", "color_with_quantity", "color_multiple", "size_only", "size_multiple",
+                    "quantity_only", "order_confirm", "order_incomplete", "payment_cod", "payment_transfer"]
+    ),
+    FlowStage(
+        "color_quantity",
+        entered_by=["color_with_quantity", "color_multiple"],
+        candidates=["size_after_color_quantity", "size_multiple", "color_with_quantity", "color_multiple",
+                    "color", "quantity_only", "order_confirm", "order_incomplete", "order_edit",
+                    "payment_cod", "payment_transfer"],
+        transitions=[(BARE_SIZE, "size_after_color_quantity")],
+        remap={"size_only": "size_after_color_quantity"},
+        in_funnel=True,
+        hint="""
+🚨 บริบทสำคัญ: ลูกค้าเพิ่งแจ้งสี+จำนวนในข้อความก่อนหน้านี้แล้ว
+ดังนั้นถ้าข้อความปัจจุบันเป็นไซส์เดียว (M, L, XL, XXL) ต้องเลือก size_after_color_quantity
+"""
+    ),
+    FlowStage(
+        "size_selected",
+        entered_by=["size_after_color_quantity", "size_only", "size_multiple", "quantity_only",
+                    "order_confirm", "order_incomplete", "order_edit"],
+        candidates=["payment_cod", "payment_transfer", "order_confirm", "order_incomplete", "order_edit",
+                    "color", "color_with_quantity", "color_multiple", "size_only", "size_multiple", "quantity_only"],
+        transitions=[(BARE_COD, "payment_cod"), (BARE_TRANSFER, "payment_transfer")],
+        in_funnel=True,
+        hint="""
+บริบท: ลูกค้าเลือกสินค้าแล้ว ขั้นตอนถัดไปคือเลือกวิธีชำระเงิน (ปลายทาง/โอน)
+"""
+    ),
+    FlowStage(
+        "awaiting_address",
+        entered_by=["payment_cod", "address_incomplete"],
+        candidates=["address_received", "address_incomplete", "payment_cod", "payment_transfer",
+                    "order_edit", "order_confirm"],
+        expects_address=True,
+        in_funnel=True,
+        hint="""
+บริบท: ลูกค้าเลือกเก็บเงินปลายทางแล้ว กำลังรอชื่อ ที่อยู่ และเบอร์โทร
+"""
+    ),
+    FlowStage(
+        "awaiting_slip",
+        entered_by=["payment_transfer"],
+        candidates=["slip_received", "address_received", "address_incomplete", "payment_cod",
+                    "payment_transfer", "order_edit"],
+        in_funnel=True,
+        hint="""
+บริบท: ลูกค้าเลือกโอนเงินแล้ว กำลังรอสลิปการโอนและที่อยู่จัดส่ง
+"""
+    ),
+    FlowStage(
+        "ordered",
+        entered_by=["address_received", "slip_received"],
+        candidates=["order_edit", "slip_received", "address_received", "address_incomplete", "payment_cod",
+                    "payment_transfer", "order_confirm", "color", "color_with_quantity", "color_multiple"]
+    ),
+]
+
+
+class OrderFlow:
+    """State machine ของการสั่งซื้อ (สี → จำนวน → ไซส์ → ชำระเงิน → ที่อยู่) กำหนดเป็นตาราง
+
+    ขั้นตอนปัจจุบันได้จาก last_intent ของลูกค้า
+    """
+
+    def __init__(self, stages: List[FlowStage] = None):
+        self.stages = stages or ORDER_STAGES
+        self.default_stage = self.stages[0]
+        self._by_intent: Dict[str, FlowStage] = {
+            intent: stage for stage in self.stages for intent in stage.entered_by
+        }
+
+    def stage_for(self, user_context: Dict[str, Any]) -> FlowStage:
+        """ขั้นตอนปัจจุบันของลูกค้า"""
+        return self._by_intent.get(user_context.get('last_intent'), self.default_stage)
+
+    def candidates(self, stage: FlowStage, known_intents: List[str]) -> List[str]:
+        """intent ที่ให้ GPT เลือกในขั้นตอนนี้ (เฉพาะที่มีใน replies.json)"""
+        allowed = set(GENERAL_INTENTS) | set(stage.candidates)
+        return [intent for intent in known_intents if intent in allowed]
+
+    def resolve(self, stage: FlowStage, message: str) -> Optional[str]:
+        """intent จาก transition ที่ตัดสินได้แน่นอน หรือ None ถ้าต้องถาม GPT"""
+        for pattern, intent in stage.transitions:
+            if pattern.match(message):
+                return intent
+        return None
+
+    def remap(self, stage: FlowStage, intent: str) -> str:
+        return stage.remap.get(intent, intent)
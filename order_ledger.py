@@ -0,0 +1,210 @@
+import csv
+import io
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from metrics import Metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL UNIQUE,
+    page_id TEXT NOT NULL,
+    sender_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    created_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    colors TEXT NOT NULL,
+    size TEXT,
+    total_quantity INTEGER NOT NULL,
+    price INTEGER,
+    shipping INTEGER,
+    total INTEGER,
+    payment_method TEXT,
+    customer_name TEXT,
+    address TEXT,
+    phone TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_sender ON orders (sender_id, id);
+CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (created_date, id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, id);
+"""
+
+COLUMNS = [
+    "id", "order_id", "page_id", "sender_id", "created_at", "created_date", "status", "colors", "size",
+    "total_quantity", "price", "shipping", "total", "payment_method", "customer_name", "address", "phone"
+]
+
+# คอลัมน์ที่บันทึกจาก record() (id ให้ SQLite สร้างเอง)
+_INSERT_COLUMNS = COLUMNS[1:]
+_UPSERT_SQL = (
+    f"INSERT INTO orders ({', '.join(_INSERT_COLUMNS)}) VALUES ({', '.join('?' for _ in _INSERT_COLUMNS)}) "
+    "ON CONFLICT(order_id) DO UPDATE SET "
+    + ", ".join(f"{column}=excluded.{column}" for column in _INSERT_COLUMNS if column not in ("order_id", "created_at", "created_date"))
+)
+_STATUS_SQL = "UPDATE orders SET status = ? WHERE order_id = ?"
+
+
+class OrderLedger:
+    """บันทึกออเดอร์ที่สั่งเสร็จแล้วลง SQLite
+
+    การเขียนทำใน background thread แบบรวม batch (record/update_status ไม่บล็อกผู้เรียก)
+    การอ่านเปิด connection ใหม่ทุกครั้ง และแบ่งหน้าด้วย id (keyset pagination)
+    """
+
+    STATUS_PENDING_SHIPMENT = "pending_shipment"  # เก็บเงินปลายทาง รอจัดส่ง
+    STATUS_AWAITING_PAYMENT = "awaiting_payment"  # โอนเงิน รอสลิป
+    STATUS_PAID = "paid"
+
+    def __init__(self, db_path: str = "orders.db", batch_size: int = 50, flush_interval: float = 1.0,
+                 max_queue: int = 10000, metrics: Metrics = None):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.metrics = metrics or Metrics()
+        self._queue: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue(maxsize=max_queue)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="order-ledger", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10.0)
+
+    def _enqueue(self, sql: str, params: tuple) -> None:
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self.metrics.incr("order_ledger.dropped")
+            print(f"Warning: order ledger queue is full, dropped write {params[0]}")
+
+    def record(self, order: Dict[str, Any]) -> None:
+        """บันทึก (หรือแทนที่ตาม order_id) ออเดอร์หนึ่งรายการ"""
+        created_at = order.get('created_at') or time.time()
+        address_info = order.get('address_info') or {}
+        row = {
+            **order,
+            'created_at': created_at,
+            'created_date': datetime.fromtimestamp(created_at).strftime("%Y-%m-%d"),
+            'colors': json.dumps(order.get('colors', []), ensure_ascii=False),
+            'total_quantity': order.get('total_quantity', 0),
+            'customer_name': address_info.get('extracted_name', ''),
+            'address': address_info.get('extracted_address', ''),
+            'phone': address_info.get('extracted_phone', ''),
+        }
+        self._enqueue(_UPSERT_SQL, tuple(row.get(column) for column in _INSERT_COLUMNS))
+
+    def update_status(self, order_id: str, status: str) -> None:
+        """เปลี่ยนสถานะออเดอร์ (เช่น ได้รับสลิปแล้ว)"""
+        self._enqueue(_STATUS_SQL, (status, order_id))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch: List[Tuple[str, tuple]] = []
+            deadline = time.monotonic() + self.flush_interval
+            # รวมรายการที่เข้ามาภายใน flush_interval เขียนใน transaction เดียว
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(conn, batch)
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Tuple[str, tuple]]) -> None:
+        started = time.perf_counter()
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+            self.metrics.incr("order_ledger.written", len(batch))
+        except sqlite3.Error as e:
+            self.metrics.incr("order_ledger.errors")
+            print(f"Error writing {len(batch)} orders to ledger: {e}")
+        self.metrics.observe("order_ledger.batch_ms", (time.perf_counter() - started) * 1000)
+        self.metrics.observe("order_ledger.batch_size", len(batch))
+
+    def close(self) -> None:
+        """เขียนรายการที่ค้างอยู่ให้หมดแล้วหยุด writer thread"""
+        self._queue.put(None)
+        self._writer.join(timeout=10.0)
+
+    @staticmethod
+    def _filters(sender_id: str = None, status: str = None, page_id: str = None,
+                 date_from: str = None, date_to: str = None) -> Tuple[List[str], List[Any]]:
+        """สร้างเงื่อนไข WHERE (วันที่ใช้รูปแบบ YYYY-MM-DD)"""
+        clauses, params = [], []
+        for column, value in (("sender_id", sender_id), ("status", status), ("page_id", page_id)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if date_from:
+            clauses.append("created_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("created_date <= ?")
+            params.append(date_to)
+        return clauses, params
+
+    @staticmethod
+    def _to_dict(row: tuple) -> Dict[str, Any]:
+        order = dict(zip(COLUMNS, row))
+        order['colors'] = json.loads(order['colors'])
+        return order
+
+    def query(self, cursor: int = 0, limit: int = 50, **filters) -> Dict[str, Any]:
+        """ค้นหาออเดอร์ใหม่สุดก่อน ส่ง next_cursor กลับไปเพื่อดึงหน้าถัดไป"""
+        clauses, params = self._filters(**filters)
+        if cursor:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM orders {where} ORDER BY id DESC LIMIT ?"
+        with self._connect() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        items = [self._to_dict(row) for row in rows[:limit]]
+        next_cursor = items[-1]['id'] if len(rows) > limit else None
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def iter_csv(self, chunk_size: int = 500, **filters) -> Iterator[str]:
+        """ส่งออก CSV ทีละ chunk ตามลำดับ id โดยไม่โหลดทั้งตารางเข้าหน่วยความจำ"""
+        clauses, params = self._filters(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM orders {where} ORDER BY id"
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params)
+            while True:
+                chunk = rows.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                writer.writerows(chunk)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        finally:
+            conn.close()
+        if buffer.tell():
+            yield buffer.getvalue()
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Any, Callable, List, Optional
+
+from context_index import ContextIndex
+
+if TYPE_CHECKING:
+    # import จริงเฉพาะตอนตรวจ type เพื่อไม่ให้ openai ถูกโหลดตอนเริ่มโปรเซส
+    from intent_detector import IntentDetector
+
+
+class PageConfig:
+    """การตั้งค่าของเพจหนึ่งเพจ (token และไฟล์ข้อมูลร้าน)"""
+
+    def __init__(self, page_id: str, access_token: Optional[str], replies_file: str = "replies.json",
+                 context_file: str = "business_context.json", images_file: str = "product_images.json",
+                 examples_file: str = "intent_examples.json"):
+        self.page_id = page_id
+        self.access_token = access_token
+        self.replies_file = replies_file
+        self.context_file = context_file
+        self.images_file = images_file
+        self.examples_file = examples_file
+
+
+class PageConversations:
+    """context ของลูกค้าในเพจหนึ่ง (manual mode, ออเดอร์ที่ยังไม่เสร็จ, history) และ index สำหรับ admin query
+
+    PageRegistry เก็บไว้แยกจาก detector จึงไม่หายไปเมื่อ detector ถูกปลดออกตอนไม่มีการใช้งาน
+    """
+
+    def __init__(self):
+        self.user_contexts: Dict[str, Dict[str, Any]] = {}
+        self.context_index = ContextIndex()
+
+
+class PageRegistry:
+    """จับคู่ page ID กับ IntentDetector ของเพจนั้น โหลดเมื่อใช้งานครั้งแรกและปลดออกเมื่อไม่มีการใช้งาน
+
+    ปลดเฉพาะข้อมูลร้าน (replies, fact index, FAQ, ตัวอย่าง) ส่วน context ของลูกค้าอยู่ใน PageConversations ของเพจ
+    detector ที่โหลดใหม่ใช้ context ชุดเดิมต่อ
+
+    รูปแบบไฟล์ pages.json:
+    {
+      "pages": {
+        "<page_id>": {
+          "access_token_env": "PAGE_ACCESS_TOKEN_SHOP1",
+          "replies_file": "shops/shop1/replies.json",
+          "context_file": "shops/shop1/business_context.json",
+          "images_file": "shops/shop1/product_images.json",
+          "examples_file": "shops/shop1/intent_examples.json"
+        }
+      }
+    }
+    ถ้าไม่มีไฟล์ จะใช้เพจเดียวจาก PAGE_ACCESS_TOKEN และไฟล์ข้อมูลเริ่มต้น (page_id = "default")
+    """
+
+    DEFAULT_PAGE_ID = "default"
+
+    def __init__(self, detector_factory: Callable[[PageConfig, PageConversations], "IntentDetector"],
+                 config_file: str = "pages.json",
+                 idle_ttl: float = 1800.0, default_access_token: Optional[str] = None):
+        self.detector_factory = detector_factory
+        self.idle_ttl = idle_ttl
+        self.pages: Dict[str, PageConfig] = self._load_config(config_file, default_access_token)
+        self._detectors: Dict[str, "IntentDetector"] = {}
+        self._conversations: Dict[str, PageConversations] = {}
+        self._last_used: Dict[str, float] = {}
+        # _lock คุมเฉพาะการแก้ dict (สั้นมาก) การสร้าง detector ใช้ lock ของเพจนั้น ไม่บล็อกเพจอื่นหรือ event loop
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+
+    def _load_config(self, file_path: str, default_access_token: Optional[str]) -> Dict[str, PageConfig]:
+        """โหลดรายการเพจจากไฟล์ JSON"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"Info: {file_path} not found. Serving a single page.")
+            return {self.DEFAULT_PAGE_ID: PageConfig(self.DEFAULT_PAGE_ID, default_access_token)}
+
+        pages = {}
+        for page_id, config in data.get('pages', {}).items():
+            access_token = config.get('access_token') or os.getenv(config.get('access_token_env', ''))
+            if not access_token:
+                print(f"Warning: access token for page {page_id} is missing")
+            pages[page_id] = PageConfig(
+                page_id,
+                access_token,
+                replies_file=config.get('replies_file', "replies.json"),
+                context_file=config.get('context_file', "business_context.json"),
+                images_file=config.get('images_file', "product_images.json"),
+                examples_file=config.get('examples_file', "intent_examples.json")
+            )
+        return pages
+
+    def resolve_page_id(self, page_id: Optional[str]) -> Optional[str]:
+        """แปลง page ID จาก webhook เป็นเพจที่ตั้งค่าไว้ (โหมดเพจเดียวรับทุก page ID)"""
+        if page_id in self.pages:
+            return page_id
+        if list(self.pages) == [self.DEFAULT_PAGE_ID]:
+            return self.DEFAULT_PAGE_ID
+        return None
+
+    def get_config(self, page_id: Optional[str]) -> Optional[PageConfig]:
+        resolved = self.resolve_page_id(page_id)
+        return self.pages.get(resolved) if resolved else None
+
+    def get_access_token(self, page_id: Optional[str]) -> Optional[str]:
+        config = self.get_config(page_id)
+        return config.access_token if config else None
+
+    def is_loaded(self, page_id: Optional[str] = None) -> bool:
+        """True ถ้า detector ของเพจถูกโหลดไว้แล้ว (ไม่ใช้ lock เรียกจาก event loop ได้)"""
+        return self.loaded_detector(page_id) is not None
+
+    def loaded_detector(self, page_id: Optional[str] = None) -> Optional["IntentDetector"]:
+        """detector ที่โหลดไว้แล้ว (None ถ้ายังไม่ได้โหลด) ไม่สร้างใหม่และไม่ใช้ lock เรียกจาก event loop ได้"""
+        resolved = self.resolve_page_id(page_id if page_id is not None else self.default_page_id())
+        detector = self._detectors.get(resolved)
+        if detector is not None:
+            self._last_used[resolved] = time.monotonic()
+        return detector
+
+    def get_detector(self, page_id: Optional[str] = None) -> Optional["IntentDetector"]:
+        """ดึง detector ของเพจ (สร้างใหม่ถ้ายังไม่ได้โหลดหรือถูกปลดไปแล้ว ควรเรียกจาก worker thread)"""
+        resolved = self.resolve_page_id(page_id if page_id is not None else self.default_page_id())
+        if resolved is None:
+            return None
+        detector = self.loaded_detector(resolved)
+        if detector is not None:
+            return detector
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(resolved, threading.Lock())
+            conversations = self._conversations.get(resolved)
+            if conversations is None:
+                conversations = self._conversations[resolved] = PageConversations()
+        # thread อื่นที่ขอเพจเดียวกันรอ detector ตัวเดียวกัน ไม่สร้างซ้ำ
+        with build_lock:
+            detector = self._detectors.get(resolved)
+            if detector is None:
+                print(f"Loading detector for page {resolved}")
+                detector = self.detector_factory(self.pages[resolved], conversations)
+                with self._lock:
+                    self._detectors[resolved] = detector
+            self._last_used[resolved] = time.monotonic()
+            return detector
+
+    def default_page_id(self) -> Optional[str]:
+        """เพจแรกในไฟล์ตั้งค่า ใช้กับ endpoint ที่ไม่ได้ระบุ page_id"""
+        return next(iter(self.pages), None)
+
+    def evict_idle(self) -> List[str]:
+        """ปลด detector ที่ไม่ได้ใช้งานเกิน idle_ttl (context ของลูกค้ายังอยู่ ใช้ต่อเมื่อโหลดเพจใหม่)"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for page_id, last_used in list(self._last_used.items()):
+                if now - last_used >= self.idle_ttl:
+                    self._detectors.pop(page_id, None)
+                    self._last_used.pop(page_id, None)
+                    evicted.append(page_id)
+        for page_id in evicted:
+            print(f"Evicted idle detector for page {page_id}")
+        return evicted
+
+    def status(self) -> Dict[str, Any]:
+        """สรุปสถานะเพจที่ตั้งค่าและที่โหลดอยู่"""
+        now = time.monotonic()
+        with self._lock:
+            loaded = {
+                page_id: {
+                    'idle_seconds': round(now - self._last_used[page_id], 1),
+                    'users': len(self._conversations[page_id].user_contexts)
+                }
+                for page_id in self._detectors
+            }
+            users = {page_id: len(conversations.user_contexts) for page_id, conversations in self._conversations.items()}
+        return {'configured_pages': list(self.pages), 'loaded_pages': loaded, 'users': users}
@@ -0,0 +1,36 @@
+import json
+from typing import Dict, Any, List, Optional
+
+# ข้อจำกัดของ Messenger Send API
+MAX_QUICK_REPLIES = 13
+MAX_TITLE_CHARS = 20
+
+
+def build_quick_replies(buttons: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """แปลง quick_replies ใน replies.json เป็นรูปแบบของ Messenger
+
+    แต่ละปุ่ม: {"title": "M", "payload": {"size": "M"}} (payload เป็น object หรือชื่อ intent)
+    """
+    quick_replies = []
+    for button in buttons[:MAX_QUICK_REPLIES]:
+        payload = button['payload']
+        quick_replies.append({
+            "content_type": "text",
+            "title": button['title'][:MAX_TITLE_CHARS],
+            "payload": payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        })
+    return quick_replies
+
+
+def parse_payload(payload: str) -> Optional[Dict[str, Any]]:
+    """payload จาก quick reply/postback เป็น dict (ข้อความธรรมดาถือเป็นชื่อ intent) คืน None ถ้าว่าง"""
+    payload = (payload or '').strip()
+    if not payload:
+        return None
+    if payload.startswith('{'):
+        try:
+            action = json.loads(payload)
+        except json.JSONDecodeError:
+            return None
+        return action if isinstance(action, dict) else None
+    return {'intent': payload}
@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Tuple
+
+from metrics import Metrics
+
+
+class SenderRateLimiter:
+    """จำกัดจำนวนข้อความต่อ sender ด้วย token bucket
+
+    เก็บเฉพาะ sender ที่เพิ่งส่งข้อความมา เรียงตามเวลาที่ใช้ล่าสุด (OrderedDict)
+    bucket ที่ไม่มีการใช้งานนานจนเติมเต็มแล้วไม่ต่างจาก bucket ใหม่ จึงถูกลบออกเองระหว่างเรียก check()
+    """
+
+    ALLOW = "allow"
+    THROTTLE = "throttle"  # เกิน limit ครั้งแรก ส่งข้อความแจ้งลูกค้า
+    DROP = "drop"  # ยังเกิน limit อยู่ ไม่ตอบ
+
+    def __init__(self, burst: int = 8, per_minute: float = 20, max_senders: int = 100000,
+                 metrics: Metrics = None):
+        self.capacity = float(max(1, burst))
+        self.refill_per_second = max(per_minute, 0.001) / 60.0
+        self.max_senders = max_senders
+        # ระยะเวลาที่ bucket ว่างเปล่าจะเติมจนเต็ม หลังจากนั้นลบทิ้งได้
+        self.idle_ttl = self.capacity / self.refill_per_second
+        self.metrics = metrics or Metrics()
+        # sender -> [tokens, updated_at, notified]
+        self._buckets: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, sender_id: str, now: float = None) -> str:
+        """ใช้ 1 token ของ sender คืน ALLOW, THROTTLE หรือ DROP"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self._expire(now)
+            bucket = self._buckets.get(sender_id)
+            if bucket is None:
+                bucket = [self.capacity, now, False]
+                self._buckets[sender_id] = bucket
+            else:
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+                bucket[1] = now
+                self._buckets.move_to_end(sender_id)
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                decision = self.ALLOW
+            elif not bucket[2]:
+                bucket[2] = True  # แจ้งครั้งเดียวต่อช่วงที่ถูกจำกัด
+                decision = self.THROTTLE
+            else:
+                decision = self.DROP
+            senders = len(self._buckets)
+
+        if decision != self.ALLOW:
+            self.metrics.incr(f"rate_limit.{decision}")
+        self.metrics.set_gauge("rate_limit.senders", senders)
+        return decision
+
+    def _expire(self, now: float) -> None:
+        """ลบ bucket ที่เต็มแล้ว (ไม่ได้ใช้นานกว่า idle_ttl) และที่เกิน max_senders จากหัวของ OrderedDict"""
+        buckets = self._buckets
+        while buckets:
+            sender_id, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self.idle_ttl and len(buckets) <= self.max_senders:
+                break
+            del buckets[sender_id]
+
+
+class PriorityScheduler:
+    """จำกัดจำนวนข้อความที่ประมวลผลพร้อมกัน เมื่อเต็มให้คิวที่ priority ต่ำกว่า (เลขน้อย) ได้ก่อน
+
+    ใช้กับงานที่ส่งเข้า worker pool เพื่อให้ลูกค้าที่อยู่ระหว่างสั่งซื้อไม่ต้องรอหลังคำถามทั่วไป
+    ลำดับเดียวกันเข้าก่อนได้ก่อน
+    """
+
+    FUNNEL = 0  # อยู่ระหว่างขั้นตอนสั่งซื้อ (สี/ไซส์/ชำระเงิน/ที่อยู่)
+    DEFAULT = 1
+    BATCH = 2  # งานของแอดมิน (batch classify) ทำหลังข้อความของลูกค้าจริง
+
+    def __init__(self, capacity: int, metrics: Metrics = None):
+        self.capacity = max(1, capacity)
+        self.metrics = metrics or Metrics()
+        self._running = 0
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = DEFAULT):
+        """async with scheduler.slot(priority): ... (ใช้ใน event loop เดียวกันเท่านั้น)"""
+        started = time.perf_counter()
+        if self._running < self.capacity and not self._waiting:
+            self._running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (priority, next(self._sequence), waiter))
+            self.metrics.set_gauge("scheduler.waiting", len(self._waiting))
+            try:
+                await waiter  # ช่องว่างถูกโอนมาให้โดย _release()
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # ได้ช่องแล้วแต่ถูกยกเลิก ส่งต่อให้คิวถัดไป
+                raise
+        self.metrics.observe(f"scheduler.wait_ms.p{priority}", (time.perf_counter() - started) * 1000)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        """ส่งช่องว่างให้คิวที่ priority สูงสุดที่ยังรออยู่ หรือคืนช่องถ้าไม่มีคิว"""
+        while self._waiting:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        else:
+            self._running -= 1
+        self.metrics.set_gauge("scheduler.waiting", len(self._waiting))
+
+    def stats(self) -> Dict[str, int]:
+        return {'capacity': self.capacity, 'running': self._running, 'waiting': len(self._waiting)}
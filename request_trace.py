@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+
+class Trace:
+    """เวลาของแต่ละขั้นตอนในการประมวลผลข้อความหนึ่งข้อความ (ms จาก perf_counter) และ token ที่ใช้
+
+    ขั้นตอนชื่อเดียวกันที่เกิดหลายครั้งจะรวมเวลาและนับจำนวนครั้ง ขั้นตอนซ้อนกันได้
+    (เช่น analyze_address อยู่ภายใน overrides) เวลาของขั้นตอนย่อยจึงไม่ได้หักออกจากขั้นตอนที่ครอบอยู่
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages: Dict[str, List[float]] = {}  # name -> [ms, calls]
+        self.tokens: Dict[str, List[int]] = {}  # call_site -> [prompt_tokens, completion_tokens]
+
+    @contextmanager
+    def stage(self, name: str):
+        """with trace.stage("detect_intent.prompt"): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, (time.perf_counter() - started) * 1000)
+
+    def add_stage(self, name: str, ms: float) -> None:
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += ms
+        entry[1] += 1
+
+    def add_tokens(self, call_site: str, prompt_tokens: int, completion_tokens: int) -> None:
+        entry = self.tokens.setdefault(call_site, [0, 0])
+        entry[0] += prompt_tokens
+        entry[1] += completion_tokens
+
+    def finish(self) -> "Trace":
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        return self
+
+    @property
+    def total_ms(self) -> float:
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_ms': round(self.total_ms, 1),
+            'stages': {name: {'ms': round(ms, 1), 'calls': calls} for name, (ms, calls) in self.stages.items()},
+            'tokens': {call_site: {'prompt_tokens': prompt, 'completion_tokens': completion}
+                       for call_site, (prompt, completion) in self.tokens.items()}
+        }
+
+    def format(self) -> str:
+        """สรุปบรรทัดเดียว เช่น total=812.0ms | detect_intent.completion=780.2ms (412+18 tok) | ..."""
+        parts = [f"total={self.total_ms:.1f}ms"]
+        for name, (ms, calls) in self.stages.items():
+            part = f"{name}={ms:.1f}ms" + (f" x{calls}" if calls > 1 else "")
+            call_site = name[:-len(".completion")] if name.endswith(".completion") else None
+            if call_site in self.tokens:
+                prompt, completion = self.tokens[call_site]
+                part += f" ({prompt}+{completion} tok)"
+            parts.append(part)
+        return " | ".join(parts)
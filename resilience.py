@@ -0,0 +1,181 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional, Set
+
+from metrics import Metrics
+
+
+class CircuitOpenError(Exception):
+    """ถูกปฏิเสธทันทีเพราะ circuit breaker เปิดอยู่"""
+
+
+class CircuitBreaker:
+    """Circuit breaker แบบนับความล้มเหลวติดกัน
+
+    - closed: เรียกได้ปกติ
+    - open: ปฏิเสธทุกการเรียกจนครบ reset_timeout
+    - half_open: ยอมให้ลองเรียก 1 ครั้ง ถ้าสำเร็จกลับเป็น closed ถ้าล้มเหลวกลับเป็น open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 metrics: Metrics = None, name: str = "openai"):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics or Metrics()
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.metrics.set_gauge(f"{self.name}.circuit_state", self._state)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        self.metrics.set_gauge(f"{self.name}.circuit_state", state)
+
+    @property
+    def state(self) -> str:
+        """สถานะปัจจุบัน (เปลี่ยนจาก open เป็น half_open เมื่อครบเวลา)"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+                self._probe_in_flight = False
+            return self._state
+
+    def is_open(self) -> bool:
+        """True ถ้ายังอยู่ในช่วงปฏิเสธการเรียก (ใช้ตัดสินใจเข้า degraded mode)"""
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        """ตรวจสอบว่าเรียกได้หรือไม่ (half_open ยอมให้ probe ได้ทีละ 1 ครั้ง)"""
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+                print(f"Circuit {self.name} closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+                    self.metrics.incr(f"{self.name}.circuit_opened")
+                self._set_state(self.OPEN)
+                self._opened_at = time.monotonic()
+            self.metrics.set_gauge(f"{self.name}.consecutive_failures", self._failures)
+
+
+class ResilientCaller:
+    """ครอบการเรียก API ด้วย deadline, hedged request และ circuit breaker"""
+
+    HEDGE_MIN_SAMPLES = 20  # ต้องมีสถิติ latency พอก่อนจึงจะคำนวณ p95 สำหรับ hedge
+
+    def __init__(self, breaker: CircuitBreaker = None, metrics: Metrics = None, deadline: float = 10.0,
+                 hedge: bool = False, hedge_percentile: float = 95, hedge_min_delay: float = 1.0,
+                 concurrency: int = 8):
+        self.metrics = metrics or Metrics()
+        self.breaker = breaker or CircuitBreaker(metrics=self.metrics)
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        # concurrency = จำนวนการเรียกพร้อมกันสูงสุดของผู้เรียก (เช่นขนาด worker pool) เผื่อ request ที่ยิงซ้ำอีกเท่าตัวเมื่อเปิด hedge
+        self._executor = ThreadPoolExecutor(max_workers=concurrency * (2 if hedge else 1),
+                                            thread_name_prefix="openai-call")
+
+    def _hedge_delay(self, call_site: str) -> Optional[float]:
+        """เวลารอก่อนยิง request ซ้ำ (วินาที) คำนวณจาก p95 ของ latency ล่าสุด"""
+        if not self.hedge:
+            return None
+        if self.metrics.count(f"{call_site}.latency_ms") < self.HEDGE_MIN_SAMPLES:
+            return None
+        p95 = self.metrics.percentile(f"{call_site}.latency_ms", self.hedge_percentile)
+        return max(self.hedge_min_delay, p95 / 1000.0)
+
+    def call(self, call_site: str, fn: Callable[[], Any], deadline: Optional[float] = None) -> Any:
+        """เรียก fn ภายใต้ deadline คืนผลลัพธ์แรกที่สำเร็จ หรือ raise ถ้าล้มเหลว/หมดเวลา
+
+        deadline: กำหนดเวลาเฉพาะการเรียกนี้ (None = ใช้ self.deadline) นับจากเวลาที่ fn เริ่มทำงานจริง
+        ไม่รวมเวลารอคิว thread (รอคิวได้ไม่เกิน deadline เช่นกัน)
+        """
+        deadline = deadline if deadline is not None else self.deadline
+        if not self.breaker.allow_request():
+            self.metrics.incr(f"{call_site}.short_circuited")
+            raise CircuitOpenError(f"Circuit {self.breaker.name} is open")
+
+        begun = threading.Event()
+
+        def run() -> Any:
+            begun.set()
+            return fn()
+
+        queued = time.monotonic()
+        pending = {self._executor.submit(run)}
+        if not begun.wait(deadline):
+            raise self._deadline_exceeded(call_site, deadline, pending)
+        started = time.monotonic()
+        self.metrics.observe(f"{call_site}.queue_ms", (started - queued) * 1000)
+        hedge_delay = self._hedge_delay(call_site)
+        hedged = False
+        hedge_future = None
+        last_error: Optional[BaseException] = None
+
+        while pending:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            timeout = remaining
+            if hedge_delay is not None and not hedged:
+                timeout = min(remaining, max(0.0, hedge_delay - (time.monotonic() - started)))
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    self.breaker.record_success()
+                    if future is hedge_future:
+                        # request ที่ยิงซ้ำเสร็จก่อนตัวแรก
+                        self.metrics.incr(f"{call_site}.hedge_completed")
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                last_error = error
+
+            # ยังไม่มีผลลัพธ์เมื่อถึงเวลา hedge ให้ยิง request ซ้ำอีก 1 ครั้ง
+            if hedge_delay is not None and not hedged and not done:
+                hedged = True
+                self.metrics.incr(f"{call_site}.hedged")
+                hedge_future = self._executor.submit(fn)
+                pending.add(hedge_future)
+
+        if last_error is not None and not pending:
+            self.breaker.record_failure()
+            raise last_error
+        raise self._deadline_exceeded(call_site, deadline, pending)
+
+    def _deadline_exceeded(self, call_site: str, deadline: float, pending: Set[Future]) -> TimeoutError:
+        """หมดเวลา: ยกเลิก request ที่ยังไม่เริ่ม (ที่ทำงานอยู่แล้วปล่อยให้จบเอง) คืน TimeoutError ให้ผู้เรียก raise"""
+        for future in pending:
+            future.cancel()
+        self.breaker.record_failure()
+        self.metrics.incr(f"{call_site}.deadline_exceeded")
+        return TimeoutError(f"{call_site} exceeded deadline of {deadline}s")
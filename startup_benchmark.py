@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup Benchmark
+วัดเวลา import ของแต่ละโมดูล และเวลาตั้งแต่เริ่ม server จน /healthz และ /readyz ตอบ 200
+
+ตัวอย่าง:
+    python startup_benchmark.py
+    python startup_benchmark.py --modes lazy,warm,eager --runs 3
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_TARGETS = ["dotenv", "httpx", "pydantic", "fastapi", "openai", "intent_detector", "main"]
+
+
+def measure_import(module: str) -> float:
+    """เวลา import โมดูลใน interpreter ใหม่ (ms)"""
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - started) * 1000)"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_startup(mode: str, timeout: float) -> dict:
+    """เริ่ม uvicorn ด้วย STARTUP_MODE ที่กำหนด แล้ววัดเวลาจน healthz/readyz ตอบ 200 (ms)"""
+    port = free_port()
+    env = dict(os.environ, STARTUP_MODE=mode)
+    env.setdefault("OPENAI_API_KEY", "startup-benchmark")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {'healthz_ms': None, 'readyz_ms': None}
+    try:
+        while time.perf_counter() - started < timeout:
+            elapsed = (time.perf_counter() - started) * 1000
+            try:
+                if result['healthz_ms'] is None:
+                    if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=0.5).status_code == 200:
+                        result['healthz_ms'] = elapsed
+                        if mode == "lazy":
+                            # โหมด lazy จะพร้อมเมื่อมีข้อความแรก จำลองด้วย /test-message
+                            httpx.post(f"http://127.0.0.1:{port}/test-message", json={"text": "สวัสดี"}, timeout=timeout)
+                elif httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=0.5).status_code == 200:
+                    result['readyz_ms'] = elapsed
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-ready")
+    parser.add_argument('--modes', default='lazy,warm,eager', help="STARTUP_MODE ที่จะวัด คั่นด้วย comma")
+    parser.add_argument('--runs', type=int, default=1, help="จำนวนรอบต่อโหมด")
+    parser.add_argument('--timeout', type=float, default=30.0, help="เวลารอสูงสุดต่อรอบ (วินาที)")
+    args = parser.parse_args()
+
+    print("📦 Import time (fresh interpreter)")
+    for module in IMPORT_TARGETS:
+        try:
+            print(f"   {module:<16} {measure_import(module):8.1f} ms")
+        except subprocess.CalledProcessError:
+            print(f"   {module:<16} failed to import")
+
+    print("🚀 Time to healthz / readyz")
+    for mode in args.modes.split(','):
+        for run in range(args.runs):
+            result = measure_startup(mode, args.timeout)
+            healthz = f"{result['healthz_ms']:.0f}ms" if result['healthz_ms'] is not None else "timeout"
+            readyz = f"{result['readyz_ms']:.0f}ms" if result['readyz_ms'] is not None else "not ready"
+            print(f"   mode={mode:<6} run={run + 1} healthz={healthz} readyz={readyz}")
+
+
+if __name__ == "__main__":
+    main()
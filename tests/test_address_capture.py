@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_detector import IntentDetector
+from order_ledger import OrderLedger
+
+ENGLISH_ADDRESS = "Mr. John Smith 99/1 Sukhumvit Soi 11 Khlong Toei Bangkok 10110 Tel 0812345678"
+
+
+def test_mixed_case_english_address_is_saved_as_typed(tmp_path):
+    ledger = OrderLedger(str(tmp_path / "orders.db"), batch_size=1, flush_interval=0.01)
+    detector = IntentDetector(openai_api_key="test-key", order_ledger=ledger)
+    user_context = detector._get_user_context("user-1")
+    user_context['last_intent'] = 'payment_cod'
+    user_context['order_info'] = {'colors': [{'color': 'ดำ', 'quantity': 2}], 'total_quantity': 2,
+                                  'size': 'M', 'payment_method': 'cod'}
+
+    result = detector.process_message(ENGLISH_ADDRESS, user_id="user-1")
+    ledger.close()
+
+    assert result['used_intent'] == 'address_received'
+    address_info = user_context['order_info']['address_info']
+    assert address_info['extracted_name'] == "Mr. John Smith"
+    assert address_info['extracted_address'] == "99/1 Sukhumvit Soi 11 Khlong Toei Bangkok 10110"
+    assert "Mr. John Smith" in result['reply']
+
+    order = ledger.query(sender_id="user-1")['items'][0]
+    assert order['customer_name'] == "Mr. John Smith"
+    assert order['address'] == "99/1 Sukhumvit Soi 11 Khlong Toei Bangkok 10110"
+    assert order['phone'] == "0812345678"
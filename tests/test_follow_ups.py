@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from follow_ups import FollowUpScheduler
+from intent_detector import IntentDetector
+
+INTENT = "color_with_quantity"
+
+
+def test_follow_up_survives_restart(tmp_path):
+    snapshot = str(tmp_path / "follow_ups.json")
+    now = time.time()
+    scheduler = FollowUpScheduler(snapshot_path=snapshot)
+    scheduler.schedule("page-1", "user-1", INTENT, 60, now=now)
+    scheduler.schedule("page-1", "user-2", INTENT, 60, now=now)
+    assert scheduler.save()
+
+    # โปรเซสใหม่: context ในหน่วยความจำหายไปหมด
+    restarted = FollowUpScheduler(snapshot_path=snapshot)
+    assert restarted.load(now=now) == 2
+    restarted.cancel("page-1", "user-2")  # เช่นแอดมินตอบหลังเริ่มใหม่
+    due = restarted.due(now + 120)
+
+    assert [(timer['user_id'], timer['restored']) for timer in due] == [("user-1", True)]
+    detector = IntentDetector(openai_api_key="test-key", page_id="page-1")
+    follow_up = detector.follow_up_message("user-1", INTENT, due[0]['restored'])
+    assert follow_up['text'] == detector.follow_ups[INTENT]['message']
+
+
+def test_follow_up_skipped_when_state_changed():
+    detector = IntentDetector(openai_api_key="test-key", page_id="page-1")
+    assert detector.follow_up_message("user-1", INTENT) is None
+
+    detector._get_user_context("user-1")['last_intent'] = INTENT
+    assert detector.follow_up_message("user-1", INTENT)
+
+    detector.set_manual_mode("user-1", True)
+    assert detector.follow_up_message("user-1", INTENT, restored=True) is None
+
+    detector.set_manual_mode("user-1", False)
+    detector._get_user_context("user-1")['last_intent'] = "address_complete"
+    assert detector.follow_up_message("user-1", INTENT, restored=True) is None
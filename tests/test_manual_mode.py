@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["ORDER_DB_PATH"] = ""
+os.environ["FOLLOW_UP_SNAPSHOT"] = ""
+
+import main
+from intent_detector import IntentDetector
+
+
+def test_extend_manual_mode_keeps_longer_expiry():
+    detector = IntentDetector(openai_api_key="test-key")
+
+    assert detector.extend_manual_mode("user-1", 60)
+    first = detector.user_contexts["user-1"]['manual_until']
+    assert not detector.extend_manual_mode("user-1", 1800)
+    assert detector.user_contexts["user-1"]['manual_until'] > first
+
+    detector.set_manual_mode("user-2", True, expires_in=7200)
+    until = detector.user_contexts["user-2"]['manual_until']
+    detector.extend_manual_mode("user-2", 1800)
+    assert detector.user_contexts["user-2"]['manual_until'] == until
+
+
+def test_extend_manual_mode_after_expiry():
+    detector = IntentDetector(openai_api_key="test-key")
+    detector.set_manual_mode("user-1", True, expires_in=60)
+    detector.user_contexts["user-1"]['manual_until'] = time.time() - 1
+
+    assert detector.extend_manual_mode("user-1", 1800)
+    assert detector.get_manual_mode_status("user-1")
+
+
+def test_admin_echo_keeps_permanent_manual_mode():
+    detector = asyncio.run(main.get_detector_async(None))
+    detector.set_manual_mode("admin-user", True)
+
+    asyncio.run(main.handle_admin_reply("admin-user"))
+
+    assert detector.user_contexts["admin-user"]['manual_until'] is None
+    assert detector.get_manual_mode_status("admin-user")
+
+
+def test_admin_echo_starts_timed_manual_mode():
+    detector = asyncio.run(main.get_detector_async(None))
+
+    asyncio.run(main.handle_admin_reply("echo-user"))
+
+    manual_until = detector.user_contexts["echo-user"]['manual_until']
+    assert manual_until - time.time() == pytest.approx(main.ADMIN_REPLY_MANUAL_SECONDS, abs=5)
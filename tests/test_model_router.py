@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_router import ModelRouter
+
+
+def create_router(tmp_path) -> ModelRouter:
+    config = tmp_path / "model_routes.json"
+    config.write_text(json.dumps({"routes": {
+        "detect_intent": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "slow_ms": 1000},
+        "smart_fallback": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "slow_ms": 5000}
+    }}))
+    return ModelRouter(config_file=str(config))
+
+
+def test_slow_model_demoted_only_on_its_route(tmp_path):
+    router = create_router(tmp_path)
+    for _ in range(ModelRouter.MIN_SAMPLES):
+        router.record("smart_fallback", "gpt-4o-mini", 3000, ok=True, now=0)
+
+    # 3000ms ไม่ช้าสำหรับ smart_fallback และไม่นับรวมกับ detect_intent
+    assert router.candidates("smart_fallback", now=1)[0] == "gpt-4o-mini"
+    assert router.candidates("detect_intent", now=1)[0] == "gpt-4o-mini"
+
+    for _ in range(ModelRouter.MIN_SAMPLES):
+        router.record("detect_intent", "gpt-4o-mini", 3000, ok=True, now=0)
+
+    assert router.candidates("detect_intent", now=1) == ["gpt-3.5-turbo", "gpt-4o-mini"]
+    assert router.candidates("smart_fallback", now=1)[0] == "gpt-4o-mini"
+    assert router.stats(now=1)['models']['detect_intent']['gpt-4o-mini']['demoted_for_s'] > 0
+    assert router.stats(now=1)['models']['smart_fallback']['gpt-4o-mini']['demoted_for_s'] == 0
+
+
+def test_demoted_model_restored_after_cooldown(tmp_path):
+    router = create_router(tmp_path)
+    for _ in range(ModelRouter.MIN_SAMPLES):
+        router.record("detect_intent", "gpt-4o-mini", 100, ok=False, now=0)
+
+    assert router.candidates("detect_intent", now=1)[0] == "gpt-3.5-turbo"
+    assert router.candidates("detect_intent", now=router.cooldown + 1)[0] == "gpt-4o-mini"
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_detector import IntentDetector
+from page_registry import PageConfig, PageConversations, PageRegistry
+
+
+def create_detector(page: PageConfig, conversations: PageConversations) -> IntentDetector:
+    return IntentDetector(
+        openai_api_key="test-key",
+        page_id=page.page_id,
+        user_contexts=conversations.user_contexts,
+        context_index=conversations.context_index
+    )
+
+
+def test_manual_mode_survives_idle_eviction():
+    registry = PageRegistry(create_detector, config_file="missing-pages.json", idle_ttl=0)
+    detector = registry.get_detector()
+    detector.set_manual_mode("user-1", True, expires_in=1800)
+    detector._get_user_context("user-1")['order_info'] = {'color': 'ดำ', 'quantity': 2}
+
+    assert registry.evict_idle() == [PageRegistry.DEFAULT_PAGE_ID]
+    reloaded = registry.get_detector()
+
+    assert reloaded is not detector
+    assert reloaded.get_manual_mode_status("user-1")
+    assert reloaded.list_manual_mode_users()['total'] == 1
+    assert reloaded.user_contexts["user-1"]['order_info'] == {'color': 'ดำ', 'quantity': 2}
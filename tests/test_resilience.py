@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import ResilientCaller
+
+
+def slow(seconds: float, result: str = "ok"):
+    def fn():
+        time.sleep(seconds)
+        return result
+    return fn
+
+
+def test_deadline_starts_when_call_begins():
+    caller = ResilientCaller(concurrency=1)
+    busy = threading.Thread(target=caller.call, args=("busy", slow(0.3)))
+    busy.start()
+    time.sleep(0.05)
+
+    # รอคิว ~0.25s + ทำงาน 0.2s เกิน deadline 0.35s ถ้านับเวลารอคิวด้วย
+    assert caller.call("queued", slow(0.2), deadline=0.35) == "ok"
+    assert caller.metrics.percentile("queued.queue_ms", 50) > 100
+    busy.join()
+
+
+def test_timeout_cancels_calls_that_never_started():
+    caller = ResilientCaller(concurrency=1)
+    busy = threading.Thread(target=caller.call, args=("busy", slow(0.3)))
+    busy.start()
+    time.sleep(0.05)
+    ran = threading.Event()
+
+    with pytest.raises(TimeoutError):
+        caller.call("queued", lambda: ran.set(), deadline=0.1)
+
+    busy.join()
+    time.sleep(0.05)
+    assert not ran.is_set()
+    assert caller.metrics.counters["queued.deadline_exceeded"] == 1
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook_events import (ADMIN_ECHO, ATTACHMENT, BOT_ECHO, BOT_MESSAGE_METADATA, DELIVERY, OTHER, PAYLOAD,
+                            READ, STICKER, TEXT, classify_event, customer_id)
+
+APP_ID = "1234"
+
+
+def test_classify_customer_events():
+    assert classify_event({"message": {"text": "สนใจค่ะ"}}) == TEXT
+    assert classify_event({"message": {"text": "ดำ", "quick_reply": {"payload": "{}"}}}) == PAYLOAD
+    assert classify_event({"postback": {"payload": "GET_STARTED"}}) == PAYLOAD
+    assert classify_event({"message": {"sticker_id": 369239263222822, "attachments": [{}]}}) == STICKER
+    assert classify_event({"message": {"attachments": [{"type": "image"}]}}) == ATTACHMENT
+    assert classify_event({"message": {}}) == OTHER
+    assert classify_event({"delivery": {"watermark": 1}}) == DELIVERY
+    assert classify_event({"read": {"watermark": 1}}) == READ
+    assert classify_event({}) == OTHER
+
+
+def test_classify_echoes():
+    own = {"message": {"is_echo": True, "app_id": 1234, "text": "ได้รับรายการแล้วค่ะ"}}
+    tagged = {"message": {"is_echo": True, "metadata": BOT_MESSAGE_METADATA, "text": "ได้รับรายการแล้วค่ะ"}}
+    inbox = {"message": {"is_echo": True, "app_id": 263902037430900, "text": "แอดมินตอบเองค่ะ"}}
+
+    assert classify_event(own, APP_ID) == BOT_ECHO
+    assert classify_event(own) == ADMIN_ECHO  # ไม่ได้ตั้ง APP_ID และไม่มี metadata
+    assert classify_event(tagged) == BOT_ECHO
+    assert classify_event(inbox, APP_ID) == ADMIN_ECHO
+
+
+def test_customer_id_of_echo_is_recipient():
+    messaging = {"sender": {"id": "page"}, "recipient": {"id": "customer"}}
+    assert customer_id(messaging, ADMIN_ECHO) == "customer"
+    assert customer_id(messaging, TEXT) == "page"
@@ -0,0 +1,56 @@
+import re
+import unicodedata
+
+# ตัวเลขไทย -> ตัวเลขอารบิก
+_THAI_DIGITS = {ord(thai): str(digit) for digit, thai in enumerate("๐๑๒๓๔๕๖๗๘๙")}
+
+# ตัวอักษรเต็มความกว้าง (Ｍ, ＸＬ, ２) -> ASCII
+# ไม่ใช้ NFKC เพราะจะแยกสระอำ (ำ) เป็น ํ + า ทำให้คำไทยเทียบ keyword ไม่ตรง
+_FULL_WIDTH = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+_FULL_WIDTH[0x3000] = ord(' ')
+
+# อักขระที่มองไม่เห็น (zero-width space/joiner, BOM, soft hyphen, direction marks)
+_INVISIBLE = {ord(char): None for char in "\u200b\u200c\u200d\u200e\u200f\u2060\ufeff\u00ad"}
+
+_TRANSLATION = {**_THAI_DIGITS, **_FULL_WIDTH, **_INVISIBLE}
+
+# สระและวรรณยุกต์ไทยไม่มีทางซ้ำกันในคำปกติ (ค่าาาา -> ค่า, ค่ะะะ -> ค่ะ)
+_REPEATED_THAI_MARK = re.compile(r'([ะ-ฺๅ็-๎ั])\1+')
+# พยัญชนะซ้ำ 2 ตัวมีในคำปกติ (กรรม) จึงยุบเฉพาะที่ซ้ำ 3 ตัวขึ้นไป
+_REPEATED_THAI_CHAR = re.compile(r'([ก-ฯๆ])\1{2,}')
+_REPEATED_PUNCT = re.compile(r'([!?.~,])\1+')
+_SPACES = re.compile(r'[ \t\u00a0]+')
+_BLANK_LINES = re.compile(r'\s*\n\s*')
+
+
+def clean_text(text: str) -> str:
+    """แปลงเฉพาะส่วนที่ไม่เปลี่ยนเนื้อหา (NFC, อักขระที่มองไม่เห็น, ตัวเลขไทย/เต็มความกว้าง, ช่องว่างซ้ำ)
+
+    ใช้กับข้อมูลที่ต้องเก็บตามที่ลูกค้าพิมพ์ เช่น ชื่อและที่อยู่ (คงตัวพิมพ์ใหญ่และตัวอักษรซ้ำไว้)
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).translate(_TRANSLATION)
+    text = _SPACES.sub(' ', text)
+    text = _BLANK_LINES.sub('\n', text)
+    return text.strip()
+
+
+def normalize_text(text: str) -> str:
+    """แปลงข้อความลูกค้าเป็นรูปแบบมาตรฐานก่อนเทียบ keyword/regex และใช้เป็น key ของ cache
+
+    - NFC และลบอักขระที่มองไม่เห็น
+    - ตัวเลขไทยและตัวอักษรเต็มความกว้างเป็น ASCII
+    - "เเ" (สระเอสองตัว) เป็น "แ" และยุบตัวอักษร/เครื่องหมายที่พิมพ์ซ้ำ
+    - ช่องว่างซ้ำเหลือตัวเดียว และอักษรอังกฤษเป็นตัวพิมพ์เล็ก (ไซส์ให้เทียบด้วย .upper())
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).translate(_TRANSLATION)
+    text = text.replace("เเ", "แ")
+    text = _REPEATED_THAI_MARK.sub(r'\1', text)
+    text = _REPEATED_THAI_CHAR.sub(r'\1', text)
+    text = _REPEATED_PUNCT.sub(r'\1', text)
+    text = _SPACES.sub(' ', text)
+    text = _BLANK_LINES.sub('\n', text)
+    return text.strip().lower()
@@ -0,0 +1,261 @@
+import json
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple
+
+# คำบอกส่วนของที่อยู่ (เทียบกับข้อความที่ผ่าน normalize_text แล้ว จึงเป็นตัวพิมพ์เล็ก)
+ADDRESS_MARKERS = [
+    "บ้านเลขที่", "เลขที่", "หมู่ที่", "หมู่บ้าน", "หมู่", "ม.", "ซอย", "ซ.", "ถนน", "ถ.", "ตรอก",
+    "ตำบล", "ต.", "แขวง", "อำเภอ", "อ.", "เขต", "จังหวัด", "จ.", "คอนโด", "อาคาร", "ตึก", "ชั้น",
+    "ห้อง", "หอพัก", "อพาร์ทเม้นท์", "อพาร์ทเมนท์", "อพาร์ท", "โครงการ", "นิคม", "รหัสไปรษณีย์"
+]
+# marker ที่บอกว่าคำถัดไปคือชื่ออำเภอ/จังหวัด
+DISTRICT_MARKERS = {"อำเภอ", "อ.", "เขต"}
+PROVINCE_MARKERS = {"จังหวัด", "จ."}
+LABELS = ["tel:", "tel", "โทร.", "โทร", "เบอร์โทร", "เบอร์", "add:", "address:", "ที่อยู่", "ชื่อ", "ผู้รับ"]
+NAME_LABELS = {"ชื่อ", "ผู้รับ"}
+NAME_TITLES = ["นางสาว", "น.ส.", "นาย", "นาง", "คุณ", "mr.", "mrs.", "ms.", "miss", "ร้าน", "บริษัท", "ห้าง"]
+# คำที่ไม่ใช่ชื่อคน (คำลงท้าย/คำเชื่อม)
+NON_NAME_WORDS = {"ส่ง", "ส่งที่", "ที่", "ด้วย", "ให้", "หน่อย", "เลย", "ได้", "ตาม", "นี้", "นี่", "และ"}
+NON_NAME_PREFIXES = ("ขอบคุณ", "ส่ง", "ปลายทาง", "เก็บเงิน", "โอน", "รบกวน", "ได้", "สั่ง", "เอา")
+_THAI_TITLE_SPACE = re.compile(r'^(นางสาว|น\.ส\.|นาย|นาง|คุณ|ร้าน|บริษัท|ห้าง) ')
+_PARTICLE_SUFFIX = re.compile(r'(?:นะ)?(?:ค่ะ|คะ|ค่า|ครับ|จ้า|จ้ะ|นะ)$')
+
+_PHONE = r'(?<![\d/])(?:\+66\s?|0)\d(?:[-\s]?\d){7,8}(?![\d/])'
+_POSTCODE = r'(?<![\d/\-])[1-9]\d{4}(?![\d/\-])'
+_NUMBER = r'\d+(?:[/\-]\d+)*'
+_PUNCT = '()[],:;-."\''
+_ADDRESS_KINDS = ('postcode', 'number', 'marker')
+_PLACE_KINDS = ('province', 'district', 'marker')
+
+
+class _Trie:
+    """Trie ของชื่อจังหวัด/อำเภอ/คำบอกที่อยู่ แปลงเป็น regex ที่แยก prefix ร่วมกันไว้แล้ว"""
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def add(self, word: str) -> None:
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def pattern(self) -> str:
+        return self._pattern(self.root)
+
+    def _pattern(self, node: Dict[str, Any]) -> str:
+        # ทางเลือกยาวกว่าวางก่อน และส่วนท้ายที่เป็น optional ทำให้ได้ longest match เสมอ
+        branches = [re.escape(char) + self._pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return '(?:' + body + ')?'
+        return body
+
+
+class ThaiAddressParser:
+    """แยกชื่อ ที่อยู่ และเบอร์โทรจากข้อความในการสแกนครั้งเดียว
+
+    ทุก token (เบอร์โทร, รหัสไปรษณีย์, ตัวเลข, ชื่อจังหวัด/อำเภอ, คำบอกที่อยู่, ชื่อ) ถูกจับด้วย regex
+    ตัวเดียวที่ compile ไว้ล่วงหน้า ส่วนชื่อจังหวัดและอำเภอสร้างจาก trie ของ thai_address_data.json
+    """
+
+    def __init__(self, data_file: str = "thai_address_data.json"):
+        with open(data_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.ambiguous = set(data.get('ambiguous_names', []))
+        self.postcode_prefixes: Dict[str, List[str]] = {}
+        # คำ -> ('province'|'district'|'marker'|'label'|'title', [จังหวัดที่เกี่ยวข้อง])
+        self.lexicon: Dict[str, Tuple[str, List[str]]] = {}
+        for province, info in data['provinces'].items():
+            self.postcode_prefixes[province] = info['postcode_prefixes']
+            for name in [province] + info.get('aliases', []):
+                self.lexicon[name.lower()] = ('province', [province])
+            for district in info.get('districts', []):
+                kind, provinces = self.lexicon.get(district, ('district', []))
+                if kind == 'district':
+                    self.lexicon[district] = ('district', provinces + [province])
+        for kind, words in (('marker', ADDRESS_MARKERS), ('label', LABELS), ('title', NAME_TITLES)):
+            for word in words:
+                self.lexicon.setdefault(word, (kind, []))
+
+        trie = _Trie()
+        for word in self.lexicon:
+            trie.add(word)
+        lexicon_pattern = trie.pattern()
+        self._token = re.compile(
+            rf'(?P<phone>{_PHONE})|(?P<postcode>{_POSTCODE})|(?P<number>{_NUMBER})'
+            rf'|(?P<word>{lexicon_pattern})|(?P<space>[\s()\[\],;:"]+)|(?P<text>(?:(?!{lexicon_pattern})[^\s\d])+)'
+        )
+
+    def _tokenize(self, message: str) -> List[Tuple[str, str, int, int, List[str]]]:
+        """แบ่งข้อความเป็น token (kind, value, start, end, provinces) ในการสแกนครั้งเดียว"""
+        tokens = []
+        at_word_start = True
+        previous_kind = None
+        for match in self._token.finditer(message):
+            group, value = match.lastgroup, match.group()
+            if group == 'space':  # ช่องว่างและวงเล็บ/จุลภาคถือเป็นตัวคั่นคำ
+                at_word_start = True
+                continue
+            kind, provinces = group, []
+            if group == 'word':
+                kind, provinces = self.lexicon[value]
+                # ชื่อสถานที่/คำนำหน้าชื่อต้องขึ้นต้นคำ (กัน "มะพร้าว", "ขอบคุณ") ยกเว้นต่อท้ายคำบอกที่อยู่
+                if not at_word_start and not (kind in _PLACE_KINDS and previous_kind in _ADDRESS_KINDS):
+                    kind = 'text'
+            # ชื่อสถานที่ที่มีคำอื่นต่อท้ายติดกันเป็นแค่ส่วนหน้าของชื่ออื่น ("บางรัก" ใน "บางรักน้อย")
+            if kind == 'text' and not at_word_start and tokens and tokens[-1][0] in ('text', 'province', 'district'):
+                last = tokens[-1]
+                tokens[-1] = ('text', last[1] + value, last[2], match.end(), last[4])
+            else:
+                tokens.append((kind, value, match.start(), match.end(), provinces))
+            previous_kind = kind
+            at_word_start = False
+        return tokens
+
+    @staticmethod
+    def _name_word(kind: str, value: str) -> str:
+        """คำที่น่าจะเป็นชื่อ (ตัดเครื่องหมายและคำลงท้าย) หรือ '' ถ้าไม่ใช่"""
+        if kind == 'title':
+            return value
+        if kind != 'text':
+            return ''
+        word = _PARTICLE_SUFFIX.sub('', value.strip(_PUNCT)).strip(_PUNCT)
+        if len(word) < 2 or word in NON_NAME_WORDS or word.startswith(NON_NAME_PREFIXES):
+            return ''
+        return word
+
+    def parse(self, message: str) -> Dict[str, Any]:
+        """วิเคราะห์ข้อความ คืน dict รูปแบบเดียวกับ IntentDetector._analyze_address พร้อมจังหวัด/อำเภอ/รหัสไปรษณีย์
+
+        เทียบคำกับข้อความตัวพิมพ์เล็ก แต่ชื่อและที่อยู่ที่คืนตัดจากข้อความเดิม (คงตัวพิมพ์ใหญ่ตามที่ลูกค้าพิมพ์)
+        """
+        result = {
+            'has_name': False,
+            'has_address': False,
+            'has_phone': False,
+            'extracted_name': '',
+            'extracted_address': '',
+            'extracted_phone': '',
+            'province': '',
+            'district': '',
+            'postcode': '',
+            'address_issue': ''
+        }
+        lowered = message.lower()
+        if len(lowered) != len(message):  # อักษรบางตัวเปลี่ยนความยาวเมื่อเป็นตัวพิมพ์เล็ก ตำแหน่งจะไม่ตรงกัน
+            message = lowered
+        tokens = self._tokenize(lowered)
+
+        def name_word(kind: str, value: str, start: int) -> str:
+            """คำที่เป็นชื่อ ตัดจากข้อความเดิมที่ตำแหน่งเดียวกัน"""
+            word = self._name_word(kind, value)
+            offset = value.find(word) if word else -1
+            return message[start + offset:start + offset + len(word)] if word else ''
+
+        address_start = address_end = None
+        has_house_number = False
+        provinces: List[str] = []
+        name_words: List[str] = []
+        name_labelled = False  # ได้ชื่อจากคำนำหน้า/ป้าย "ชื่อ" แล้ว
+        collecting = False  # กำลังเก็บชื่อต่อจากคำนำหน้า/ป้าย "ชื่อ"
+        previous = ''
+
+        for kind, value, start, end, token_provinces in tokens:
+            is_address_part = kind in _ADDRESS_KINDS
+            if kind == 'phone':
+                collecting = False
+                if not result['has_phone']:
+                    result['has_phone'] = True
+                    digits = re.sub(r'\D', '', value)
+                    result['extracted_phone'] = '0' + digits[2:] if value.startswith('+66') else digits
+            elif kind in ('title', 'label'):
+                collecting = (kind == 'title' or value in NAME_LABELS) and not name_labelled
+                if collecting:
+                    name_words = [message[start:end]] if kind == 'title' else []
+                    name_labelled = True
+            elif kind == 'province':
+                # ชื่อจังหวัดที่เป็นคำทั่วไปด้วย (เช่น "เลย") ต้องตามหลัง จ./จังหวัด
+                if value not in self.ambiguous or previous in PROVINCE_MARKERS:
+                    provinces = token_provinces
+                    result['province'] = provinces[0]
+                    is_address_part = True
+            elif kind == 'district':
+                if value not in self.ambiguous or previous in DISTRICT_MARKERS:
+                    result['district'] = value
+                    if not provinces and len(token_provinces) == 1:
+                        provinces = token_provinces
+                        result['province'] = provinces[0]
+                    is_address_part = True
+            elif kind == 'postcode':
+                result['postcode'] = value
+
+            if is_address_part:
+                collecting = False
+                has_house_number = has_house_number or kind == 'number'
+                if address_start is None:
+                    address_start = start
+                address_end = end
+            elif kind not in ('title', 'label') and len(name_words) < 3 \
+                    and (collecting or (address_start is None and not name_labelled)):
+                word = name_word(kind, value, start)
+                if word:
+                    name_words.append(word)
+            previous = value
+
+        # ชื่ออยู่หลังที่อยู่ (เช่น "... 10110 สมศรี ใจดี 08x") ใช้คำถัดจากส่วนสุดท้ายของที่อยู่
+        if not [word for word in name_words if word.lower() not in NAME_TITLES] and address_end is not None:
+            name_words = []
+            for kind, value, start, end, _ in tokens:
+                if start < address_end:
+                    continue
+                if kind in ('phone', 'label') or len(name_words) == 3:
+                    break
+                word = name_word(kind, value, start)
+                if word:
+                    name_words.append(word)
+
+        if [word for word in name_words if word.lower() not in NAME_TITLES]:
+            result['has_name'] = True
+            # คำนำหน้าชื่อภาษาไทยเขียนติดกับชื่อ (นายสมชาย, คุณแพร)
+            result['extracted_name'] = _THAI_TITLE_SPACE.sub(r'\1', ' '.join(name_words))
+
+        if address_start is not None:
+            # ตัดเบอร์โทรและป้ายกำกับที่อยู่ระหว่างกลางออก คงช่องว่างเดิมไว้
+            parts, cursor = [], address_start
+            for kind, value, start, end, _ in tokens:
+                if address_start <= start < address_end and kind in ('phone', 'label'):
+                    parts.append(message[cursor:start])
+                    cursor = end
+            parts.append(message[cursor:address_end])
+            result['extracted_address'] = ' '.join(''.join(parts).split())
+
+        # ที่อยู่ที่ส่งของได้: มีบ้านเลขที่/หมู่/ซอย/ถนน และรู้จังหวัดหรือรหัสไปรษณีย์ที่สอดคล้องกัน
+        postcode = result['postcode']
+        if postcode and not provinces:
+            provinces = [p for p, prefixes in self.postcode_prefixes.items() if postcode[:2] in prefixes]
+            if provinces:
+                result['province'] = provinces[0]
+            else:
+                result['address_issue'] = 'unknown_postcode'
+        elif postcode and not any(postcode[:2] in self.postcode_prefixes[p] for p in provinces):
+            result['address_issue'] = 'postcode_mismatch'
+
+        if not has_house_number and address_start is not None:
+            result['address_issue'] = result['address_issue'] or 'missing_house_number'
+        elif address_start is not None and not provinces:
+            result['address_issue'] = result['address_issue'] or 'missing_province'
+
+        result['has_address'] = address_start is not None and has_house_number and bool(provinces) \
+            and not result['address_issue']
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_address_parser(data_file: str = "thai_address_data.json") -> ThaiAddressParser:
+    """parser ใช้ร่วมกันทุก detector (ข้อมูลจังหวัดไม่เปลี่ยนระหว่างรัน)"""
+    return ThaiAddressParser(data_file)
@@ -0,0 +1,159 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List
+
+from metrics import Metrics
+
+
+def _new_window() -> Dict[str, Any]:
+    return {'prompt_tokens': 0, 'completion_tokens': 0, 'calls': 0, 'by_call_site': {}, 'by_intent': {}}
+
+
+def _copy_window(window: Dict[str, Any]) -> Dict[str, Any]:
+    return {**window, 'by_call_site': dict(window['by_call_site']), 'by_intent': dict(window['by_intent'])}
+
+
+def _add(counter: Dict[str, int], key: str, tokens: int) -> None:
+    counter[key] = counter.get(key, 0) + tokens
+
+
+def _add_usage(window: Dict[str, Any], call_site: str, intent: str, prompt_tokens: int, completion_tokens: int) -> None:
+    window['prompt_tokens'] += prompt_tokens
+    window['completion_tokens'] += completion_tokens
+    window['calls'] += 1
+    _add(window['by_call_site'], call_site, prompt_tokens + completion_tokens)
+    _add(window['by_intent'], intent, prompt_tokens + completion_tokens)
+
+
+class TokenBudget:
+    """นับ token ที่ใช้กับ OpenAI แยกตาม call site, intent, user และช่วงเวลา (รายชั่วโมง/รายวัน)
+    และเลือกโหมดการทำงานตามงบที่เหลือ
+
+    - normal: ทำงานปกติ
+    - economy: ใช้ไปถึง economy_at ของงบแล้ว ตัดข้อมูลธุรกิจและประวัติการสนทนาใน prompt ให้สั้นลง
+    - static: ใช้ครบงบแล้ว นอกจาก economy ยังตอบ static fallback แทนการเรียก smart fallback
+
+    งบเป็น 0 = ไม่จำกัด (นับอย่างเดียว)
+
+    งานที่ไม่ใช่ลูกค้าจริง (เช่น batch classify) บันทึกด้วย governed=False: นับแยกเป็นรายวัน
+    ไม่นับรวมในงบ ไม่ทำให้เปลี่ยนโหมด และไม่อยู่ใน top_users_today
+    """
+
+    NORMAL = "normal"
+    ECONOMY = "economy"
+    STATIC = "static"
+
+    def __init__(self, daily_budget: int = 0, hourly_budget: int = 0, economy_at: float = 0.8,
+                 keep_hours: int = 48, keep_days: int = 7, metrics: Metrics = None):
+        self.daily_budget = daily_budget
+        self.hourly_budget = hourly_budget
+        self.economy_at = economy_at
+        self.keep_hours = keep_hours
+        self.keep_days = keep_days
+        self.metrics = metrics or Metrics()
+        self._hours: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._days: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._ungoverned_days: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._users: Dict[str, int] = {}  # token ต่อ user ของวันปัจจุบัน
+        self._users_day = ''
+        self._mode = self.NORMAL
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(now: float):
+        local = time.localtime(now)
+        return time.strftime("%Y-%m-%d %H:00", local), time.strftime("%Y-%m-%d", local)
+
+    @staticmethod
+    def _window(windows: "OrderedDict[str, Dict[str, Any]]", key: str, keep: int) -> Dict[str, Any]:
+        window = windows.get(key)
+        if window is None:
+            window = windows[key] = _new_window()
+            while len(windows) > keep:
+                windows.popitem(last=False)
+        return window
+
+    def record(self, call_site: str, prompt_tokens: int, completion_tokens: int, intent: str = '',
+               user_id: str = '', now: float = None, governed: bool = True) -> None:
+        """บันทึก usage ของการเรียก OpenAI หนึ่งครั้ง (governed=False = นับแยก ไม่ใช้คุมงบ)"""
+        now = now if now is not None else time.time()
+        hour_key, day_key = self._keys(now)
+        tokens = prompt_tokens + completion_tokens
+        intent = intent or 'unknown'
+        if not governed:
+            with self._lock:
+                _add_usage(self._window(self._ungoverned_days, day_key, self.keep_days),
+                           call_site, intent, prompt_tokens, completion_tokens)
+            self.metrics.incr("token_budget.ungoverned_tokens", tokens)
+            return
+        with self._lock:
+            for window in (self._window(self._hours, hour_key, self.keep_hours),
+                           self._window(self._days, day_key, self.keep_days)):
+                _add_usage(window, call_site, intent, prompt_tokens, completion_tokens)
+            if user_id:
+                if self._users_day != day_key:
+                    self._users, self._users_day = {}, day_key
+                _add(self._users, user_id, tokens)
+        self.metrics.incr("token_budget.tokens", tokens)
+        self.mode(now)
+
+    def _spent(self, windows: "OrderedDict[str, Dict[str, Any]]", key: str) -> int:
+        window = windows.get(key)
+        return window['prompt_tokens'] + window['completion_tokens'] if window else 0
+
+    def usage_ratio(self, now: float = None) -> float:
+        """สัดส่วนงบที่ใช้ไปแล้ว (ค่าที่สูงกว่าระหว่างงบรายชั่วโมงกับรายวัน)"""
+        hour_key, day_key = self._keys(now if now is not None else time.time())
+        ratio = 0.0
+        with self._lock:
+            if self.hourly_budget:
+                ratio = max(ratio, self._spent(self._hours, hour_key) / self.hourly_budget)
+            if self.daily_budget:
+                ratio = max(ratio, self._spent(self._days, day_key) / self.daily_budget)
+        return ratio
+
+    def mode(self, now: float = None) -> str:
+        """โหมดปัจจุบันตามงบที่ใช้ไป (เริ่มชั่วโมง/วันใหม่จะกลับเป็น normal เอง)"""
+        if not (self.hourly_budget or self.daily_budget):
+            return self.NORMAL
+        ratio = self.usage_ratio(now)
+        if ratio >= 1.0:
+            mode = self.STATIC
+        elif ratio >= self.economy_at:
+            mode = self.ECONOMY
+        else:
+            mode = self.NORMAL
+        if mode != self._mode:
+            print(f"Token budget mode: {self._mode} -> {mode} ({ratio:.0%} of budget used)")
+            self._mode = mode
+            self.metrics.incr(f"token_budget.mode.{mode}")
+            self.metrics.set_gauge("token_budget.mode", mode)
+        return mode
+
+    def snapshot(self, top: int = 10, now: float = None) -> Dict[str, Any]:
+        """สรุปการใช้ token สำหรับ admin endpoint"""
+        now = now if now is not None else time.time()
+        hour_key, day_key = self._keys(now)
+        mode = self.mode(now)
+        with self._lock:
+            hours: List[Dict[str, Any]] = [
+                {'hour': key, 'tokens': window['prompt_tokens'] + window['completion_tokens'], 'calls': window['calls']}
+                for key, window in self._hours.items()
+            ]
+            current_hour = _copy_window(self._hours.get(hour_key) or _new_window())
+            today = _copy_window(self._days.get(day_key) or _new_window())
+            ungoverned_today = _copy_window(self._ungoverned_days.get(day_key) or _new_window())
+            users = self._users if self._users_day == day_key else {}
+            top_users = heapq.nlargest(top, users.items(), key=lambda item: item[1])
+        return {
+            'mode': mode,
+            'usage_ratio': round(self.usage_ratio(now), 3),
+            'budget': {'hourly': self.hourly_budget, 'daily': self.daily_budget, 'economy_at': self.economy_at},
+            'current_hour': {'hour': hour_key, **current_hour},
+            'today': {'date': day_key, **today},
+            'ungoverned_today': {'date': day_key, **ungoverned_today},
+            'top_users_today': [{'user_id': user_id, 'tokens': tokens} for user_id, tokens in top_users],
+            'hours': hours
+        }
@@ -0,0 +1,56 @@
+from typing import Dict, Any, Optional
+
+# ประเภทของ messaging event จาก webhook
+TEXT = "text"
+PAYLOAD = "payload"  # กดปุ่ม quick reply / postback
+BOT_ECHO = "bot_echo"  # ข้อความที่บอทส่งเอง สะท้อนกลับมา (message_echoes)
+ADMIN_ECHO = "admin_echo"  # แอดมินตอบลูกค้าเองผ่าน inbox ของเพจ
+DELIVERY = "delivery"
+READ = "read"
+REACTION = "reaction"
+STICKER = "sticker"  # สติกเกอร์/ปุ่มไลก์อย่างเดียว
+ATTACHMENT = "attachment"  # รูป/ไฟล์/เสียงที่ไม่มีข้อความ
+OTHER = "other"
+
+# ประเภทที่ต้องประมวลผลต่อ ประเภทอื่นทิ้งได้ทันที
+ACTIONABLE = (TEXT, PAYLOAD, ADMIN_ECHO)
+
+# ใส่ใน metadata ของข้อความที่บอทส่ง ใช้แยก echo ของบอทออกจากของแอดมินเมื่อไม่ได้ตั้ง APP_ID
+BOT_MESSAGE_METADATA = "chatbot"
+
+
+def classify_event(messaging: Dict[str, Any], app_id: Optional[str] = None) -> str:
+    """ประเภทของ messaging event หนึ่งรายการ (ดูแค่ key ที่มี ไม่แตะเนื้อหาข้อความ)
+
+    echo ที่มาจาก app_id ของเรา หรือมี metadata ที่บอทใส่ไว้ คือข้อความของบอทเอง
+    echo อื่นๆ (ไม่มี app_id หรือเป็น app ของ Page inbox) คือแอดมินตอบเอง
+    """
+    message = messaging.get("message")
+    if message is not None:
+        if message.get("is_echo"):
+            own_app = app_id is not None and str(message.get("app_id")) == str(app_id)
+            return BOT_ECHO if own_app or message.get("metadata") == BOT_MESSAGE_METADATA else ADMIN_ECHO
+        if "quick_reply" in message:
+            return PAYLOAD
+        if "sticker_id" in message:
+            return STICKER
+        if message.get("text"):
+            return TEXT
+        if message.get("attachments"):
+            return ATTACHMENT
+        return OTHER
+    if "postback" in messaging:
+        return PAYLOAD
+    if "delivery" in messaging:
+        return DELIVERY
+    if "read" in messaging:
+        return READ
+    if "reaction" in messaging:
+        return REACTION
+    return OTHER
+
+
+def customer_id(messaging: Dict[str, Any], kind: str) -> Optional[str]:
+    """user ID ของลูกค้าในบทสนทนา (echo: ลูกค้าคือผู้รับ, event อื่น: ลูกค้าคือผู้ส่ง)"""
+    party = messaging.get("recipient" if kind in (BOT_ECHO, ADMIN_ECHO) else "sender") or {}
+    return party.get("id")